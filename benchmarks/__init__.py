@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# the in-memory KVS stand-in is a test helper that the benchmarks share
+tests_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests')
+if tests_dir not in sys.path:
+    sys.path.append(tests_dir)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import json
+import argparse
+
+from benchmarks import publish
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmark each stage of the publish hot path.')
+    parser.add_argument('--areas', type=int, default=10)
+    parser.add_argument('--shelters', type=int, default=0)
+    parser.add_argument('--body-length', type=int, default=100)
+    parser.add_argument('--variant', type=int, choices=[3, 4], default=3)
+    parser.add_argument('--codec', default='json')
+    parser.add_argument('--validation', default='full',
+                        choices=['full', 'envelope', 'sampled'])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--compare', metavar='RESULT',
+                        help='saved result to compare with')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+
+    options = {'areas': args.areas, 'shelters': args.shelters,
+               'body_length': args.body_length, 'variant': args.variant}
+    report = publish.report(options, args.iterations, args.warmup, args.codec,
+                            args.validation)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print('{0} ({1} bytes)'.format(
+        ', '.join('{0}={1}'.format(k, v) for k, v in sorted(options.items())),
+        report['options']['bytes']))
+    print(publish.format_report(report, baseline))
+    if not args.no_save:
+        print('saved to {0}'.format(publish.save(report)))
+
+
+if __name__ == '__main__':
+    main()
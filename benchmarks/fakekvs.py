@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import random
+import socket
+import argparse
+import urlparse
+
+from publiccommons.pool import ConnectionPool
+from publiccommons.writebehind import bulk_upsert
+from memorykvs import MemoryKVS
+
+
+class FakeKVSApplication(object):
+    def __init__(self, kvs=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 stall_rate=0.0, stall=0.0, seed=None):
+        self.kvs = kvs or MemoryKVS()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.random = random.Random(seed)
+
+    def __call__(self, environ, start_response):
+        # any base path, so that it can stand in for a base_url with a path
+        name = environ.get('PATH_INFO', '').rpartition('/')[2]
+        method = {'search': self.kvs.search, 'set': self.kvs.set}.get(name)
+        if method is None or environ['REQUEST_METHOD'] != 'POST':
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return []
+
+        length = int(environ.get('CONTENT_LENGTH') or '0')
+        payload = json.loads(environ['wsgi.input'].read(length))
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if self.random.random() < self.stall_rate:
+            # long enough to run into harakiri in the application
+            delay += self.stall
+        if delay:
+            time.sleep(delay)
+
+        if self.random.random() < self.error_rate:
+            start_response('500 Internal Server Error',
+                           [('Content-Length', '0')])
+            return []
+
+        body = json.dumps(method(payload) or {})
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class FakeKVSClient(object):
+    def __init__(self, base_url, timeout=5.0, pool_size=10):
+        url = urlparse.urlsplit(base_url)
+        self.path = url.path.rstrip('/')
+        self.pool = ConnectionPool(url.scheme, url.hostname, url.port,
+                                   size=pool_size, timeout=timeout)
+
+    def _call(self, path, payload):
+        res, data = self.pool.request(
+            'POST', self.path + path, json.dumps(payload),
+            {'Content-Type': 'application/json'})
+        if res.status != 200:
+            raise IOError('{0} {1}'.format(res.status, res.reason))
+        return json.loads(data)
+
+    def search(self, conditions):
+        return self._call('/search', conditions)
+
+    def set(self, records):
+        return self._call('/set', records)
+
+    def upsert(self, data, key, cmp=None):
+        return bulk_upsert(self, [(data, key, cmp)])
+
+
+def serve(listen, latency=0.0, **kwargs):
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+    from gevent.pywsgi import WSGIServer, WSGIHandler
+
+    class Handler(WSGIHandler):
+        def handle(self):
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return WSGIHandler.handle(self)
+
+    host, _, port = listen.rpartition(':')
+    application = FakeKVSApplication(latency=latency, **kwargs)
+    WSGIServer((host, int(port)), application, handler_class=Handler,
+               log=None).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.fakekvs',
+        description='In-memory KVS over HTTP with simulated latency, '
+                    'errors and stalls.')
+    parser.add_argument('--listen', default='127.0.0.1:7790')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many seconds more, uniformly')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of calls answered with 500')
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help='fraction of calls delayed by --stall')
+    parser.add_argument('--stall', type=float, default=60.0,
+                        help='seconds a stalled call takes')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    serve(args.listen, args.latency, jitter=args.jitter,
+          error_rate=args.error_rate, stall_rate=args.stall_rate,
+          stall=args.stall, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
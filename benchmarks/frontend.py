@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+from benchmarks.publish import summarize
+
+MODES = ['sync', 'evented']
+
+
+def build_app(mode, kvs_url):
+    from publiccommons import soap
+    from benchmarks.fakekvs import FakeKVSClient
+
+    application = soap.get_app(FakeKVSClient(kvs_url, pool_size=1000))
+    if mode == 'evented':
+        from publiccommons.evented import EventedApplication
+        return EventedApplication(application)
+
+    from publiccommons.stream import StreamingApplication
+    return StreamingApplication(application)
+
+
+def serve(mode, listen, kvs_url):
+    host, _, port = listen.rpartition(':')
+    if mode == 'evented':
+        from gevent import monkey
+        monkey.patch_all(thread=False)
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+        WSGIServer((host, int(port)), build_app(mode, kvs_url),
+                   spawn=Pool(1000), log=None).serve_forever()
+    else:
+        from wsgiref.simple_server import (make_server, WSGIServer,
+                                           WSGIRequestHandler)
+
+        class Server(WSGIServer):
+            request_queue_size = 1024
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        make_server(host, int(port), build_app(mode, kvs_url),
+                    server_class=Server,
+                    handler_class=QuietHandler).serve_forever()
+
+
+def wait_for(listen, timeout=10.0):
+    host, _, port = listen.rpartition(':')
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, int(port)), 0.5).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('{0} did not start'.format(listen))
+
+
+def load(listen, messages, concurrency):
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+    import gevent.pool
+    import httplib
+
+    host, _, port = listen.rpartition(':')
+    samples = []
+    errors = [0]
+
+    def post(body):
+        started = time.time()
+        conn = httplib.HTTPConnection(host, int(port), timeout=60)
+        try:
+            conn.request('POST', '/', body,
+                         {'Content-Type': 'text/xml; charset=utf-8'})
+            res = conn.getresponse()
+            res.read()
+            if res.status != 200:
+                errors[0] += 1
+        except (IOError, httplib.HTTPException):
+            errors[0] += 1
+        finally:
+            conn.close()
+        samples.append(time.time() - started)
+
+    pool = gevent.pool.Pool(concurrency)
+    started = time.time()
+    for body in messages:
+        pool.spawn(post, body)
+    pool.join()
+    elapsed = time.time() - started
+
+    result = summarize(samples)
+    result.update(throughput=len(samples) / elapsed, errors=errors[0])
+    return result
+
+
+def run(mode, requests, concurrency, latency, port=7791):
+    from benchmarks.synthetic import stream
+
+    kvs_listen = '127.0.0.1:{0}'.format(port + 1)
+    app_listen = '127.0.0.1:{0}'.format(port)
+    children = [
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.fakekvs',
+                          '--listen', kvs_listen, '--latency', str(latency)]),
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.frontend',
+                          'serve', '--mode', mode, '--listen', app_listen,
+                          '--kvs', 'http://' + kvs_listen])
+    ]
+    try:
+        wait_for(kvs_listen)
+        wait_for(app_listen)
+        return load(app_listen, list(stream(requests)), concurrency)
+    finally:
+        for child in children:
+            child.terminate()
+            child.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.frontend',
+        description='Compare publish throughput of the blocking and the '
+                    'evented front end against a fake KVS.')
+    sub = parser.add_subparsers(dest='command')
+
+    bench = sub.add_parser('run')
+    bench.add_argument('--mode', choices=MODES, action='append')
+    bench.add_argument('--requests', type=int, default=500)
+    bench.add_argument('--concurrency', type=int, default=100)
+    bench.add_argument('--latency', type=float, default=0.02,
+                       help='seconds the fake KVS adds to every call')
+
+    server = sub.add_parser('serve')
+    server.add_argument('--mode', choices=MODES, default='sync')
+    server.add_argument('--listen', default='127.0.0.1:7791')
+    server.add_argument('--kvs', default='http://127.0.0.1:7792')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        return serve(args.mode, args.listen, args.kvs)
+
+    print('{0:<8} {1:>10} {2:>10} {3:>10} {4:>7}'.format(
+        'mode', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for mode in args.mode or MODES:
+        r = run(mode, args.requests, args.concurrency, args.latency)
+        print('{0:<8} {1:>10.1f} {2:>10.1f} {3:>10.1f} {4:>7}'.format(
+            mode, r['throughput'], r['p50_us'] / 1000, r['p99_us'] / 1000,
+            r['errors']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import errno
+import socket
+import argparse
+import itertools
+import urlparse
+
+from benchmarks.publish import summarize, percentile
+
+SOAP_HEADERS = {'Content-Type': 'text/xml; charset=utf-8'}
+
+
+def read_archive(path):
+    with gzip.open(path, 'rb') as f:
+        while True:
+            header = f.readline()
+            if not header:
+                return
+            meta = json.loads(header)
+            if meta.get('truncated') and 'size' not in meta:
+                # archives written before size was recorded: nothing after a
+                # truncated body can be located
+                sys.stderr.write('{0}: stop at a truncated body\n'.format(path))
+                return
+            body = f.read(meta.get('size', meta['length']))
+            f.read(1)
+            if not meta.get('truncated'):
+                yield body
+
+
+def load_messages(sources, count=1000, seed=0):
+    if not sources:
+        from benchmarks.synthetic import stream
+        return list(stream(count, seed))
+
+    messages = []
+    for source in sources:
+        paths = [source]
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, 'body-*.gz')))
+        for path in paths:
+            if path.endswith('.gz'):
+                messages.extend(read_archive(path))
+            else:
+                with open(path, 'rb') as f:
+                    messages.append(f.read())
+    return messages
+
+
+def rss(pid):
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return 0
+
+
+def children(pid):
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+            return [int(p) for p in f.read().split()]
+    except IOError:
+        return []
+
+
+class Window(object):
+    def __init__(self):
+        self.samples = []
+        self.errors = {}
+        self.shed = 0
+
+    def record(self, elapsed, error):
+        self.samples.append(elapsed)
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+
+class LoadTest(object):
+    def __init__(self, url, messages, concurrency=100, timeout=60.0,
+                 pids=(), master=None):
+        url = urlparse.urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path or '/'
+        self.messages = itertools.cycle(messages)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.pids = list(pids)
+        self.master = master
+        self.workers = set()
+        self.respawns = 0
+        self.samples = []
+        self.window = Window()
+
+    def post(self, body):
+        import httplib
+
+        error = None
+        started = time.time()
+        conn = httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+        try:
+            conn.request('POST', self.path, body, SOAP_HEADERS)
+            res = conn.getresponse()
+            data = res.read()
+            if res.status != 200:
+                error = str(res.status)
+            elif b':Fault>' in data:
+                error = 'fault'
+        except socket.timeout:
+            error = 'timeout'
+        except (httplib.BadStatusLine, httplib.IncompleteRead):
+            # what a client sees when harakiri kills the worker mid-request
+            error = 'reset'
+        except socket.error as e:
+            error = 'reset' if e.errno in (errno.ECONNRESET, errno.EPIPE) \
+                else 'connect'
+        finally:
+            conn.close()
+        elapsed = time.time() - started
+        self.samples.append(elapsed)
+        self.window.record(elapsed, error)
+
+    def memory(self):
+        pids = list(self.pids)
+        if self.master is not None:
+            workers = set(children(self.master))
+            if self.workers:
+                self.respawns += len(workers - self.workers)
+            self.workers = workers
+            pids += [self.master] + sorted(workers)
+        return sum(rss(pid) for pid in pids)
+
+    def run(self, rate, duration, interval=5.0, ramp=0.0, out=sys.stdout):
+        from gevent import sleep
+        from gevent.pool import Pool
+
+        pool = Pool(self.concurrency)
+        windows = []
+        started = next_send = last = time.time()
+        next_window = started + interval
+        while True:
+            now = time.time()
+            if now >= next_window or now - started >= duration:
+                window, self.window = self.window, Window()
+                windows.append(self.report(window, rate, now - started,
+                                           now - last, out))
+                last = now
+                next_window += interval
+                rate += ramp
+                if now - started >= duration:
+                    break
+
+            if next_send > now:
+                sleep(min(next_send, next_window) - now)
+                continue
+
+            if pool.full():
+                # open loop: requests the client could not even start count
+                # against the target instead of slowing the offered rate
+                self.window.shed += 1
+            else:
+                pool.spawn(self.post, next(self.messages))
+            next_send += 1.0 / rate
+
+        pool.join(timeout=self.timeout)
+        # requests still in flight at the end belong to the last window
+        if windows:
+            row = windows[-1]
+            row['completed'] += len(self.window.samples)
+            for error, count in self.window.errors.items():
+                row['errors'][error] = row['errors'].get(error, 0) + count
+        return windows
+
+    def report(self, window, rate, elapsed, interval, out):
+        row = {
+            'elapsed': elapsed,
+            'offered': rate,
+            'completed': len(window.samples),
+            'throughput': len(window.samples) / interval,
+            'errors': window.errors,
+            'shed': window.shed,
+            'rss': self.memory(),
+            'workers': len(self.workers),
+            'respawns': self.respawns
+        }
+        if window.samples:
+            row['p50_ms'] = percentile(window.samples, 50) * 1000
+            row['p99_ms'] = percentile(window.samples, 99) * 1000
+        out.write('{0:>7.0f}s {1:>7.1f} {2:>8.1f} {3:>8.1f} {4:>8.1f} '
+                  '{5:>6} {6:>5} {7:>9.1f} {8:>4}\n'.format(
+                      elapsed, rate, row['throughput'], row.get('p50_ms', 0),
+                      row.get('p99_ms', 0), sum(window.errors.values()),
+                      window.shed, row['rss'] / 1048576.0, self.respawns))
+        out.flush()
+        return row
+
+
+def summary(windows, samples):
+    errors = {}
+    for w in windows:
+        for k, v in w['errors'].items():
+            errors[k] = errors.get(k, 0) + v
+    completed = sum(w['completed'] for w in windows)
+    elapsed = windows[-1]['elapsed'] if windows else 0
+    result = {
+        'completed': completed,
+        'throughput': completed / elapsed if elapsed else 0,
+        'errors': errors,
+        'shed': sum(w['shed'] for w in windows),
+        'respawns': windows[-1]['respawns'] if windows else 0,
+        'peak_throughput': max([w['throughput'] for w in windows] or [0])
+    }
+    if samples:
+        latency = summarize(samples)
+        result.update((k.replace('_us', '_ms'), latency[k] / 1000)
+                      for k in ('p50_us', 'p90_us', 'p99_us', 'max_us'))
+    rss = [w['rss'] for w in windows if w['rss']]
+    if len(rss) > 1:
+        # growth between the first and the last window, per hour of soak
+        result['rss_growth_mb_per_hour'] = (rss[-1] - rss[0]) / 1048576.0 / (
+            (windows[-1]['elapsed'] - windows[0]['elapsed']) / 3600.0)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.loadtest',
+        description='Replay SOAP publish envelopes against a running '
+                    'publiccommons (e.g. uWSGI with publiccommons.wsgi) at a '
+                    'fixed or ramping rate. Pair it with '
+                    'python -m benchmarks.fakekvs as NC-KVS.')
+    parser.add_argument('url', nargs='?', default='http://127.0.0.1:7789/')
+    parser.add_argument('source', nargs='*',
+                        help='envelope files, body archive files or '
+                             'directories (default: synthetic envelopes)')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='synthetic envelopes to generate and cycle')
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help='requests per second offered')
+    parser.add_argument('--ramp', type=float, default=0.0,
+                        help='add this many requests per second every '
+                             'interval to find the saturation point')
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='client timeout; keep it above harakiri')
+    parser.add_argument('--pid', type=int, action='append', default=[],
+                        help='process to sample RSS of')
+    parser.add_argument('--master', type=int,
+                        help='uWSGI master pid: sample it and its workers '
+                             'and count respawns')
+    parser.add_argument('--json', metavar='PATH',
+                        help='write the windows and summary to PATH')
+    args = parser.parse_args(argv)
+
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+
+    test = LoadTest(args.url, load_messages(args.source, args.messages),
+                    args.concurrency, args.timeout, args.pid, args.master)
+    test.memory()
+    print('{0:>8} {1:>7} {2:>8} {3:>8} {4:>8} {5:>6} {6:>5} {7:>9} {8:>4}'
+          .format('elapsed', 'offered', 'req/s', 'p50 ms', 'p99 ms',
+                  'errors', 'shed', 'rss MB', 'resp'))
+    windows = test.run(args.rate, args.duration, args.interval, args.ramp)
+    result = summary(windows, test.samples)
+    print(json.dumps(result, sort_keys=True))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'windows': windows, 'summary': result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
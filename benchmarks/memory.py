@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import sys
+import timeit
+
+import lxml.etree
+
+from publiccommons import soap, compact
+from benchmarks.publish import allocations
+from benchmarks.synthetic import generate
+
+TREES = [('dict', soap.parse), ('compact', compact.parse)]
+data_dir = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+
+def message(xml):
+    root = lxml.etree.fromstring(xml)
+    found = root.find('.//{%s}message' % soap.TARGET_NAMESPACE)
+    return root if found is None else found[0]
+
+
+def load_messages():
+    with open(os.path.join(data_dir, 'soap1.xml')) as f:
+        yield 'soap1.xml', message(f.read())
+    for areas in (100, 1000):
+        xml = generate(areas=areas, shelters=areas // 10)
+        yield 'areas={0}'.format(areas), message(xml)
+
+
+def retained(obj):
+    # sys.getsizeof over everything reachable from the tree, as gc does not
+    # track dicts that only hold atomic values
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return total
+
+
+def main(number=100):
+    # peak is only measured where tracemalloc is installed
+    print('{0:<12} {1:<8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'message', 'tree', 'bytes', 'peak', 'usec/parse', 'usec/short'))
+    for name, elem in load_messages():
+        for tree_name, parse in TREES:
+            tree = parse(elem)
+            size = retained(tree)
+            peak = allocations(lambda: parse(elem))['peak_bytes']
+            parsing = min(timeit.repeat(lambda: parse(elem), number=number))
+            shortening = min(timeit.repeat(tree.shorten, number=number))
+            print('{0:<12} {1:<8} {2:>10} {3:>10} {4:>10.1f} {5:>10.1f}'.format(
+                name, tree_name, size, '-' if peak is None else peak,
+                parsing / number * 1e6, shortening / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
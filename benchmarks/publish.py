@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import json
+import time
+import platform
+import subprocess
+
+import lxml.etree
+
+from publiccommons import soap
+from publiccommons.rawdata import Codec
+from memorykvs import MemoryKVS
+from benchmarks.synthetic import generate
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+results_dir = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), '..', '.benchmarks'))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        'n': len(samples),
+        'mean_us': total / len(samples) * 1e6,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p90_us': percentile(samples, 90) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+        'max_us': max(samples) * 1e6,
+        'ops_per_sec': len(samples) / total if total else None
+    }
+
+
+def allocations(func):
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        if tracemalloc is not None:
+            tracemalloc.start()
+        result = func()
+        peak = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        objects = len(gc.get_objects()) - before
+        del result
+    finally:
+        gc.enable()
+
+    return {'objects': objects, 'peak_bytes': peak}
+
+
+class Stages(object):
+    def __init__(self, xml, codec='json', validation='full'):
+        self.xml = xml
+        self.app = soap.get_app(MemoryKVS(), Codec(codec), validation)
+        self.protocol = self.app.app.in_protocol
+        self.parser_kwargs = self.protocol.parser_kwargs
+        self.envelope = self.soap_envelope()
+        self.message = self.envelope.find(
+            './/{%s}message' % soap.TARGET_NAMESPACE)[0]
+        self.tree = soap.parse(self.message)
+        self.short = self.tree.shorten()
+        self.param = dict(soap.extract(self.message),
+                          rawdata=soap.codec.encode(self.short))
+
+    def soap_envelope(self):
+        parser = lxml.etree.XMLParser(**self.parser_kwargs)
+        envelope = lxml.etree.fromstring(self.xml, parser)
+        body = envelope.find('{%s}Body' % SOAP_ENV)[0]
+        self.protocol.validate_document(body)
+        return envelope
+
+    def parse(self):
+        return soap.parse(self.message)
+
+    def extract(self):
+        return soap.extract(self.message)
+
+    def shorten(self):
+        return self.tree.shorten()
+
+    def flatten(self):
+        return soap.flatten(self.message)
+
+    def encode(self):
+        return soap.codec.encode(self.short)
+
+    def upsert(self):
+        return soap.upsert(self.param)
+
+    def publish(self):
+        return soap._publish(self.message)
+
+    names = ['soap_envelope', 'parse', 'extract', 'shorten', 'flatten',
+             'encode', 'upsert', 'publish']
+
+
+def run(xml, iterations=200, warmup=20, codec='json', validation='full'):
+    stages = Stages(xml, codec, validation)
+    results = {}
+    for name in Stages.names:
+        func = getattr(stages, name)
+        for _ in range(warmup):
+            func()
+
+        samples = []
+        for _ in range(iterations):
+            started = time.time()
+            func()
+            samples.append(time.time() - started)
+
+        results[name] = summarize(samples)
+        results[name].update(allocations(func))
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(report, directory=results_dir):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, '{0}-{1}.json'.format(
+        report['revision'], time.strftime('%Y%m%d%H%M%S')))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return path
+
+
+def report(options, iterations=200, warmup=20, codec='json',
+           validation='full'):
+    xml = generate(**options)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'options': dict(options, codec=codec, validation=validation,
+                        bytes=len(xml)),
+        'stages': run(xml, iterations, warmup, codec, validation)
+    }
+
+
+def format_report(report, baseline=None):
+    lines = ['{0:<14} {1:>10} {2:>10} {3:>10} {4:>10} {5:>9} {6:>12}'.format(
+        'stage', 'ops/s', 'p50 us', 'p90 us', 'p99 us', 'objects',
+        'vs baseline')]
+    for name in Stages.names:
+        r = report['stages'][name]
+        delta = ''
+        if baseline and name in baseline['stages']:
+            base = baseline['stages'][name]['p50_us']
+            delta = '{0:+.1f}%'.format((r['p50_us'] - base) / base * 100)
+        lines.append('{0:<14} {1:>10.0f} {2:>10.1f} {3:>10.1f} {4:>10.1f} '
+                     '{5:>9} {6:>12}'.format(
+                         name, r['ops_per_sec'], r['p50_us'], r['p90_us'],
+                         r['p99_us'], r['objects'], delta))
+    return '\n'.join(lines)
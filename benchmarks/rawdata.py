@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import timeit
+
+import lxml.etree
+
+from publiccommons import soap, rawdata
+
+CODECS = ['dict', 'dict+interned', 'json', 'json+interned', 'zlib',
+          'zlib+interned']
+data_dir = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+
+def load_messages():
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.xml'))):
+        root = lxml.etree.parse(path).getroot()
+        message = root.find('.//{%s}message' % soap.TARGET_NAMESPACE)
+        if message is not None:
+            root = message[0]
+        yield os.path.basename(path), soap.parse(root).shorten()
+
+
+def size(value):
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return len(value)
+
+
+def main(number=1000):
+    print('{0:<12} {1:<14} {2:>8} {3:>10}'.format(
+        'file', 'codec', 'bytes', 'usec/enc'))
+    for name, d in load_messages():
+        for codec_name in CODECS:
+            codec = rawdata.Codec(codec_name)
+            elapsed = timeit.timeit(lambda: codec.encode(d), number=number)
+            print('{0:<12} {1:<14} {2:>8} {3:>10.1f}'.format(
+                name, codec_name, size(codec.encode(d)),
+                elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
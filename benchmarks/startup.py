@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from wsgiref.util import setup_testing_defaults
+from ConfigParser import SafeConfigParser
+
+dev_ini = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), '..', 'publiccommons.dev.ini'))
+VARIANTS = {
+    'default': {},
+    'preload': {'wsdl_url': 'http://localhost:7789/', 'kvs_lazy': 'true'}
+}
+
+
+def write_config(settings):
+    parser = SafeConfigParser()
+    parser.read(dev_ini)
+    for key, value in settings.items():
+        parser.set('publiccommons', key, value)
+    parser.set('logger_root', 'level', 'WARNING')
+    parser.set('logger_app', 'level', 'WARNING')
+
+    fd, path = tempfile.mkstemp(suffix='.ini')
+    with os.fdopen(fd, 'w') as f:
+        parser.write(f)
+    return path
+
+
+def first_request(application):
+    environ = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'wsdl'}
+    setup_testing_defaults(environ)
+    started = time.time()
+    b''.join(application(environ, lambda status, headers: None))
+    return time.time() - started
+
+
+def measure(forks):
+    started = time.time()
+    from publiccommons import wsgi
+    imported = time.time() - started
+
+    # like uWSGI without lazy-apps: the master imports the application and
+    # each respawned worker is a fork of it
+    samples = []
+    for _ in range(forks):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, repr(first_request(wsgi.application)))
+            os._exit(0)
+        os.close(w)
+        samples.append(float(os.read(r, 64)))
+        os.close(r)
+        os.waitpid(pid, 0)
+
+    return {'import': imported, 'first_request': samples}
+
+
+def run(variant, repeat, forks):
+    from benchmarks.publish import percentile
+
+    config = write_config(VARIANTS[variant])
+    env = dict(os.environ, PUBLICCOMMONS_CONFIG=config)
+    imports = []
+    requests = []
+    try:
+        for _ in range(repeat):
+            out = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.startup', 'measure',
+                 '--forks', str(forks)], env=env)
+            result = json.loads(out)
+            imports.append(result['import'])
+            requests.extend(result['first_request'])
+    finally:
+        os.remove(config)
+
+    return {'import_ms': percentile(imports, 50) * 1000,
+            'first_request_ms': percentile(requests, 50) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.startup',
+        description='Measure worker cold start: importing publiccommons.wsgi '
+                    '(lazy-apps) and the first request of a forked worker.')
+    sub = parser.add_subparsers(dest='command')
+    bench = sub.add_parser('run')
+    bench.add_argument('--variant', choices=sorted(VARIANTS), action='append')
+    bench.add_argument('--repeat', type=int, default=5)
+    bench.add_argument('--forks', type=int, default=5)
+    child = sub.add_parser('measure')
+    child.add_argument('--forks', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == 'measure':
+        sys.stdout.write(json.dumps(measure(args.forks)))
+        return
+
+    print('{0:<10} {1:>10} {2:>18}'.format(
+        'variant', 'import ms', 'first request ms'))
+    for variant in args.variant or sorted(VARIANTS):
+        r = run(variant, args.repeat, args.forks)
+        print('{0:<10} {1:>10.1f} {2:>18.2f}'.format(
+            variant, r['import_ms'], r['first_request_ms']))
+
+
+if __name__ == '__main__':
+    main()
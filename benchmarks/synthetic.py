@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+import random
+from xml.sax.saxutils import escape
+
+from publiccommons.soap import TARGET_NAMESPACE, NS_MAP
+
+VARIANTS = {
+    3: {
+        'report': 'http://xml.publiccommons.ne.jp/pcxml1/3',
+        'ib': ('pcx_ib', NS_MAP['pcx_ib']),
+        'eb': ('pcx_eb', 'http://xml.publiccommons.ne.jp/pcxml1/elementBasis3/'),
+        'ev': ('pcx_ev', 'http://xml.publiccommons.ne.jp/pcxml1/body/evacuation3'),
+        'sh': ('pcx_sh', 'http://xml.publiccommons.ne.jp/pcxml1/body/shelter3'),
+    },
+    4: {
+        'report': 'http://xml.publiccommons.ne.jp/pcxml1/4',
+        'ib': ('pcx_cns_i3', NS_MAP['pcx_cns_i3']),
+        'eb': ('pcx_cns_i4', 'http://xml.publiccommons.ne.jp/pcxml1/elementBasis4/'),
+        'ev': ('pcx_cns_i8', 'http://xml.publiccommons.ne.jp/pcxml1/body/evacuation4'),
+        'sh': ('pcx_cns_i12', 'http://xml.publiccommons.ne.jp/pcxml1/body/shelter4'),
+    }
+}
+
+CATEGORIES = ['EvacuationOrder', 'Shelter', 'Event', 'DamageInformation']
+STATUSES = ['Actual', 'Test', 'Exercise']
+TEXT = u'土砂災害警戒情報の発表に伴い避難勧告を発令しました。'
+
+
+def area(eb, i, jis):
+    return (
+        u'<{eb}:Area><{eb}:Location>'
+        u'<{eb}:circle>35.{i:06d},139.{i:06d}</{eb}:circle><{eb}:polygon/>'
+        u'<{eb}:areaName>地区{i}</{eb}:areaName><{eb}:areaNameKana/>'
+        u'<commons:jisX0402>{jis}</commons:jisX0402>'
+        u'<{eb}:ooAzaTyouTyouMokuCode>{jis}{i:06d}</{eb}:ooAzaTyouTyouMokuCode>'
+        u'</{eb}:Location><{eb}:DateTime>2013-04-10T18:55:00+09:00</{eb}:DateTime>'
+        u'<{eb}:Object/></{eb}:Area>'
+    ).format(eb=eb, i=i, jis=jis)
+
+
+def shelter(sh, eb, i, jis):
+    return (
+        u'<{sh}:Shelter><{sh}:Name>避難所{i}</{sh}:Name>'
+        u'<{sh}:Capacity>{capacity}</{sh}:Capacity>'
+        u'<{sh}:Status>開設</{sh}:Status>{area}</{sh}:Shelter>'
+    ).format(sh=sh, i=i, capacity=100 + i, area=area(eb, i, jis))
+
+
+def generate(areas=10, shelters=0, body_length=100, variant=3,
+             status='Actual', category='EvacuationOrder', document_id=None,
+             revision=1, distribution_id=None, jis='131016'):
+    ns = VARIANTS[variant]
+    ib, ib_uri = ns['ib']
+    eb, eb_uri = ns['eb']
+    ev, ev_uri = ns['ev']
+    sh, sh_uri = ns['sh']
+    document_id = document_id or str(uuid.uuid4())
+    text = (TEXT * (body_length // len(TEXT) + 1))[:body_length]
+
+    body = [u'<{ev}:EvacuationOrder><{ev}:Detail><{ev}:Areas>'.format(ev=ev)]
+    body.extend(area(eb, i, jis) for i in range(areas))
+    body.append(u'</{ev}:Areas></{ev}:Detail></{ev}:EvacuationOrder>'.format(ev=ev))
+    if shelters:
+        body.append(u'<{sh}:Shelters>'.format(sh=sh))
+        body.extend(shelter(sh, eb, i, jis) for i in range(shelters))
+        body.append(u'</{sh}:Shelters>'.format(sh=sh))
+
+    xml = (
+        u'<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        u'<soap:Body><pcsoap:publish xmlns:pcsoap="{tns}"><pcsoap:message>'
+        u'<edxlde:EDXLDistribution xmlns:edxlde="{edxlde}" xmlns:commons="{commons}" '
+        u'xmlns:{ib}="{ib_uri}" xmlns:{eb}="{eb_uri}" xmlns:{ev}="{ev_uri}" '
+        u'xmlns:{sh}="{sh_uri}">'
+        u'<edxlde:distributionID>{distribution_id}</edxlde:distributionID>'
+        u'<edxlde:senderID>bench.publiccommons.test</edxlde:senderID>'
+        u'<edxlde:dateTimeSent>2013-04-10T18:57:05+09:00</edxlde:dateTimeSent>'
+        u'<edxlde:distributionStatus>{status}</edxlde:distributionStatus>'
+        u'<edxlde:distributionType>Report</edxlde:distributionType>'
+        u'<commons:targetArea><commons:areaName>ベンチマーク市</commons:areaName>'
+        u'<commons:jisX0402>{jis}</commons:jisX0402></commons:targetArea>'
+        u'<commons:contentObject><edxlde:xmlContent><edxlde:embeddedXMLContent>'
+        u'<Report xmlns="{report}"><{ib}:Head>'
+        u'<{ib}:Title>ベンチマーク市 避難勧告・指示情報 発令</{ib}:Title>'
+        u'<commons:documentID>{document_id}</commons:documentID>'
+        u'<{ib}:Headline><{ib}:Text>{text}</{ib}:Text></{ib}:Headline>'
+        u'</{ib}:Head>{body}</Report>'
+        u'</edxlde:embeddedXMLContent></edxlde:xmlContent>'
+        u'<commons:documentRevision>{revision}</commons:documentRevision>'
+        u'<commons:documentID>{document_id}</commons:documentID>'
+        u'<commons:category>{category}</commons:category>'
+        u'</commons:contentObject></edxlde:EDXLDistribution>'
+        u'</pcsoap:message></pcsoap:publish></soap:Body></soap:Envelope>'
+    ).format(tns=TARGET_NAMESPACE, edxlde=NS_MAP['edxlde'],
+             commons=NS_MAP['commons'], ib=ib, ib_uri=ib_uri, eb=eb,
+             eb_uri=eb_uri, ev=ev, ev_uri=ev_uri, sh=sh, sh_uri=sh_uri,
+             report=ns['report'], status=status, category=category,
+             distribution_id=distribution_id or str(uuid.uuid4()),
+             document_id=document_id, revision=revision, jis=jis,
+             text=escape(text), body=u''.join(body))
+
+    return xml.encode('utf-8')
+
+
+def stream(count, seed=0, documents=None, **kwargs):
+    rnd = random.Random(seed)
+    ids = [str(uuid.UUID(int=rnd.getrandbits(128)))
+           for _ in range(documents or count)]
+    revisions = {}
+    for _ in range(count):
+        document_id = rnd.choice(ids)
+        revisions[document_id] = revisions.get(document_id, 0) + 1
+        options = {'distribution_id': str(uuid.UUID(int=rnd.getrandbits(128))),
+                   'status': rnd.choice(STATUSES),
+                   'category': rnd.choice(CATEGORIES),
+                   'jis': '{0:06d}'.format(rnd.randrange(10000, 480000))}
+        options.update(kwargs)
+        yield generate(document_id=document_id,
+                       revision=revisions[document_id], **options)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import logging
+import threading
+from io import BytesIO
+from collections import deque
+
+from publiccommons import metrics
+from publiccommons.stream import fault
+
+log = logging.getLogger(__name__)
+
+DISTRIBUTION_STATUS = re.compile(
+    br'<(?:[\w.-]+:)?distributionStatus>\s*([^<\s]+)\s*</')
+CATEGORY = re.compile(br'<(?:[\w.-]+:)?category>\s*([^<\s]+)\s*</')
+EMBEDDED_END = b'embeddedXMLContent>'
+URGENT_CATEGORIES = ('EvacuationOrder',)
+
+
+def peek(body):
+    status = DISTRIBUTION_STATUS.search(body)
+    # the embedded document comes before the category of the content object
+    # and may have elements of its own with the same names
+    category = CATEGORY.search(body, body.rfind(EMBEDDED_END) + 1)
+    return (status.group(1).decode('utf-8') if status else None,
+            category.group(1).decode('utf-8') if category else None)
+
+
+class Lane(object):
+    def __init__(self, name, concurrency, queue_timeout=0.0, target=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.target = target
+        self.active = 0
+        self.waiters = deque()
+        self.latency = None
+        self.observed = 0
+
+    @property
+    def waiting(self):
+        return len(self.waiters)
+
+    def observe(self, elapsed, alpha):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += alpha * (elapsed - self.latency)
+        self.observed = time.time()
+
+    def breached(self, now, window):
+        # a lane that has been quiet for a window no longer holds others back
+        return self.target is not None and self.latency is not None and \
+            now - self.observed < window and self.latency > self.target
+
+
+def default_lanes():
+    return [Lane('urgent', 8, 20.0, 2.0), Lane('actual', 4, 5.0, 5.0),
+            Lane('low', 1, 0.0)]
+
+
+class AdmissionMiddleware(object):
+    def __init__(self, application, lanes=None,
+                 urgent_categories=URGENT_CATEGORIES,
+                 max_content_length=2 * 1024 * 1024, retry_after=30,
+                 alpha=0.2, window=10.0, evented=False):
+        self.application = application
+        # in priority order: Actual messages of an urgent category, other
+        # Actual messages, and Test, Exercise, System or unknown ones
+        self.lanes = lanes or default_lanes()
+        self.urgent_categories = frozenset(urgent_categories)
+        self.max_content_length = max_content_length
+        self.retry_after = retry_after
+        self.alpha = alpha
+        self.window = window
+        # queued requests wait on their own event and are handed a slot on
+        # release; under gevent with unpatched threads a threading wait
+        # would block every greenlet of the process
+        if evented:
+            from gevent.event import Event
+            self.event = Event
+        else:
+            self.event = threading.Event
+        self.lock = threading.Lock()
+
+    def classify(self, status, category):
+        if status != 'Actual':
+            return len(self.lanes) - 1
+        if category in self.urgent_categories:
+            return 0
+        return min(1, len(self.lanes) - 1)
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            return self.application(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH') or '0')
+        if length > self.max_content_length:
+            return self.application(environ, start_response)
+
+        received = time.time()
+        body = environ['wsgi.input'].read(length)
+        environ['wsgi.input'] = BytesIO(body)
+        i = self.classify(*peek(body))
+        lane = self.lanes[i]
+        reason = self.admit(i, received)
+        if reason is not None:
+            log.warning('shed %s: %s', lane.name, reason)
+            metrics.registry.incr('publiccommons_admission_shed_total',
+                                  lane=lane.name)
+            return self._busy(start_response, reason)
+
+        try:
+            result = self.application(environ, start_response)
+            try:
+                content = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            self.release(lane, time.time() - received)
+
+        return [content]
+
+    def admit(self, i, received):
+        lane = self.lanes[i]
+        for higher in self.lanes[:i]:
+            if higher.breached(received, self.window):
+                return '{0} latency is above target'.format(higher.name)
+
+        waiter = None
+        with self.lock:
+            # lower lanes also wait while a higher lane has a backlog
+            if lane.active < lane.concurrency and not any(
+                    l.waiters for l in self.lanes[:i + 1]):
+                lane.active += 1
+            else:
+                waiter = self.event()
+                lane.waiters.append(waiter)
+
+        if waiter is not None:
+            remaining = received + lane.queue_timeout - time.time()
+            if remaining <= 0 or not waiter.wait(remaining):
+                with self.lock:
+                    # a slot may have been handed over after the timeout
+                    admitted = waiter.is_set()
+                    if not admitted:
+                        lane.waiters.remove(waiter)
+                        self._dispatch()
+                if not admitted:
+                    return '{0} queue is full'.format(lane.name)
+
+        metrics.registry.observe('publiccommons_admission_wait_seconds',
+                                 time.time() - received, lane=lane.name)
+        return None
+
+    def release(self, lane, elapsed):
+        with self.lock:
+            lane.active -= 1
+            lane.observe(elapsed, self.alpha)
+            self._dispatch()
+
+    def _dispatch(self):
+        for lane in self.lanes:
+            while lane.waiters and lane.active < lane.concurrency:
+                lane.active += 1
+                lane.waiters.popleft().set()
+            if lane.waiters:
+                return
+
+    def _busy(self, start_response, reason):
+        body = fault('Server.Busy', 'Service is busy ({0}); retry later'
+                     .format(reason))
+        start_response('503 Service Unavailable',
+                       [('Content-Type', 'text/xml; charset=utf-8'),
+                        ('Content-Length', str(len(body))),
+                        ('Retry-After', str(self.retry_after))])
+        return [body]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import gzip
+import json
+import time
+import Queue
+import random
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class TeeInput(object):
+    def __init__(self, stream, max_size=None):
+        self.stream = stream
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+        self.length = 0
+
+    def _tee(self, data):
+        self.length += len(data)
+        if self.max_size is None:
+            self.chunks.append(data)
+        elif self.size < self.max_size:
+            data = data[:self.max_size - self.size]
+            self.chunks.append(data)
+            self.size += len(data)
+        return data
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self._tee(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self._tee(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self.stream.readlines(*args)
+        for line in lines:
+            self._tee(line)
+        return lines
+
+    def __iter__(self):
+        for line in self.stream:
+            self._tee(line)
+            yield line
+
+    @property
+    def truncated(self):
+        return self.max_size is not None and self.length > self.max_size
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+class ClosingIterator(object):
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+
+class BodyArchive(object):
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, backup_count=10,
+                 queue_size=1000, compresslevel=6, flush_interval=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compresslevel = compresslevel
+        self.flush_interval = flush_interval
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = 0
+        self.file = None
+        self.written = 0
+        self.dirty = False
+        self.pid = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, body, **meta):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((body, meta))
+        except Queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put((None, None))
+            self.thread.join()
+            self.thread = None
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.file = None
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                body, meta = self.queue.get(timeout=self.flush_interval)
+            except Queue.Empty:
+                # a gzip flush ends the deflate block, so only flush when idle
+                if self.dirty:
+                    self.file.flush()
+                    self.dirty = False
+                continue
+            if body is None:
+                break
+
+            try:
+                self._write(body, meta)
+            except Exception as e:
+                log.exception(e)
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write(self, body, meta):
+        if self.file is None or self.written >= self.max_bytes:
+            self._rotate()
+
+        # length is what the client sent, size what is stored after it, so
+        # a truncated body does not hide the records that follow
+        header = json.dumps(dict(meta, size=len(body)), separators=(',', ':'),
+                            sort_keys=True)
+        self.file.write(header + '\n')
+        self.file.write(body + '\n')
+        self.dirty = True
+        self.written += len(header) + len(body) + 2
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+
+        name = 'body-{0}-{1}.gz'.format(
+            time.strftime('%Y%m%d%H%M%S'), os.getpid())
+        path = os.path.join(self.directory, name)
+        self.file = gzip.open(path, 'ab', self.compresslevel)
+        self.written = 0
+        self.dirty = False
+
+        # backup_count is per worker: the files of other workers are still
+        # being written, and an earlier process with this pid has exited
+        archives = sorted(glob.glob(os.path.join(
+            self.directory, 'body-*-{0}.gz'.format(os.getpid()))),
+            key=lambda p: (os.path.getmtime(p), p))
+        for old in archives[:-self.backup_count]:
+            if old != path:
+                os.remove(old)
+
+
+def sampled(rate):
+    return rate >= 1.0 or random.random() < rate
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from publiccommons import metrics
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    def __init__(self, size=10000, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.pop(key, None)
+            if item is None or (item[1] is not None and item[1] <= time.time()):
+                self.misses += 1
+                return None
+
+            self.data[key] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, expires)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.data)}
+
+
+class SQLiteCache(object):
+    evict_interval = 100
+
+    def __init__(self, path, size=10000, ttl=None, table='cache'):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.pid = None
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = threading.local()
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS {0} ('
+                       'key TEXT PRIMARY KEY, value TEXT, '
+                       'expires REAL, used REAL)'.format(self.table))
+            db.execute('CREATE INDEX IF NOT EXISTS {0}_used '
+                       'ON {0} (used)'.format(self.table))
+            self.local.db = db
+        return db
+
+    def get(self, key):
+        now = time.time()
+        db = self.db
+        row = db.execute(
+            'SELECT value FROM {0} WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)'.format(self.table),
+            (key, now)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        db.execute('UPDATE {0} SET used = ? WHERE key = ?'.format(self.table),
+                   (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        db = self.db
+        db.execute('INSERT OR REPLACE INTO {0} VALUES (?, ?, ?, ?)'.format(
+            self.table), (key, json.dumps(value), expires, now))
+
+        self.writes += 1
+        if self.writes % self.evict_interval == 0:
+            self.evict()
+
+    def evict(self):
+        db = self.db
+        db.execute('DELETE FROM {0} WHERE expires <= ?'.format(self.table),
+                   (time.time(),))
+        db.execute('DELETE FROM {0} WHERE key IN (SELECT key FROM {0} '
+                   'ORDER BY used DESC LIMIT -1 OFFSET ?)'.format(self.table),
+                   (self.size,))
+
+    def stats(self):
+        size = self.db.execute(
+            'SELECT count(*) FROM {0}'.format(self.table)).fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+
+class RevisionCachingClient(object):
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def upsert(self, data, key, cmp=None):
+        known = self.cache.get(data[key])
+        metrics.registry.incr('publiccommons_revision_cache_total',
+                              result='miss' if known is None else 'hit')
+        if known is not None and cmp is not None and \
+                not cmp({'revision': known}, data):
+            log.info('skip: {0}.{1} (known revision {2})'.format(
+                data[key], data['revision'], known))
+            return None
+
+        compared = []
+
+        def _cmp(old, new_):
+            accepted = cmp(old, new_)
+            compared.append(new_ if accepted else old)
+            return accepted
+
+        result = self.client.upsert(data, key,
+                                    cmp=None if cmp is None else _cmp)
+        # the revision written, or the newer one that made it stale
+        known = compared[-1] if compared else data
+        self.cache.set(data[key], known['revision'])
+        return result
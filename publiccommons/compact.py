@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+import lxml.etree
+
+from publiccommons.soap import Namespaces
+
+
+class Document(object):
+    __slots__ = ('tags', 'tag_ids', 'nsmaps', 'names', 'namespaces')
+
+    def __init__(self, namespaces=None):
+        self.tags = []
+        self.tag_ids = {}
+        self.nsmaps = []
+        self.names = {}
+        self.namespaces = namespaces or Namespaces()
+
+    def tag_id(self, tag):
+        i = self.tag_ids.get(tag)
+        if i is None:
+            i = self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return i
+
+    def ns_id(self, ns):
+        self.nsmaps.append(ns)
+        return len(self.nsmaps) - 1
+
+    def short_name(self, nsid, tagid):
+        key = nsid << 32 | tagid
+        name = self.names.get(key)
+        if name is None:
+            _, rns, _ = self.namespaces.cache(self.nsmaps[nsid])
+            name = self.names[key] = self.namespaces.resolve(
+                rns, self.tags[tagid])
+        return name
+
+
+class Node(object):
+    __slots__ = ('doc', 'nsid', 'keys', 'values')
+
+    def __init__(self, doc, nsid, keys, values):
+        self.doc = doc
+        self.nsid = nsid
+        self.keys = keys
+        self.values = values
+
+    @property
+    def ns(self):
+        return self.doc.nsmaps[self.nsid]
+
+    def _index(self, tag):
+        tagid = self.doc.tag_ids.get(tag)
+        if tagid is not None:
+            try:
+                return self.keys.index(tagid)
+            except ValueError:
+                pass
+        return -1
+
+    def get(self, tag, default=None):
+        i = self._index(tag)
+        return default if i < 0 else self.values[i]
+
+    def __getitem__(self, tag):
+        i = self._index(tag)
+        if i < 0:
+            raise KeyError(tag)
+        return self.values[i]
+
+    def __contains__(self, tag):
+        return self._index(tag) >= 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        tags = self.doc.tags
+        return (tags[i] for i in self.keys)
+
+    def iteritems(self):
+        tags = self.doc.tags
+        return ((tags[i], v) for i, v in zip(self.keys, self.values))
+
+    def items(self):
+        return list(self.iteritems())
+
+    def find(self, tag):
+        i = self._index(tag)
+        if i >= 0:
+            return self.values[i]
+
+        for v in self.values:
+            if isinstance(v, Node):
+                r = v.find(tag)
+                if r:
+                    return r
+
+        return None
+
+    def findall(self, tag):
+        tagid = self.doc.tag_ids.get(tag)
+        found = []
+        for i, v in zip(self.keys, self.values):
+            if i == tagid:
+                found.append(v)
+            if isinstance(v, Node):
+                found.extend(v.findall(tag))
+
+        return found
+
+    def shorten(self, namespaces=None):
+        # names are resolved once per document, so a shared Namespaces
+        # has nothing left to cache
+        short_name = self.doc.short_name
+        d = {}
+        for tagid, value in zip(self.keys, self.values):
+            if isinstance(value, Node):
+                # the child's namespaces apply to its own tag
+                d[short_name(value.nsid, tagid)] = value.shorten()
+            else:
+                d[short_name(self.nsid, tagid)] = value
+
+        return d
+
+    def encode(self, encoding):
+        values = []
+        for value in self.values:
+            if isinstance(value, Node):
+                value = value.encode(encoding)
+            elif isinstance(value, unicode):
+                value = value.encode(encoding)
+            values.append(value)
+
+        return Node(self.doc, self.nsid, self.keys, tuple(values))
+
+
+def parse(elem, doc=None):
+    return _parse(elem, doc or Document(), None, None)
+
+
+def _parse(elem, doc, parent_nsid, parent_ns):
+    ns = elem.nsmap
+    nsid = parent_nsid if ns == parent_ns else doc.ns_id(ns)
+
+    tag_ids = doc.tag_ids
+    keys = array('I')
+    children = []
+    for el in elem:
+        if isinstance(el, lxml.etree._Comment):
+            continue
+
+        tagid = tag_ids.get(el.tag)
+        if tagid is None:
+            tagid = doc.tag_id(el.tag)
+        if tagid in keys:
+            # the last of repeated tags wins as in XMLDict, so the earlier
+            # ones are never converted
+            children[keys.index(tagid)] = el
+        else:
+            keys.append(tagid)
+            children.append(el)
+
+    return Node(doc, nsid, keys, tuple(
+        _parse(el, doc, nsid, ns) if len(el) > 0 else el.text
+        for el in children))
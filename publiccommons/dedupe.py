@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import re
+import hashlib
+import logging
+from io import BytesIO
+
+from publiccommons import metrics
+
+log = logging.getLogger(__name__)
+
+DISTRIBUTION_ID = re.compile(
+    br'<(?:[\w.-]+:)?distributionID>\s*([^<\s]+)\s*</(?:[\w.-]+:)?distributionID>')
+FAULT = b':Fault>'
+
+
+def message_key(body):
+    m = DISTRIBUTION_ID.search(body)
+    if m is None:
+        return None
+
+    return '{0}:{1}'.format(m.group(1).decode('utf-8'),
+                            hashlib.sha1(body).hexdigest())
+
+
+class DedupeMiddleware(object):
+    def __init__(self, application, cache, max_content_length=2 * 1024 * 1024):
+        self.application = application
+        self.cache = cache
+        self.max_content_length = max_content_length
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            return self.application(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH') or '0')
+        if length > self.max_content_length:
+            return self.application(environ, start_response)
+
+        body = environ['wsgi.input'].read(length)
+        environ['wsgi.input'] = BytesIO(body)
+        key = message_key(body)
+        if key is None:
+            return self.application(environ, start_response)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            log.info('duplicate: %s', key)
+            metrics.registry.incr('publiccommons_duplicates_total')
+            content = cached['body'].encode('utf-8')
+            content_type = str(cached['content_type'])
+            start_response('200 OK', [('Content-Type', content_type),
+                                      ('Content-Length', str(len(content)))])
+            return [content]
+
+        response = []
+
+        def _start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+            return start_response(status, headers, exc_info)
+
+        result = self.application(environ, _start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        status, headers = response
+        if status.startswith('200') and FAULT not in content:
+            content_type = dict((k.lower(), v) for k, v in headers).get(
+                'content-type', 'text/xml; charset=utf-8')
+            self.cache.set(key, {'content_type': content_type,
+                                 'body': content.decode('utf-8')})
+
+        return [content]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+from io import BytesIO
+
+from gevent.threadpool import ThreadPool
+
+from publiccommons import soap
+from publiccommons.stream import StreamingApplication
+
+
+class EventedApplication(StreamingApplication):
+    def __init__(self, application, max_content_length=2 * 1024 * 1024,
+                 chunk_size=8192, cpu_workers=4):
+        super(EventedApplication, self).__init__(
+            application, max_content_length, chunk_size)
+        self.cpu_workers = cpu_workers
+        self.pid = None
+        self.pool = None
+
+    @property
+    def executor(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pool = ThreadPool(self.cpu_workers)
+        return self.pool
+
+    def parse(self, environ, length):
+        body = environ['wsgi.input'].read(length)
+        environ['wsgi.input'] = BytesIO(body)
+        return self.executor.apply(
+            super(EventedApplication, self).parse, (environ, len(body)))
+
+    def store(self, root):
+        param = self.executor.apply(self.prepare, (root,))
+        with soap.stage('upsert'):
+            soap.upsert(param)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m publiccommons.evented',
+        description='Serve publiccommons.wsgi from a gevent server.')
+    parser.add_argument('--listen', help='host:port (default: evented_listen)')
+    parser.add_argument('--connections', type=int,
+                        help='concurrent connections (default: evented_connections)')
+    args = parser.parse_args(argv)
+
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    from publiccommons import wsgi
+
+    listen = args.listen or wsgi.settings.get('evented_listen', '127.0.0.1:7789')
+    connections = args.connections or \
+        int(wsgi.settings.get('evented_connections', 1000))
+    host, _, port = listen.rpartition(':')
+    server = WSGIServer((host or '0.0.0.0', int(port)), wsgi.application,
+                        spawn=Pool(connections), log=None)
+    print('listening to http://{0}'.format(listen))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+from publiccommons import metrics
+from publiccommons.writebehind import bulk_upsert
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ('document_id', 'revision', 'area_code', 'category', 'status',
+           'title', 'updated')
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS documents ('
+    'document_id TEXT PRIMARY KEY, revision INTEGER, area_code TEXT, '
+    'category TEXT, status TEXT, title TEXT, updated REAL)',
+    'CREATE INDEX IF NOT EXISTS documents_area ON documents '
+    '(area_code, updated)',
+    'CREATE INDEX IF NOT EXISTS documents_category ON documents '
+    '(category, status, updated)',
+    'CREATE TABLE IF NOT EXISTS revisions ('
+    'document_id TEXT, revision INTEGER, area_code TEXT, category TEXT, '
+    'status TEXT, title TEXT, updated REAL, '
+    'PRIMARY KEY (document_id, revision))'
+]
+
+
+def prefix_range(prefix):
+    # area codes are digits, so every code with the prefix sorts before
+    # the prefix with its last character incremented
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+class DocumentIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.pid = None
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = threading.local()
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self.local.db = db
+        return db
+
+    def add(self, data, updated=None):
+        row = (data['document_id'], int(data['revision']),
+               data.get('area_code'), data.get('category'),
+               data.get('status'), data.get('title'),
+               time.time() if updated is None else updated)
+        db = self.db
+        db.execute('BEGIN')
+        try:
+            db.execute('INSERT OR IGNORE INTO revisions VALUES '
+                       '(?, ?, ?, ?, ?, ?, ?)', row)
+            db.execute('INSERT OR REPLACE INTO documents '
+                       'SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS ('
+                       'SELECT 1 FROM documents WHERE document_id = ? '
+                       'AND revision >= ?)', row + row[:2])
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _select(self, table, where, args, order, limit=None):
+        sql = 'SELECT {0} FROM {1} WHERE {2} ORDER BY {3}'.format(
+            ', '.join(COLUMNS), table, where, order)
+        if limit is not None:
+            sql += ' LIMIT {0:d}'.format(limit)
+        return [dict(zip(COLUMNS, row))
+                for row in self.db.execute(sql, args)]
+
+    def by_area(self, prefix='', limit=100):
+        if not prefix:
+            return self._select('documents', '1', (), 'updated DESC', limit)
+        return self._select('documents', 'area_code >= ? AND area_code < ?',
+                            prefix_range(unicode(prefix)), 'updated DESC',
+                            limit)
+
+    def since(self, category, since, status='Actual', limit=100):
+        return self._select(
+            'documents', 'category = ? AND status = ? AND updated >= ?',
+            (category, status, since), 'updated DESC', limit)
+
+    def history(self, document_id):
+        return self._select('revisions', 'document_id = ?', (document_id,),
+                            'revision')
+
+    def stats(self):
+        db = self.db
+        return {
+            'documents': db.execute(
+                'SELECT count(*) FROM documents').fetchone()[0],
+            'revisions': db.execute(
+                'SELECT count(*) FROM revisions').fetchone()[0]
+        }
+
+
+class IndexingClient(object):
+    def __init__(self, client, index):
+        self.client = client
+        self.index = index
+
+    def search(self, conditions):
+        return self.client.search(conditions)
+
+    def set(self, records):
+        result = self.client.set(records)
+        # only what NC-KVS accepted; bulk_upsert leaves out stale revisions
+        for record in records:
+            try:
+                self.index.add(record)
+            except Exception as e:
+                # the write has been accepted, and a retry would be skipped
+                # as not newer, so the index falls behind instead
+                log.exception(e)
+                metrics.registry.incr('publiccommons_index_errors_total',
+                                      type=e.__class__.__name__)
+        return result
+
+    def upsert(self, data, key, cmp=None):
+        return bulk_upsert(self, [(data, key, cmp)])
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        prog='python -m publiccommons.index',
+        description='Query the local document index.')
+    parser.add_argument('path')
+    sub = parser.add_subparsers(dest='command')
+    area = sub.add_parser('area', help='latest documents for an area code '
+                                       'prefix')
+    area.add_argument('prefix', nargs='?', default='')
+    area.add_argument('--limit', type=int, default=100)
+    since = sub.add_parser('since', help='documents of a category updated '
+                                         'since a UNIX time')
+    since.add_argument('category')
+    since.add_argument('since', type=float)
+    since.add_argument('--status', default='Actual')
+    since.add_argument('--limit', type=int, default=100)
+    history = sub.add_parser('history', help='revisions of a document')
+    history.add_argument('document_id')
+    sub.add_parser('stats')
+    args = parser.parse_args(argv)
+
+    index = DocumentIndex(args.path)
+    if args.command == 'area':
+        rows = index.by_area(args.prefix, args.limit)
+    elif args.command == 'since':
+        rows = index.since(args.category, args.since, args.status, args.limit)
+    elif args.command == 'history':
+        rows = index.history(args.document_id)
+    else:
+        rows = [index.stats()]
+
+    for row in rows:
+        out.write(json.dumps(row, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import mmap
+import zlib
+import logging
+import multiprocessing
+from io import BytesIO
+from multiprocessing.queues import SimpleQueue
+
+from publiccommons import soap, metrics
+from publiccommons.metrics import alive
+from publiccommons.stream import parse_stream, response, fault
+
+log = logging.getLogger(__name__)
+
+OPERATION = re.compile(br':Body[^>]*>\s*<(?:[\w.-]+:)?([\w.-]+)')
+DOCUMENT_ID = re.compile(
+    br'<(?:[\w.-]+:)?documentID>\s*([^<\s]+)\s*</(?:[\w.-]+:)?documentID>')
+STOP = -1
+INLINE = -2
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class Channel(object):
+    def __init__(self, slots=16, slot_size=2 * 1024 * 1024):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = mmap.mmap(-1, slots * slot_size)
+        self.used = multiprocessing.Array('b', slots)
+        self.free = multiprocessing.Semaphore(slots)
+        self.tasks = SimpleQueue()
+
+    def put(self, body, timeout=None):
+        if len(body) > self.slot_size:
+            self.tasks.put((INLINE, body))
+            return
+
+        if not self.free.acquire(True, timeout):
+            raise PoolBusy('no free buffer in {0}s'.format(timeout))
+        with self.used.get_lock():
+            slot = self.used[:].index(0)
+            self.used[slot] = 1
+
+        start = slot * self.slot_size
+        self.buffer[start:start + len(body)] = body
+        self.tasks.put((slot, len(body)))
+
+    def get(self):
+        slot, value = self.tasks.get()
+        if slot < 0:
+            return None if slot == STOP else value
+
+        start = slot * self.slot_size
+        body = self.buffer[start:start + value]
+        with self.used.get_lock():
+            self.used[slot] = 0
+        self.free.release()
+        return body
+
+    def empty(self):
+        return self.tasks.empty()
+
+    def stop(self):
+        self.tasks.put((STOP, None))
+
+
+def process(body):
+    with soap.stage('stream_parse'):
+        root = parse_stream(BytesIO(body), len(body))
+    with soap.stage('extract'):
+        param = soap.extract(root)
+    soap.store(param, root)
+
+
+def work(channel):
+    while True:
+        body = channel.get()
+        if body is None:
+            return
+
+        try:
+            process(body)
+        except Exception as e:
+            log.exception(e)
+            metrics.registry.incr('publiccommons_errors_total',
+                                  type=e.__class__.__name__)
+        # the HTTP workers only render what the ingest workers have flushed
+        metrics.registry.flush(force=channel.empty())
+
+
+def route(body, workers):
+    m = DOCUMENT_ID.search(body)
+    return zlib.crc32(m.group(1) if m else body) % workers
+
+
+class IngestPool(object):
+    def __init__(self, processes=None, slots=16, slot_size=2 * 1024 * 1024,
+                 timeout=5.0):
+        self.size = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.channels = [Channel(slots, slot_size) for _ in range(self.size)]
+        self.processes = []
+        self.pid = None
+
+    def start(self):
+        self.pid = os.getpid()
+        for i, channel in enumerate(self.channels):
+            p = multiprocessing.Process(target=work, args=(channel,),
+                                        name='publiccommons-ingest-{0}'.format(i))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+
+    def submit(self, body):
+        i = route(body, self.size)
+        # a dead worker cannot be restarted from the forked HTTP workers, so
+        # its documents move to the next live one; every process picks the
+        # same one and revisions of a document stay in order
+        for j in range(i, i + self.size):
+            if self.alive(j % self.size):
+                if j != i:
+                    metrics.registry.incr('publiccommons_ingest_rerouted_total')
+                self.channels[j % self.size].put(body, self.timeout)
+                return
+        raise PoolBusy('no ingest worker is running')
+
+    def alive(self, i):
+        p = self.processes[i]
+        if os.getpid() == self.pid:
+            return p.is_alive()
+        # is_alive() only works in the process that started the pool, and
+        # the HTTP workers are forks of it
+        return alive(p.pid)
+
+    def close(self):
+        for channel in self.channels:
+            channel.stop()
+        for p in self.processes:
+            p.join()
+
+
+class IngestApplication(object):
+    def __init__(self, application, pool, max_content_length=2 * 1024 * 1024):
+        self.application = application
+        self.pool = pool
+        self.max_content_length = max_content_length
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            return self.application(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH') or '0')
+        if length > self.max_content_length:
+            return self._reply(start_response, '413 Request Entity Too Large',
+                               fault('Client', 'Request body is too long'))
+
+        body = environ['wsgi.input'].read(length)
+        m = OPERATION.search(body)
+        if m is None or m.group(1) != b'publish':
+            environ['wsgi.input'] = BytesIO(body)
+            return self.application(environ, start_response)
+
+        try:
+            self.pool.submit(body)
+        except PoolBusy as e:
+            log.warning('reject publish: %s', e)
+            return self._reply(start_response, '503 Service Unavailable',
+                               fault('Server', str(e)))
+
+        return self._reply(start_response, '200 OK', response(0))
+
+    def _reply(self, start_response, status, body):
+        start_response(status, [('Content-Type', 'text/xml; charset=utf-8'),
+                                 ('Content-Length', str(len(body)))])
+        return [body]
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import errno
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS = {
+    'publiccommons_stage_seconds': (
+        'histogram', 'Time spent in each publish stage'),
+    'publiccommons_http_request_seconds': (
+        'histogram', 'Time spent in each WSGI layer'),
+    'publiccommons_http_requests_total': (
+        'counter', 'HTTP requests by method and status'),
+    'publiccommons_messages_total': (
+        'counter', 'Published messages by category and distributionStatus'),
+    'publiccommons_upsert_skipped_total': (
+        'counter', 'Upserts skipped because the revision was not newer'),
+    'publiccommons_errors_total': (
+        'counter', 'Errors raised while publishing'),
+    'publiccommons_duplicates_total': (
+        'counter', 'Redelivered messages answered from the dedupe cache'),
+    'publiccommons_revision_cache_total': (
+        'counter', 'Revision cache lookups by result'),
+    'publiccommons_kvs_connections_total': (
+        'counter', 'NC-KVS connection pool events'),
+    'publiccommons_kvs_retries_total': (
+        'counter', 'NC-KVS searches retried after an error'),
+    'publiccommons_index_errors_total': (
+        'counter', 'Accepted documents that could not be indexed'),
+    'publiccommons_ingest_rerouted_total': (
+        'counter', 'Publish bodies routed away from a dead ingest worker'),
+    'publiccommons_spool_records_total': (
+        'counter', 'Records appended to and replayed from the local spool'),
+    'publiccommons_admission_shed_total': (
+        'counter', 'Publish requests shed with a retryable fault by lane'),
+    'publiccommons_admission_wait_seconds': (
+        'histogram', 'Time from arrival to admission by lane'),
+}
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            # exited, but not reaped yet by the process that started it
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+        k, unicode(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry(object):
+    def __init__(self, directory=None, flush_interval=1.0,
+                 buckets=DEFAULT_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.flushed = 0
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def _check_pid(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.flushed = 0
+            self.reset()
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            self._check_pid()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            self._check_pid()
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            self._check_pid()
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[n, list(l), v]
+                             for (n, l), v in self.counters.items()],
+                'histograms': [[n, list(l), list(v)]
+                               for (n, l), v in self.histograms.items()]
+            }
+
+    def flush(self, force=False):
+        if self.directory is None:
+            return
+        with self.lock:
+            self._check_pid()
+        if not force and time.time() - self.flushed < self.flush_interval:
+            return
+
+        path = self._path(self.pid)
+        if not self.flushed:
+            # a file left by an earlier process with this pid is retired
+            # first, so that the counters never go down
+            with self._locked():
+                if os.path.exists(path):
+                    self._retire([path])
+
+        self.flushed = time.time()
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.rename(tmp, path)
+
+    def collect(self):
+        if self.directory is None:
+            return [self.snapshot()]
+
+        self.flush(force=True)
+        with self._locked():
+            dead = []
+            for path in self._paths():
+                pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+                if pid.isdigit() and int(pid) != self.pid and \
+                        not alive(int(pid)):
+                    dead.append(path)
+            if dead:
+                self._retire(dead)
+
+            snapshots = []
+            for path in self._paths():
+                snapshot = self._load(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+
+        return snapshots
+
+    def merge(self, snapshots):
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(x) for x in labels))
+                counters[key] = counters.get(key, 0) + value
+            if snapshot['buckets'] != list(self.buckets):
+                continue
+            for name, labels, value in snapshot['histograms']:
+                key = (name, tuple(tuple(x) for x in labels))
+                current = histograms.setdefault(key, [0] * len(value))
+                histograms[key] = [a + b for a, b in zip(current, value)]
+
+        return counters, histograms
+
+    def _path(self, name):
+        return os.path.join(self.directory, 'metrics-{0}.json'.format(name))
+
+    def _paths(self):
+        return glob.glob(os.path.join(self.directory, 'metrics-*.json'))
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            log.warning('skip unreadable metrics file %s', path)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, '.metrics.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _retire(self, paths):
+        # the totals of exited workers are kept in one file
+        retired = self._path('retired')
+        snapshots = [self._load(p) for p in [retired] + paths
+                     if os.path.exists(p)]
+        counters, histograms = self.merge(s for s in snapshots if s)
+        tmp = retired + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'buckets': list(self.buckets),
+                'counters': [[n, list(l), v]
+                             for (n, l), v in counters.items()],
+                'histograms': [[n, list(l), v]
+                               for (n, l), v in histograms.items()]
+            }, f)
+        os.rename(tmp, retired)
+        for path in paths:
+            os.remove(path)
+
+    def render(self):
+        counters, histograms = self.merge(self.collect())
+
+        lines = []
+        names = sorted(set(n for n, _ in counters) | set(n for n, _ in histograms))
+        for name in names:
+            type_, help_ = METRICS.get(name, (None, None))
+            if help_:
+                lines.append('# HELP {0} {1}'.format(name, help_))
+            if type_:
+                lines.append('# TYPE {0} {1}'.format(name, type_))
+
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append('{0}{1} {2}'.format(
+                        name, _format_labels(labels), _format_value(value)))
+
+            for (n, labels), value in sorted(histograms.items()):
+                if n != name:
+                    continue
+                bounds = list(self.buckets) + [float('inf')]
+                counts = value[:len(self.buckets)] + [value[-2]]
+                for bound, count in zip(bounds, counts):
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        name, _format_labels(labels, [('le', _format_value(bound))]),
+                        count))
+                lines.append('{0}_sum{1} {2}'.format(
+                    name, _format_labels(labels), _format_value(value[-1])))
+                lines.append('{0}_count{1} {2}'.format(
+                    name, _format_labels(labels), value[-2]))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def configure(directory=None, flush_interval=1.0):
+    global registry
+    registry = Registry(directory, flush_interval)
+    return registry
+
+
+class MetricsMiddleware(object):
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, application, path='/metrics'):
+        self.application = application
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.path and \
+                environ['REQUEST_METHOD'] == 'GET':
+            body = registry.render().encode('utf-8')
+            start_response('200 OK', [('Content-Type', self.content_type),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+
+        method = environ['REQUEST_METHOD']
+        status = []
+
+        def _start_response(status_, headers, exc_info=None):
+            status.append(status_.split(' ', 1)[0])
+            return start_response(status_, headers, exc_info)
+
+        try:
+            with registry.timer('publiccommons_http_request_seconds',
+                                layer='wsgi'):
+                return self.application(environ, _start_response)
+        finally:
+            registry.incr('publiccommons_http_requests_total', method=method,
+                          status=status[0] if status else '500')
+            registry.flush()
+
+
+class TimedApplication(object):
+    def __init__(self, application, layer):
+        self.application = application
+        self.layer = layer
+
+    def __call__(self, environ, start_response):
+        with registry.timer('publiccommons_http_request_seconds',
+                            layer=self.layer):
+            return self.application(environ, start_response)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import errno
+import Queue
+import socket
+import urllib
+import httplib
+import logging
+import urllib2
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+
+from publiccommons import metrics
+from publiccommons.writebehind import bulk_upsert
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_ERRORS = (socket.error, httplib.HTTPException)
+STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+class ConnectionPool(object):
+    def __init__(self, scheme, host, port=None, size=10, timeout=5.0,
+                 retries=2, backoff=0.1):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = Queue.LifoQueue(size)
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ('created', 'reused', 'discarded', 'requests', 'retries',
+             'errors'), 0)
+
+    def _count(self, event):
+        with self.lock:
+            self.counts[event] += 1
+        if event != 'requests':
+            metrics.registry.incr('publiccommons_kvs_connections_total',
+                                  event=event)
+
+    def _get(self):
+        try:
+            conn = self.idle.get_nowait()
+            self._count('reused')
+            return conn, True
+        except Queue.Empty:
+            pass
+
+        cls = httplib.HTTPSConnection if self.scheme == 'https' \
+            else httplib.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.timeout)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._count('created')
+        return conn, False
+
+    def _put(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+            self._count('discarded')
+
+    def request(self, method, path, body=None, headers=None, idempotent=None):
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        self._count('requests')
+        attempt = 0
+        fresh = False
+        while True:
+            conn = reused = None
+            sent = False
+            try:
+                conn, reused = self._get()
+                conn.request(method, path, body, headers or {})
+                sent = True
+                res = conn.getresponse()
+                data = res.read()
+            except RETRY_ERRORS as e:
+                if conn is not None:
+                    conn.close()
+                if isinstance(e, socket.timeout):
+                    # the server may still be working on it
+                    self._count('errors')
+                    raise
+                # the server may have closed idle keep-alive connections;
+                # retry once on a fresh one, unless a request that is not
+                # idempotent may have reached it
+                if reused and not fresh and (not sent or idempotent) and \
+                        self._stale(e):
+                    fresh = True
+                    self.close()
+                    self._count('retries')
+                    continue
+                if not idempotent or attempt >= self.retries:
+                    self._count('errors')
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                self._count('retries')
+                continue
+
+            if res.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return res, data
+
+    def _stale(self, e):
+        if isinstance(e, httplib.BadStatusLine):
+            return True
+        return isinstance(e, socket.error) and e.errno in STALE_ERRNOS
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, idle=self.idle.qsize(), size=self.size)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Queue.Empty:
+                return
+
+
+class PooledHandler(urllib2.BaseHandler):
+    handler_order = 400
+
+    def __init__(self, size=10, timeout=5.0, retries=2, backoff=0.1,
+                 scoped=False):
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # a scoped handler only serves requests made within scope(), and
+        # leaves the others to the next HTTP handler of the opener
+        self.scoped = scoped
+        self.local = threading.local()
+        self.pools = {}
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def scope(self):
+        active = getattr(self.local, 'active', False)
+        self.local.active = True
+        self.local.used = False
+        try:
+            yield
+        finally:
+            self.local.active = active
+
+    def used(self):
+        return getattr(self.local, 'used', False)
+
+    def pool(self, scheme, host):
+        key = (scheme, host)
+        with self.lock:
+            if self.pid != os.getpid():
+                # connections opened before a fork belong to the parent
+                self.pid = os.getpid()
+                self.pools = {}
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(
+                    scheme, host, size=self.size, timeout=self.timeout,
+                    retries=self.retries, backoff=self.backoff)
+            return self.pools[key]
+
+    def _open(self, scheme, req):
+        if self.scoped and not getattr(self.local, 'active', False):
+            return None
+        self.local.used = True
+
+        headers = dict(self.parent.addheaders)
+        headers.update(req.headers)
+        headers.update(req.unredirected_hdrs)
+        headers = dict((k.title(), v) for k, v in headers.items())
+        headers.pop('Connection', None)
+
+        res, data = self.pool(scheme, req.get_host()).request(
+            req.get_method(), req.get_selector(), req.get_data(), headers)
+        resp = urllib.addinfourl(BytesIO(data), res.msg, req.get_full_url(),
+                                 res.status)
+        resp.msg = res.reason
+        return resp
+
+    def http_open(self, req):
+        return self._open('http', req)
+
+    def https_open(self, req):
+        return self._open('https', req)
+
+    def stats(self):
+        with self.lock:
+            pools = self.pools.items()
+        return dict(('{0}://{1}'.format(*key), pool.stats())
+                    for key, pool in pools)
+
+
+def install(size=10, timeout=5.0, retries=2, backoff=0.1):
+    # nckvsclient has no way to pass it an opener, so the handler is
+    # installed for urllib2.urlopen and only used within PooledClient calls
+    handler = PooledHandler(size, timeout, retries, backoff, scoped=True)
+    urllib2.install_opener(urllib2.build_opener(handler))
+    return handler
+
+
+class PooledClient(object):
+    def __init__(self, client, handler):
+        self.client = client
+        self.handler = handler
+        self.warned = False
+
+    def _call(self, method, *args, **kwargs):
+        with self.handler.scope():
+            result = method(*args, **kwargs)
+            if not self.handler.used() and not self.warned:
+                self.warned = True
+                log.warning('NC-KVS client did not request through urllib2; '
+                            'its connections are not pooled')
+        return result
+
+    def search(self, conditions):
+        return self._call(self.client.search, conditions)
+
+    def set(self, records):
+        return self._call(self.client.set, records)
+
+    def upsert(self, data, key, cmp=None):
+        return self._call(self.client.upsert, data, key, cmp=cmp)
+
+
+class RetryingClient(object):
+    def __init__(self, client, retries=2, backoff=0.1):
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+
+    def search(self, conditions):
+        attempt = 0
+        while True:
+            try:
+                return self.client.search(conditions)
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                log.warning('retry search (%d): %s', attempt + 1, e)
+                metrics.registry.incr('publiccommons_kvs_retries_total')
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+
+    def set(self, records):
+        return self.client.set(records)
+
+    def upsert(self, data, key, cmp=None):
+        return bulk_upsert(self, [(data, key, cmp)])
+
+
+class LazyClient(object):
+    def __init__(self, factory, *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.client = self.factory(*self.args, **self.kwargs)
+                    self.pid = os.getpid()
+        return self.client
+
+    def search(self, conditions):
+        return self.get().search(conditions)
+
+    def set(self, records):
+        return self.get().set(records)
+
+    def upsert(self, data, key, cmp=None):
+        return self.get().upsert(data, key, cmp=cmp)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pstats
+import signal
+import logging
+import cProfile
+import threading
+
+from publiccommons.archive import sampled
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+log = logging.getLogger(__name__)
+
+MAX_DEPTH = 64
+
+
+def frame_name(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # built-in functions
+        return name
+    return '{0}:{1}'.format(os.path.basename(filename), name)
+
+
+def folded(stats, min_fraction=0.0005):
+    # paths under min_fraction of the total are dropped, which bounds the
+    # output however many requests were aggregated
+    min_time = sum(v[2] for v in stats.stats.values()) * min_fraction
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+
+    stacks = {}
+
+    def walk(func, path, share):
+        tt, ct = stats.stats[func][2:4]
+        path = path + (frame_name(func),)
+        if tt * share > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + tt * share
+        if len(path) >= MAX_DEPTH:
+            return
+
+        for callee, edge_ct in callees.get(func, {}).items():
+            callee_ct = stats.stats[callee][3]
+            # cProfile keeps caller -> callee edges but not whole stacks, so
+            # a callee's time is split between its callers by edge time
+            child_share = share * edge_ct / callee_ct if callee_ct else 0
+            if frame_name(callee) not in path and \
+                    callee_ct * child_share >= min_time:
+                walk(callee, path, child_share)
+
+    for func, value in stats.stats.items():
+        if not value[4]:
+            walk(func, (), 1.0)
+
+    return stacks
+
+
+def write_folded(path, stacks, scale):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        for stack, value in sorted(stacks.items()):
+            if int(value * scale):
+                f.write('{0} {1:d}\n'.format(stack, int(value * scale)))
+    os.rename(tmp, path)
+
+
+class ProfilingMiddleware(object):
+    def __init__(self, application, directory, enabled=False, sample_rate=0.01,
+                 min_size=None, toggle_path=None, flush_interval=60.0,
+                 trace_memory=False, frames=16, signum=signal.SIGUSR2):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.application = application
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.min_size = min_size
+        self.toggle_path = toggle_path
+        self.flush_interval = flush_interval
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.frames = frames
+        self.toggled = False
+        self.checked = 0
+        self.was_active = False
+        self.lock = threading.Lock()
+        self.reset()
+        if trace_memory and tracemalloc is None:
+            log.warning('tracemalloc is not available; profiling CPU only')
+        if signum is not None:
+            try:
+                signal.signal(signum, self.toggle)
+            except ValueError:
+                log.warning('not in the main thread; toggle profiling with %s',
+                            toggle_path)
+
+    def reset(self):
+        self.stats = None
+        self.memory = {}
+        self.profiled = 0
+        self.pid = os.getpid()
+        self.flushed = time.time()
+
+    def toggle(self, signum=None, frame=None):
+        # nothing else here: the interrupted frame may hold the lock that
+        # flush() takes
+        self.enabled = not self.enabled
+
+    def active(self):
+        active = self.enabled
+        if not active and self.toggle_path is not None:
+            # a stat() at most once a second keeps the disabled path cheap
+            now = time.time()
+            if now - self.checked >= 1.0:
+                self.checked = now
+                self.toggled = os.path.exists(self.toggle_path)
+            active = self.toggled
+
+        if active != self.was_active:
+            self.was_active = active
+            log.info('profiling %s', 'enabled' if active else 'disabled')
+            if not active:
+                # switched off by the signal or the toggle file since the
+                # last request
+                self.flush()
+        return active
+
+    def selected(self, environ):
+        if self.min_size is not None and \
+                int(environ.get('CONTENT_LENGTH') or '0') >= self.min_size:
+            return True
+        return sampled(self.sample_rate)
+
+    def __call__(self, environ, start_response):
+        if not self.active() or environ['REQUEST_METHOD'] != 'POST' or \
+                not self.selected(environ):
+            return self.application(environ, start_response)
+
+        return self.profile(environ, start_response)
+
+    def profile(self, environ, start_response):
+        before = None
+        if self.trace_memory:
+            tracemalloc.start(self.frames)
+            before = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        try:
+            # Spyne and the streaming front end do all of the work before
+            # they return the response body
+            return profile.runcall(self.application, environ, start_response)
+        finally:
+            after = None
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            self.record(profile, before, after)
+
+    def record(self, profile, before, after):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+            if after is not None:
+                for diff in after.compare_to(before, 'traceback'):
+                    if diff.size_diff > 0:
+                        key = ';'.join(
+                            '{0}:{1}'.format(os.path.basename(f.filename),
+                                             f.lineno)
+                            for f in reversed(diff.traceback))
+                        self.memory[key] = \
+                            self.memory.get(key, 0) + diff.size_diff
+
+            self.profiled += 1
+            due = time.time() - self.flushed >= self.flush_interval
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.stats is None:
+                return
+
+            prefix = os.path.join(self.directory,
+                                  'profile-{0}'.format(os.getpid()))
+            self.stats.dump_stats(prefix + '.pstats')
+            # microseconds, for flamegraph.pl and speedscope
+            write_folded(prefix + '.folded', folded(self.stats), 1e6)
+            if self.memory:
+                write_folded(prefix + '.memory.folded', self.memory, 1)
+            self.flushed = time.time()
+            log.info('profiled %d requests into %s', self.profiled, prefix)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import json
+import zlib
+import base64
+
+PREFIXES = {
+    'edxlde': 'e',
+    'commons': 'c',
+    'pcx_ib': 'i',
+    'pcx_eb': 'b',
+    'pcx_cns_i3': 'n',
+    'pcx_cns_i20': 'd',
+    'pcx_cns_i4': 'l',
+    'pcx_ev': 'v',
+    'pcxml': 'x'
+}
+CODES = {v: k for k, v in PREFIXES.items()}
+MARK = '#'
+ZLIB_HEADER = 'PCZ1:'
+
+
+def intern_keys(d):
+    r = {}
+    for key, value in d.iteritems():
+        prefix, sep, name = key.partition(':')
+        if sep and prefix in PREFIXES:
+            key = MARK + PREFIXES[prefix] + name
+        r[key] = intern_keys(value) if isinstance(value, dict) else value
+
+    return r
+
+
+def extern_keys(d):
+    r = {}
+    for key, value in d.iteritems():
+        if key.startswith(MARK) and key[1:2] in CODES:
+            key = '{0}:{1}'.format(CODES[key[1]], key[2:])
+        r[key] = extern_keys(value) if isinstance(value, dict) else value
+
+    return r
+
+
+def dumps(d):
+    return json.dumps(d, separators=(',', ':'), ensure_ascii=False)
+
+
+class Codec(object):
+    formats = ('dict', 'json', 'zlib')
+
+    def __init__(self, name='dict', level=6):
+        parts = name.split('+')
+        self.format = parts[0]
+        self.interned = 'interned' in parts[1:]
+        self.level = level
+        if self.format not in self.formats or \
+                set(parts[1:]) - set(['interned']):
+            raise ValueError('unknown rawdata encoding: {0}'.format(name))
+
+    def encode(self, d):
+        if self.interned:
+            d = intern_keys(d)
+        if self.format == 'dict':
+            return d
+
+        s = dumps(d)
+        if self.format == 'json':
+            return s
+
+        compressed = zlib.compress(s.encode('utf-8'), self.level)
+        return ZLIB_HEADER + base64.b64encode(compressed)
+
+    def decode(self, value):
+        return decode(value)
+
+
+def decode(value):
+    if isinstance(value, basestring):
+        if value.startswith(ZLIB_HEADER):
+            compressed = base64.b64decode(value[len(ZLIB_HEADER):])
+            value = zlib.decompress(compressed).decode('utf-8')
+        value = json.loads(value)
+
+    return extern_keys(value)
@@ -1,18 +1,24 @@
 # -*- coding: utf-8 -*-
 
-import re
 import json
+import bisect
+import random
 import logging
 
 import lxml.etree
 from spyne.decorator import srpc
 from spyne.service import ServiceBase
 from spyne.model.primitive import Integer, AnyXml
-from spyne.model.complex import ComplexModel
+from spyne.model.complex import ComplexModel, Array
 from spyne.application import Application
+from spyne.protocol import ProtocolBase
 from spyne.protocol.soap import Soap11
+from spyne.protocol.xml import SchemaValidationError
 from spyne.server.wsgi import WsgiApplication
 
+from publiccommons import metrics
+from publiccommons.rawdata import Codec
+
 TARGET_NAMESPACE = 'http://soap.publiccommons.ne.jp/'
 NS_MAP = {
     'edxlde': 'urn:oasis:names:tc:emergency:EDXL:DE:1.0',
@@ -21,8 +27,13 @@ NS_MAP = {
     'pcx_cns_i3': 'http://xml.publiccommons.ne.jp/pcxml1/informationBasis4/'
 }
 
+PUBLISH = '{{{0}}}publish'.format(TARGET_NAMESPACE)
+MESSAGE = '{{{0}}}message'.format(TARGET_NAMESPACE)
+
 log = logging.getLogger(__name__)
 nckvs = None
+schemas = {}
+codec = Codec()
 
 
 class ProcessResponse(ComplexModel):
@@ -36,6 +47,11 @@ class PublishResponse(ComplexModel):
     response = ProcessResponse
 
 
+class PublishBatchResponse(ComplexModel):
+    __namespace__ = TARGET_NAMESPACE
+    responses = Array(ProcessResponse)
+
+
 class MQService(ServiceBase):
     @srpc(AnyXml, _returns=PublishResponse)
     def publish(message):
@@ -43,45 +59,207 @@ class MQService(ServiceBase):
             return _publish(message)
         except Exception as e:
             log.exception(e)
+            metrics.registry.incr('publiccommons_errors_total',
+                                  type=e.__class__.__name__)
             raise
 
+    @srpc(AnyXml(max_occurs='unbounded'), _returns=PublishBatchResponse)
+    def publishBatch(message):
+        return _publish_batch(message or [])
+
 
 def _publish(message):
-    def exp(ns, name):
-        return '{{{0}}}{1}'.format(NS_MAP[ns], name)
-
-    root = parse(message)
-    content = root[exp('commons', 'contentObject')]
-    document = content.find(exp('edxlde', 'embeddedXMLContent'))
-    if document.find(exp('pcx_ib', 'Title')):
-        ns_ib = 'pcx_ib'
-    else:
-        ns_ib = 'pcx_cns_i3'
-
-    param = {
-        'status': root[exp('edxlde', 'distributionStatus')],
-        'document_id': content[exp('commons', 'documentID')],
-        'revision': content[exp('commons', 'documentRevision')],
-        'category': content[exp('commons', 'category')],
-        'area_code': root[exp('commons', 'targetArea')].get(exp('commons', 'jisX0402'), ''),
-        'title': document.find(exp(ns_ib, 'Title')),
-        'summary': document.find(exp(ns_ib, 'Headline')).get(exp(ns_ib, 'Text'), ''),
-        'rawdata': root.shorten()
-    }
+    with stage('extract'):
+        param = extract(message)
+    with stage('parse'):
+        tree = parser(message)
 
-    upsert(param)
+    store(param, tree)
     return PublishResponse(response=ProcessResponse(code=0))
 
 
+def _publish_batch(messages):
+    responses = [ProcessResponse(code=0) for _ in messages]
+    latest = {}
+    indexes = {}
+    for i, message in enumerate(messages):
+        try:
+            with stage('extract'):
+                param = extract(message)
+            revision = int(param['revision'])
+        except (KeyError, ValueError) as e:
+            log.warning('skip invalid message %d: %s', i, e)
+            metrics.registry.incr('publiccommons_errors_total',
+                                  type=e.__class__.__name__)
+            responses[i].code = 1
+            continue
+
+        document_id = param['document_id']
+        indexes.setdefault(document_id, []).append(i)
+        if document_id not in latest or latest[document_id][0] < revision:
+            latest[document_id] = (revision, i, param, message)
+
+    namespaces = Namespaces()
+    for _, i, param, message in sorted(latest.values(), key=lambda x: x[1]):
+        try:
+            with stage('parse'):
+                tree = parser(message)
+            store(param, tree, namespaces)
+        except Exception as e:
+            log.exception(e)
+            metrics.registry.incr('publiccommons_errors_total',
+                                  type=e.__class__.__name__)
+            for j in indexes[param['document_id']]:
+                responses[j].code = 1
+
+    return PublishBatchResponse(responses=responses)
+
+
+def store(param, tree, namespaces=None):
+    prepare(param, tree, namespaces)
+    with stage('upsert'):
+        upsert(param)
+
+
+def prepare(param, tree, namespaces=None):
+    metrics.registry.incr('publiccommons_messages_total',
+                          category=param['category'], status=param['status'])
+    with stage('shorten'):
+        if isinstance(tree, lxml.etree._Element):
+            short = flatten(tree, namespaces=namespaces)
+        else:
+            short = tree.shorten(namespaces)
+    with stage('encode'):
+        param['rawdata'] = codec.encode(short)
+    return param
+
+
+def stage(name):
+    return metrics.registry.timer('publiccommons_stage_seconds', stage=name)
+
+
+class Field(object):
+    required = object()
+
+    def __init__(self, *paths, **kwargs):
+        self.paths = paths
+        self.default = kwargs.get('default', self.required)
+        self.xpaths = [lxml.etree.XPath(path, namespaces=NS_MAP)
+                       for path in paths]
+        self.steps = [self._steps(path) for path in paths]
+
+    def __call__(self, elem):
+        if hasattr(elem, 'shorten'):
+            found = (self._lookup(elem, steps) for steps in self.steps)
+        else:
+            found = (self._xpath(elem, xpath) for xpath in self.xpaths)
+
+        for value in found:
+            if value is not self.required:
+                return value
+
+        if self.default is self.required:
+            raise KeyError(self.paths[0])
+        return self.default
+
+    def _xpath(self, elem, xpath):
+        found = xpath(elem)
+        # the last of repeated elements, as parse() keeps it
+        return found[-1].text if found else self.required
+
+    def _lookup(self, d, steps):
+        for descendant, tag in steps:
+            if not hasattr(d, 'shorten'):
+                return self.required
+
+            d = d.find(tag) if descendant else d.get(tag, self.required)
+            if d is None and descendant:
+                return self.required
+
+        return d
+
+    def _steps(self, path):
+        steps = []
+        descendant = False
+        for part in path.split('/'):
+            if not part:
+                descendant = True
+                continue
+
+            prefix, name = part.split(':')
+            steps.append((descendant, '{{{0}}}{1}'.format(NS_MAP[prefix], name)))
+            descendant = False
+
+        return steps
+
+
+CONTENT = 'commons:contentObject'
+DOCUMENT = CONTENT + '/edxlde:xmlContent/edxlde:embeddedXMLContent'
+
+FIELDS = {
+    'status': Field('edxlde:distributionStatus'),
+    'document_id': Field(CONTENT + '/commons:documentID'),
+    'revision': Field(CONTENT + '/commons:documentRevision'),
+    'category': Field(CONTENT + '/commons:category'),
+    'area_code': Field('commons:targetArea/commons:jisX0402', default=''),
+    'title': Field(DOCUMENT + '//pcx_ib:Title',
+                   DOCUMENT + '//pcx_cns_i3:Title', default=None),
+    'summary': Field(DOCUMENT + '//pcx_ib:Headline/pcx_ib:Text',
+                     DOCUMENT + '//pcx_cns_i3:Headline/pcx_cns_i3:Text',
+                     default='')
+}
+
+REQUIRED = [field for field in FIELDS.values() if field.default is Field.required]
+
+
+def extract(elem):
+    return {name: field(elem) for name, field in FIELDS.items()}
+
+
+class TagIndex(object):
+    def __init__(self):
+        self.positions = {}
+        self.values = {}
+        self.size = 0
+
+    def reserve(self, tag):
+        self.positions.setdefault(tag, []).append(self.size)
+        values = self.values.setdefault(tag, [])
+        values.append(None)
+        self.size += 1
+        return values, len(values) - 1
+
+    def _range(self, tag, start, end):
+        positions = self.positions.get(tag, ())
+        lo = bisect.bisect_left(positions, start)
+        hi = bisect.bisect_left(positions, end, lo)
+        return self.values[tag][lo:hi] if lo < hi else []
+
+    def first(self, tag, start, end):
+        for value in self._range(tag, start, end):
+            if value:
+                return value
+
+        return None
+
+    def all(self, tag, start, end):
+        return self._range(tag, start, end)
+
+
 class XMLDict(dict):
     def __init__(self, ns=None):
         super(XMLDict, self).__init__()
         self.ns = ns or {}
+        self.index = None
+        self.span = None
 
     def find(self, key):
         if key in self:
             return self[key]
 
+        if self.index is not None:
+            return self.index.first(key, *self.span)
+
         for v in (x for x in self.values() if isinstance(x, XMLDict)):
             r = v.find(key)
             if r:
@@ -89,11 +267,27 @@ class XMLDict(dict):
 
         return None
 
-    def shorten(self):
-        elem = ShortXMLDict(self.ns)
+    def findall(self, key):
+        if self.index is not None:
+            return self.index.all(key, *self.span)
+
+        found = []
+        for k, v in self.items():
+            if k == key:
+                found.append(v)
+            if isinstance(v, XMLDict):
+                found.extend(v.findall(key))
+
+        return found
+
+    def shorten(self, namespaces=None):
+        if namespaces is None:
+            namespaces = Namespaces()
+
+        elem = ShortXMLDict(self.ns, namespaces)
         for key, value in self.iteritems():
             if isinstance(value, XMLDict):
-                value = value.shorten()
+                value = value.shorten(namespaces)
             elem[key] = value
 
         return elem
@@ -115,46 +309,127 @@ class XMLDict(dict):
         return s
 
 
-class ShortXMLDict(XMLDict):
-    namespace_re = re.compile(r'{([^}]+)}(.+)')
+class Namespaces(object):
+    def __init__(self):
+        self.caches = {}
 
-    def __init__(self, ns=None):
+    def cache(self, ns):
+        # lxml builds a new nsmap on every access, so entries are keyed by
+        # contents for a shared instance to hit across documents
+        key = tuple(sorted(ns.items()))
+        entry = self.caches.get(key)
+        if entry is None:
+            rns = {v: k for k, v in ns.items()}
+            if None in ns:
+                rns[ns[None]] = None
+            entry = self.caches[key] = (ns, rns, {})
+
+        return entry
+
+    def resolve(self, rns, name):
+        if not name.startswith('{'):
+            return name
+
+        uri, _, local = name[1:].partition('}')
+        alias = rns.get(uri)
+        if alias:
+            name = '{}:{}'.format(alias, local)
+        else:
+            name = local
+
+        return intern(name) if isinstance(name, str) else name
+
+
+class ShortXMLDict(XMLDict):
+    def __init__(self, ns=None, namespaces=None):
         super(ShortXMLDict, self).__init__(ns)
-        self.rns = {v: k for k, v in self.ns.items()}
-        if None in self.ns:
-            self.rns[self.ns[None]] = None
+        self.namespaces = namespaces or Namespaces()
+        _, self.rns, self.names = self.namespaces.cache(self.ns)
 
     def __setitem__(self, key, value):
         if isinstance(value, XMLDict):
             # keys must evalueted in child element's namespaces
             # because a default namespace is also applied on a declared tag
-            key = value.resolve(key)
+            key = value.names.get(key) or value.resolve(key)
         else:
-            key = self.resolve(key)
-        super(XMLDict, self).__setitem__(key, value)
+            key = self.names.get(key) or self.resolve(key)
+        dict.__setitem__(self, key, value)
 
     def resolve(self, name):
-        m = self.namespace_re.match(name)
-        if not m:
-            return name
+        resolved = self.names.get(name)
+        if resolved is None:
+            resolved = self.names[name] = \
+                self.namespaces.resolve(self.rns, name)
 
-        alias = self.rns.get(m.group(1))
-        if alias:
-            return '{}:{}'.format(alias, m.group(2))
-        else:
-            return m.group(2)
+        return resolved
 
 
 def parse(elem):
-    d = XMLDict(elem.nsmap)
+    return _parse(elem, None)
+
+
+def _parse(elem, parent_ns):
+    ns = elem.nsmap
+    if ns == parent_ns:
+        # share the parent's nsmap so that the tree keeps one per scope
+        ns = parent_ns
+
+    d = XMLDict(ns)
     for el in (x for x in elem if not isinstance(x, lxml.etree._Comment)):
-        d[el.tag] = parse(el) if len(el) > 0 else el.text
+        d[el.tag] = _parse(el, ns) if len(el) > 0 else el.text
 
     return d
 
 
+parser = parse
+
+
+def flatten(elem, encoding=None, namespaces=None):
+    return _flatten(elem, encoding, namespaces or Namespaces(), None)[1]
+
+
+def _flatten(elem, encoding, namespaces, parent_ns):
+    ns = elem.nsmap
+    if ns == parent_ns:
+        ns = parent_ns
+    _, rns, names = namespaces.cache(ns)
+
+    # collect children in a dict first so that repeated and colliding
+    # tags resolve exactly as parse(elem).shorten() does
+    children = {}
+    for el in elem:
+        if not isinstance(el, lxml.etree._Comment):
+            children[el.tag] = el
+
+    d = {}
+    for tag, el in children.iteritems():
+        if len(el) > 0:
+            key, value = _flatten(el, encoding, namespaces, ns)
+        else:
+            key = _short_name(tag, rns, names, namespaces, encoding)
+            value = el.text
+            if encoding is not None and isinstance(value, unicode):
+                value = value.encode(encoding)
+        d[key] = value
+
+    return _short_name(elem.tag, rns, names, namespaces, encoding), d
+
+
+def _short_name(tag, rns, names, namespaces, encoding):
+    name = names.get(tag)
+    if name is None:
+        name = names[tag] = namespaces.resolve(rns, tag)
+    if encoding is not None and isinstance(name, unicode):
+        return name.encode(encoding)
+    return name
+
+
 def is_new_revision(old, new_):
-    return int(old['revision']) < int(new_['revision'])
+    if int(old['revision']) < int(new_['revision']):
+        return True
+
+    metrics.registry.incr('publiccommons_upsert_skipped_total')
+    return False
 
 
 def upsert(data):
@@ -162,16 +437,81 @@ def upsert(data):
     return nckvs.upsert(data, 'document_id', cmp=is_new_revision)
 
 
-def get_app(kvsclient):
+class PublishSoap11(Soap11):
+    validations = ('full', 'envelope', 'sampled')
+
+    def __init__(self, validation='full', sample_rate=1.0, **kwargs):
+        if validation not in self.validations:
+            raise ValueError('unknown validation: {0}'.format(validation))
+
+        self.validation = validation
+        self.sample_rate = sample_rate
+        super(PublishSoap11, self).__init__(validator='lxml', **kwargs)
+
+    def set_app(self, value):
+        key = None if value is None else (value.tns, tuple(value.services))
+        if key in schemas:
+            ProtocolBase.set_app(self, value)
+            self.validation_schema = schemas[key]
+            return
+
+        super(PublishSoap11, self).set_app(value)
+        if key is not None:
+            schemas[key] = self.validation_schema
+
+    def set_validator(self, validator):
+        super(PublishSoap11, self).set_validator(validator)
+        self.validate_schema = self.validate_document
+        self.validate_document = self.validate
+
+    def validate(self, payload):
+        if self.validation == 'full' or payload.tag != PUBLISH:
+            return self.validate_schema(payload)
+        if self.validation == 'sampled' and random.random() < self.sample_rate:
+            return self.validate_schema(payload)
+
+        message = payload.find(MESSAGE)
+        if message is None or len(message) != 1:
+            raise SchemaValidationError(
+                'publish must contain exactly one message element')
+        try:
+            for field in REQUIRED:
+                field(message[0])
+        except KeyError as e:
+            raise SchemaValidationError('{0} is required'.format(e.args[0]))
+
+
+def get_app(kvsclient, rawdata_codec=None, validation='full', sample_rate=1.0,
+            tree='dict', wsdl_url=None):
     import sys
+    from publiccommons import compact
+    parsers = {
+        'dict': parse,
+        'compact': compact.parse,
+        # prepare() flattens the element itself in one pass
+        'fused': lambda elem: elem
+    }
+    if tree not in parsers:
+        raise ValueError('unknown tree: {0}'.format(tree))
+
     setattr(sys.modules[__name__], 'nckvs', kvsclient)
+    setattr(sys.modules[__name__], 'codec', rawdata_codec or Codec())
+    setattr(sys.modules[__name__], 'parser', parsers[tree])
 
+    in_protocol = PublishSoap11(validation, sample_rate)
     application = Application([MQService], TARGET_NAMESPACE,
-                              in_protocol=Soap11(validator='lxml'),
+                              in_protocol=in_protocol,
                               out_protocol=Soap11())
 
     # set block_length same as max_content_length
     # because splitting inappropriate position causes UnicodeDecodeError
-    return WsgiApplication(application,
-                           max_content_length=2 * 1024 * 1024,
-                           block_length=2 * 1024 * 1024)
+    wsgi_app = WsgiApplication(application,
+                               max_content_length=2 * 1024 * 1024,
+                               block_length=2 * 1024 * 1024)
+    if wsdl_url:
+        # build the WSDL now instead of on the first ?wsdl request, so that
+        # workers forked from a preloading master share it
+        wsgi_app.doc.wsdl11.build_interface_document(wsdl_url)
+        wsgi_app._wsdl = wsgi_app.doc.wsdl11.get_interface_document()
+
+    return wsgi_app
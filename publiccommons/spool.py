@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import mmap
+import time
+import zlib
+import fcntl
+import atexit
+import struct
+import urllib2
+import httplib
+import logging
+import argparse
+import threading
+
+from publiccommons import metrics
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<II')
+FSYNC_POLICIES = ('always', 'interval', 'never')
+CHECKPOINT = 'checkpoint.json'
+LOCK = 'replay.lock'
+REJECTED = 'rejected'
+
+
+def checksum(payload):
+    return zlib.crc32(payload) & 0xffffffff
+
+
+class Segment(object):
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.offset = 0
+        # lock before the segment becomes visible to the replayer, which
+        # removes closed segments once it has read them
+        self.file = open(path + '.tmp', 'w+b')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        os.rename(path + '.tmp', path)
+
+    def append(self, payload):
+        end = self.offset + HEADER.size + len(payload)
+        if end > self.size:
+            return False
+
+        # the header goes last so that a reader never sees a length
+        # before the payload behind it is complete
+        self.mm[self.offset + HEADER.size:end] = payload
+        self.mm[self.offset:self.offset + HEADER.size] = HEADER.pack(
+            len(payload), checksum(payload))
+        self.offset = end
+        return True
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+def is_active(path):
+    with open(path, 'rb') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return True
+    return False
+
+
+def read_segment(path, offset=0):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            while offset + HEADER.size <= size:
+                length, crc = HEADER.unpack_from(mm, offset)
+                start = offset + HEADER.size
+                if length == 0 or start + length > size:
+                    return
+                payload = mm[start:start + length]
+                if checksum(payload) != crc:
+                    log.warning('broken record at %s:%d', path, offset)
+                    return
+                offset = start + length
+                yield offset, json.loads(payload)
+        finally:
+            mm.close()
+
+
+def unavailable(e):
+    # NC-KVS or the network failing, as opposed to a record it rejects
+    if isinstance(e, urllib2.HTTPError):
+        return e.code >= 500
+    return isinstance(e, (EnvironmentError, httplib.HTTPException))
+
+
+def segment_names(directory):
+    return sorted(os.path.basename(p)
+                  for p in glob.glob(os.path.join(directory, '*.seg')))
+
+
+class Spool(object):
+    def __init__(self, directory, segment_size=64 * 1024 * 1024,
+                 fsync='interval', fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('unknown fsync policy: {0}'.format(fsync))
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment = None
+        self.synced = 0
+        self.dirty = False
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _roll(self, size):
+        if self.segment is not None:
+            self.segment.close()
+        name = '{0:016d}-{1}.seg'.format(int(time.time() * 1e6), os.getpid())
+        self.segment = Segment(os.path.join(self.directory, name),
+                               max(size, self.segment_size))
+
+    def append(self, record):
+        payload = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.segment = None
+            if self.segment is None or not self.segment.append(payload):
+                self._roll(HEADER.size + len(payload))
+                self.segment.append(payload)
+
+            if self.fsync == 'always' or (
+                    self.fsync == 'interval' and
+                    time.time() - self.synced >= self.fsync_interval):
+                self.segment.flush()
+                self.synced = time.time()
+                self.dirty = False
+            else:
+                self.dirty = True
+
+    def sync(self):
+        # with the interval policy the last records appended are only
+        # flushed by a later append, or by this
+        with self.lock:
+            if self.fsync == 'interval' and self.dirty and \
+                    self.pid == os.getpid() and \
+                    time.time() - self.synced >= self.fsync_interval:
+                self.segment.flush()
+                self.synced = time.time()
+                self.dirty = False
+
+    def close(self):
+        with self.lock:
+            if self.segment is not None and self.pid == os.getpid():
+                self.segment.close()
+            self.segment = None
+
+
+class Replayer(object):
+    def __init__(self, directory, client, cmp=None, max_failures=5):
+        self.directory = directory
+        self.client = client
+        self.cmp = cmp
+        self.max_failures = max_failures
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT)
+        self.lock_file = None
+        self.failure = None
+
+    def acquire(self):
+        if self.lock_file is not None:
+            return True
+
+        f = open(os.path.join(self.directory, LOCK), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            f.close()
+            return False
+        self.lock_file = f
+        return True
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_checkpoint(self, checkpoint):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(tmp, self.checkpoint_path)
+
+    def drain(self):
+        checkpoint = self.load_checkpoint()
+        names = segment_names(self.directory)
+        replayed = 0
+        try:
+            for name in names:
+                path = os.path.join(self.directory, name)
+                active = is_active(path)
+                for offset, record in read_segment(path,
+                                                   checkpoint.get(name, 0)):
+                    try:
+                        self.client.upsert(record['data'], record['key'],
+                                           cmp=self.cmp)
+                    except Exception as e:
+                        if not self.rejected((name, offset), e):
+                            raise
+                        self.reject(record, e)
+                    else:
+                        replayed += 1
+                        metrics.registry.incr(
+                            'publiccommons_spool_records_total',
+                            event='replayed')
+                    checkpoint[name] = offset
+
+                if not active:
+                    os.remove(path)
+                    checkpoint.pop(name, None)
+        finally:
+            for name in set(checkpoint) - set(names):
+                del checkpoint[name]
+            self.save_checkpoint(checkpoint)
+
+        return replayed
+
+    def rejected(self, position, e):
+        if unavailable(e):
+            self.failure = None
+            return False
+
+        failures = 1
+        if self.failure is not None and self.failure[0] == position:
+            failures = self.failure[1] + 1
+        self.failure = (position, failures)
+        return failures >= self.max_failures
+
+    def reject(self, record, e):
+        # kept in a spool of its own that the command line can show and
+        # replay, so that one record does not hold up all the others
+        log.error('reject spooled %s %s after %d failures: %s',
+                  record['key'], record['data'].get(record['key']),
+                  self.max_failures, e)
+        directory = os.path.join(self.directory, REJECTED)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        rejected = Spool(directory, 64 * 1024, 'always')
+        rejected.append(record)
+        rejected.close()
+        self.failure = None
+        metrics.registry.incr('publiccommons_spool_records_total',
+                              event='rejected')
+
+
+class SpoolClient(object):
+    def __init__(self, client, directory, segment_size=64 * 1024 * 1024,
+                 fsync='interval', fsync_interval=1.0, poll=0.5, cmp=None,
+                 max_failures=5):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.spool = Spool(directory, segment_size, fsync, fsync_interval)
+        self.replayer = Replayer(directory, client, cmp, max_failures)
+        self.poll = poll
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+        self.pid = None
+
+    def upsert(self, data, key, cmp=None):
+        self._ensure_started()
+        self.spool.append({'key': key, 'data': data})
+        metrics.registry.incr('publiccommons_spool_records_total',
+                              event='appended')
+        with self.cond:
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.spool.close()
+        self.replayer.release()
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+
+        with self.cond:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.replayer.lock_file = None
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        delay = self.poll
+        retry = 0
+        while True:
+            with self.cond:
+                if self.closed:
+                    return
+                self.cond.wait(min(delay, self.spool.fsync_interval))
+                if self.closed:
+                    return
+
+            self.spool.sync()
+            if time.time() < retry or not self.replayer.acquire():
+                continue
+
+            try:
+                self.replayer.drain()
+                delay = self.poll
+                retry = 0
+            except Exception as e:
+                log.exception(e)
+                metrics.registry.incr('publiccommons_spool_records_total',
+                                      event='failed')
+                delay = min(delay * 2, 30.0)
+                retry = time.time() + delay
+
+
+def build_client(config_path):
+    from ConfigParser import SafeConfigParser
+    from nckvsclient import KVSClient
+
+    parser = SafeConfigParser()
+    parser.read(config_path)
+    config = dict(parser.items('nckvs'))
+    config['datatypeversion'] = int(config.get('datatypeversion', '1'))
+    config.pop('rawdata_encoding', None)
+    return KVSClient(**config)
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        prog='python -m publiccommons.spool',
+        description='Inspect and replay spool segments.')
+    parser.add_argument('directory')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('list', help='list segments and replay progress')
+    show = sub.add_parser('show', help='print the records of a segment')
+    show.add_argument('segment')
+    show.add_argument('--all', action='store_true',
+                      help='include records that were already replayed')
+    replay = sub.add_parser('replay', help='upsert pending records to NC-KVS')
+    replay.add_argument('--config', required=True,
+                        help='publiccommons.ini with an [nckvs] section')
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(args.directory, None)
+    checkpoint = replayer.load_checkpoint()
+    if args.command == 'list':
+        for name in segment_names(args.directory):
+            path = os.path.join(args.directory, name)
+            done = checkpoint.get(name, 0)
+            records = pending = 0
+            for offset, _ in read_segment(path):
+                records += 1
+                pending += offset > done
+            out.write('{0}\t{1}\t{2}\t{3}\t{4}\n'.format(
+                name, os.path.getsize(path), records, pending,
+                'active' if is_active(path) else 'closed'))
+
+    elif args.command == 'show':
+        name = os.path.basename(args.segment)
+        offset = 0 if args.all else checkpoint.get(name, 0)
+        for end, record in read_segment(
+                os.path.join(args.directory, name), offset):
+            out.write(json.dumps(record, sort_keys=True) + '\n')
+
+    elif args.command == 'replay':
+        from publiccommons.soap import is_new_revision
+        replayer = Replayer(args.directory, build_client(args.config),
+                            is_new_revision)
+        if not replayer.acquire():
+            parser.error('another process is replaying this spool')
+        out.write('replayed {0} records\n'.format(replayer.drain()))
+
+
+if __name__ == '__main__':
+    main()
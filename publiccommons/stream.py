@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from io import BytesIO
+
+import lxml.etree
+
+from publiccommons import soap, metrics
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+BODY = '{{{0}}}Body'.format(SOAP_ENV)
+PUBLISH = soap.PUBLISH
+MESSAGE = soap.MESSAGE
+
+RESPONSE = (
+    "<?xml version='1.0' encoding='UTF-8'?>\n"
+    '<soap11env:Envelope xmlns:soap11env="{0}" xmlns:tns="{1}">'
+    '<soap11env:Body><tns:publishResponse><tns:publishResult>'
+    '<tns:response><tns:code>{{code}}</tns:code></tns:response>'
+    '</tns:publishResult></tns:publishResponse></soap11env:Body>'
+    '</soap11env:Envelope>'
+).format(SOAP_ENV, soap.TARGET_NAMESPACE)
+
+FAULT = (
+    "<?xml version='1.0' encoding='UTF-8'?>\n"
+    '<soap11env:Envelope xmlns:soap11env="{0}"><soap11env:Body>'
+    '<soap11env:Fault><faultcode>soap11env:{{code}}</faultcode>'
+    '<faultstring>{{string}}</faultstring><faultactor></faultactor>'
+    '</soap11env:Fault></soap11env:Body></soap11env:Envelope>'
+).format(SOAP_ENV)
+
+log = logging.getLogger(__name__)
+
+
+class StreamError(Exception):
+    pass
+
+
+def response(code=0):
+    return RESPONSE.format(code=code)
+
+
+def fault(code, string):
+    text = (string.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;'))
+    return FAULT.format(code=code, string=text)
+
+
+class UnsupportedOperation(StreamError):
+    pass
+
+
+class StreamParser(object):
+    def __init__(self):
+        self.parser = lxml.etree.XMLPullParser(
+            events=('start', 'end', 'comment'))
+        self.index = soap.TagIndex()
+        self.stack = []
+        self.root = None
+        self.operation = None
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self._consume()
+
+    def close(self):
+        self.parser.close()
+        self._consume()
+        if self.operation is None:
+            raise StreamError('No operation was found')
+        if self.root is None:
+            raise StreamError('No message element was found')
+
+        return self.root
+
+    def _consume(self):
+        for event, el in self.parser.read_events():
+            if event == 'start':
+                self._start(el)
+            elif event == 'end':
+                self._end(el)
+            elif self.stack:
+                self._child(self.stack[-1])
+
+    def _start(self, el):
+        if self.stack:
+            self._child(self.stack[-1])
+            reserved = self.index.reserve(el.tag)
+            self.stack.append([el, None, reserved, self.index.size])
+            return
+
+        parent = el.getparent()
+        if parent is None or self.root is not None:
+            return
+
+        if parent.tag == BODY:
+            self.operation = el.tag
+            if el.tag != PUBLISH:
+                raise UnsupportedOperation(
+                    '{0} is not supported'.format(el.tag))
+        elif parent.tag == MESSAGE:
+            self.root = soap.XMLDict(el.nsmap)
+            self.stack.append([el, self.root, None, self.index.size])
+
+    def _child(self, entry):
+        if entry[1] is None:
+            ns = entry[0].nsmap
+            parent = self.stack[-2][1] if len(self.stack) > 1 else None
+            if parent is not None and ns == parent.ns:
+                ns = parent.ns
+            entry[1] = soap.XMLDict(ns)
+
+    def _end(self, el):
+        if not self.stack or self.stack[-1][0] is not el:
+            return
+
+        el, d, reserved, start = self.stack.pop()
+        if d is not None:
+            d.index = self.index
+            d.span = (start, self.index.size)
+
+        if self.stack:
+            value = d if d is not None else el.text
+            self.stack[-1][1][el.tag] = value
+            values, i = reserved
+            values[i] = value
+
+        el.clear()
+        parent = el.getparent()
+        while el.getprevious() is not None:
+            del parent[0]
+
+
+def parse_stream(stream, length, chunk_size=8192):
+    parser = StreamParser()
+    head = []
+    while length > 0:
+        chunk = stream.read(min(chunk_size, length))
+        if not chunk:
+            break
+
+        if parser.operation is None:
+            head.append(chunk)
+        try:
+            parser.feed(chunk)
+        except UnsupportedOperation as e:
+            e.consumed = b''.join(head)
+            raise
+        length -= len(chunk)
+
+    return parser.close()
+
+
+class StreamingApplication(object):
+    def __init__(self, application, max_content_length=2 * 1024 * 1024,
+                 chunk_size=8192):
+        self.application = application
+        self.max_content_length = max_content_length
+        self.chunk_size = chunk_size
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            return self.application(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH') or '0')
+        if length > self.max_content_length:
+            return self._fault(start_response, '413 Request Entity Too Large',
+                               'Client', 'Request body is too long')
+
+        try:
+            root = self.parse(environ, length)
+        except UnsupportedOperation as e:
+            rest = environ['wsgi.input'].read(length - len(e.consumed))
+            environ['wsgi.input'] = BytesIO(e.consumed + rest)
+            return self.application(environ, start_response)
+        except (lxml.etree.XMLSyntaxError, StreamError) as e:
+            return self._fault(start_response, '500 Internal Server Error',
+                               'Client', str(e))
+
+        try:
+            self.store(root)
+        except Exception as e:
+            log.exception(e)
+            metrics.registry.incr('publiccommons_errors_total',
+                                  type=e.__class__.__name__)
+            return self._fault(start_response, '500 Internal Server Error',
+                               'Server', 'InternalError: An unknown error has occured.')
+
+        body = response(0)
+        start_response('200 OK', [('Content-Type', 'text/xml; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def parse(self, environ, length):
+        with soap.stage('stream_parse'):
+            return parse_stream(environ['wsgi.input'], length, self.chunk_size)
+
+    def prepare(self, root):
+        with soap.stage('extract'):
+            param = soap.extract(root)
+        return soap.prepare(param, root)
+
+    def store(self, root):
+        param = self.prepare(root)
+        with soap.stage('upsert'):
+            soap.upsert(param)
+
+    def _fault(self, start_response, status, code, string):
+        body = fault(code, string)
+        start_response(status, [('Content-Type', 'text/xml; charset=utf-8'),
+                                ('Content-Length', str(len(body)))])
+        return [body]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import fcntl
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Journal(object):
+    def __init__(self, path, fsync=True):
+        self.path = '{0}.{1}'.format(path, os.getpid())
+        self.pattern = '{0}.*'.format(path)
+        self.fsync = fsync
+        self.file = open(self.path, 'ab')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def rewrite(self, records):
+        # the new file is locked before it replaces the old one, so another
+        # process never recovers it
+        directory, name = os.path.split(self.path)
+        tmp = os.path.join(directory, '.{0}.tmp'.format(name))
+        f = open(tmp, 'wb')
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        self.file.close()
+        self.file = f
+
+    def recover(self):
+        records = []
+        for path in sorted(glob.glob(self.pattern)):
+            if path == self.path:
+                continue
+
+            with open(path, 'rb') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    continue
+
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        log.warning('skip broken journal record in %s', path)
+
+            os.remove(path)
+
+        return records
+
+    def close(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+def bulk_upsert(client, items):
+    records = []
+    for data, key, cmp in items:
+        res = client.search([{'key': key, 'value': data[key], 'pattern': 'cmp'}])
+        if not res['datalist']:
+            records.append(dict(data, id='-1'))
+            continue
+
+        old = res['datalist'][0]
+        if cmp is None or cmp(old, data):
+            records.append(dict(data, id=old['id']))
+
+    if records:
+        client.set(records)
+
+    return records
+
+
+class WriteBehindClient(object):
+    def __init__(self, client, batch_size=100, linger=0.5, max_pending=10000,
+                 timeout=5.0, journal=None, fsync=True, cmp=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.journal_path = journal
+        self.fsync = fsync
+        self.cmp = cmp
+        self.pending = OrderedDict()
+        self.writing = []
+        self.cond = threading.Condition()
+        # journal I/O is kept out of cond so that a slow fsync does not hold
+        # up other upserts and the writer thread
+        self.journal_lock = threading.Lock()
+        self.journal = None
+        self.thread = None
+        self.pid = None
+        self.closed = False
+
+    def upsert(self, data, key, cmp=None):
+        self._ensure_started()
+        with self.cond:
+            deadline = time.time() + self.timeout
+            while (len(self.pending) >= self.max_pending and
+                   (key, data[key]) not in self.pending):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise QueueFull('{0} documents are pending'.format(
+                        len(self.pending)))
+                self.cond.wait(remaining)
+
+            self._merge(data, key, cmp)
+            self.cond.notify_all()
+
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.append({'key': key, 'data': data})
+
+    def flush(self):
+        # stop at the first failure and leave the rest to the journal rather
+        # than retrying against an unavailable NC-KVS
+        while True:
+            with self.cond:
+                batch = self._take()
+            if not batch or not self._write(batch):
+                return
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        with self.journal_lock:
+            if self.journal is not None and not self.pending:
+                self.journal.close()
+                self.journal = None
+
+    def _merge(self, data, key, cmp, restore=False):
+        current = self.pending.get((key, data[key]))
+        if current is not None:
+            if cmp is None and restore:
+                return
+            if cmp is not None and not cmp(current[0], data):
+                return
+
+        self.pending[(key, data[key])] = (data, key, cmp)
+
+    def _take(self):
+        batch = []
+        while self.pending and len(batch) < self.batch_size:
+            batch.append(self.pending.popitem(last=False)[1])
+        if batch:
+            self.writing.append(batch)
+        self.cond.notify_all()
+        return batch
+
+    def _write(self, batch):
+        try:
+            bulk_upsert(self.client, batch)
+        except Exception as e:
+            log.exception(e)
+            with self.cond:
+                self.writing.remove(batch)
+                for data, key, cmp in batch:
+                    self._merge(data, key, cmp, restore=True)
+            return False
+
+        with self.journal_lock:
+            with self.cond:
+                self.writing.remove(batch)
+                items = list(self.pending.values())
+                for writing in self.writing:
+                    items.extend(writing)
+            if self.journal is not None:
+                # keep only what is still to be written after every batch, so
+                # that the journal does not grow under sustained load; an
+                # upsert merged after the snapshot appends after the rewrite
+                self.journal.rewrite({'key': key, 'data': data}
+                                     for data, key, cmp in items)
+        return True
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+
+        with self.cond:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            if self.journal_path:
+                self.journal = Journal(self.journal_path, self.fsync)
+                for record in self.journal.recover():
+                    self.journal.append(record)
+                    self._merge(record['data'], record['key'], self.cmp)
+
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        delay = self.linger
+        while True:
+            with self.cond:
+                started = time.time()
+                while not self.closed and len(self.pending) < self.batch_size:
+                    remaining = started + delay - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                if self.closed:
+                    return
+                batch = self._take()
+
+            if batch and not self._write(batch):
+                delay = min(delay * 2, 30.0)
+            else:
+                delay = self.linger
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import logging.config
 from ConfigParser import SafeConfigParser
 
 from nckvsclient import KVSClient
 
+from publiccommons.archive import TeeInput, ClosingIterator, BodyArchive, sampled
+
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -26,31 +29,226 @@ def search_config():
 
 
 class RequestLogger(object):
-    def __init__(self, application, logger_name='request.body'):
+    def __init__(self, application, logger_name='request.body', archive=None,
+                 sample_rate=1.0, max_size=None):
         self.application = application
         self.log = logging.getLogger(logger_name)
+        self.archive = archive
+        self.sample_rate = sample_rate
+        self.max_size = max_size
 
     def __call__(self, environ, start_response):
-        if environ['REQUEST_METHOD'] == 'POST':
-            length = int(environ.get('CONTENT_LENGTH', '0'))
-            body = StringIO(environ['wsgi.input'].read(length))
-            self.log.info(body.getvalue())
-            environ['wsgi.input'] = body
+        if environ['REQUEST_METHOD'] != 'POST':
+            return self.application(environ, start_response)
+
+        if self.archive is not None:
+            return self._tee(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH', '0'))
+        body = StringIO(environ['wsgi.input'].read(length))
+        self.log.info(body.getvalue())
+        environ['wsgi.input'] = body
 
         return self.application(environ, start_response)
 
+    def _tee(self, environ, start_response):
+        if not sampled(self.sample_rate):
+            return self.application(environ, start_response)
+
+        received = time.time()
+        tee = TeeInput(environ['wsgi.input'], self.max_size)
+        environ['wsgi.input'] = tee
+
+        def archive():
+            self.archive.put(tee.getvalue(), received=received,
+                             remote_addr=environ.get('REMOTE_ADDR'),
+                             length=tee.length, truncated=tee.truncated)
+
+        return ClosingIterator(self.application(environ, start_response),
+                               archive)
+
+
+def asbool(value):
+    return str(value).strip().lower() in ('true', 'yes', 'on', '1')
+
+
+def aslist(value, type_=str):
+    return [type_(v.strip()) for v in str(value).split(',') if v.strip()]
+
 
 config = search_config()
 logging.config.fileConfig(config)
 
 parser = SafeConfigParser()
 parser.read(config)
+settings = {}
+if parser.has_section('publiccommons'):
+    settings = dict(parser.items('publiccommons'))
+
 config = dict(parser.items('nckvs'))
 config['datatypeversion'] = int(config.get('datatypeversion', '1'))
-client = KVSClient(**config)
+rawdata_encoding = config.pop('rawdata_encoding', 'dict')
+kvs_pool = None
+kvs_retries = int(settings.get('kvs_retries', 2))
+kvs_retry_backoff = float(settings.get('kvs_retry_backoff', 0.1))
+if asbool(settings.get('kvs_pool', 'false')):
+    from publiccommons import pool
+    kvs_pool = pool.install(
+        size=int(settings.get('kvs_pool_size', 10)),
+        timeout=float(settings.get('kvs_timeout', 5.0)),
+        retries=kvs_retries, backoff=kvs_retry_backoff)
+
+if asbool(settings.get('kvs_lazy', 'false')):
+    from publiccommons.pool import LazyClient
+    client = LazyClient(KVSClient, **config)
+else:
+    client = KVSClient(**config)
+if kvs_pool is not None:
+    from publiccommons.pool import PooledClient, RetryingClient
+    client = PooledClient(client, kvs_pool)
+    if kvs_retries:
+        client = RetryingClient(client, retries=kvs_retries,
+                                backoff=kvs_retry_backoff)
+
+document_index = None
+if settings.get('index_path'):
+    from publiccommons.index import DocumentIndex, IndexingClient
+    document_index = DocumentIndex(settings['index_path'])
+    client = IndexingClient(client, document_index)
+
+if settings.get('spool'):
+    from publiccommons.soap import is_new_revision
+    from publiccommons.spool import SpoolClient
+    client = SpoolClient(
+        client, settings['spool'],
+        segment_size=int(settings.get('spool_segment_size', 64 * 1024 * 1024)),
+        fsync=settings.get('spool_fsync', 'interval'),
+        fsync_interval=float(settings.get('spool_fsync_interval', 1.0)),
+        max_failures=int(settings.get('spool_max_failures', 5)),
+        cmp=is_new_revision)
+
+if asbool(settings.get('write_behind', 'false')):
+    from publiccommons.soap import is_new_revision
+    from publiccommons.writebehind import WriteBehindClient
+    client = WriteBehindClient(
+        client,
+        batch_size=int(settings.get('write_behind_batch_size', 100)),
+        linger=float(settings.get('write_behind_linger', 0.5)),
+        max_pending=int(settings.get('write_behind_max_pending', 10000)),
+        timeout=float(settings.get('write_behind_timeout', 5.0)),
+        journal=settings.get('write_behind_journal') or None,
+        fsync=asbool(settings.get('write_behind_fsync', 'true')),
+        cmp=is_new_revision)
+
+if asbool(settings.get('revision_cache', 'false')):
+    from publiccommons.cache import LRUCache, SQLiteCache, RevisionCachingClient
+    size = int(settings.get('revision_cache_size', 10000))
+    ttl = float(settings.get('revision_cache_ttl', 0)) or None
+    if settings.get('revision_cache_path'):
+        revision_cache = SQLiteCache(settings['revision_cache_path'], size, ttl)
+    else:
+        revision_cache = LRUCache(size, ttl)
+    client = RevisionCachingClient(client, revision_cache)
 
 from publiccommons.soap import get_app
-application = RequestLogger(get_app(client))
+from publiccommons.rawdata import Codec
+application = get_app(
+    client, Codec(rawdata_encoding),
+    validation=settings.get('validation', 'full'),
+    sample_rate=float(settings.get('validation_sample_rate', 0.01)),
+    tree=settings.get('tree', 'dict'),
+    wsdl_url=settings.get('wsdl_url') or None)
+
+metrics_enabled = asbool(settings.get('metrics', 'false'))
+if metrics_enabled:
+    from publiccommons import metrics
+    metrics.configure(settings.get('metrics_dir') or None)
+    application = metrics.TimedApplication(application, 'spyne')
+
+if int(settings.get('ingest_processes', 0)):
+    from publiccommons.ingest import IngestPool, IngestApplication
+    max_content_length = int(settings.get('max_content_length', 2 * 1024 * 1024))
+    ingest_pool = IngestPool(
+        int(settings['ingest_processes']),
+        slots=int(settings.get('ingest_slots', 16)),
+        slot_size=max_content_length,
+        timeout=float(settings.get('ingest_timeout', 5.0)))
+    ingest_pool.start()
+    application = IngestApplication(application, ingest_pool,
+                                    max_content_length)
+elif asbool(settings.get('evented', 'false')):
+    from publiccommons.evented import EventedApplication
+    application = EventedApplication(
+        application,
+        max_content_length=int(settings.get('max_content_length', 2 * 1024 * 1024)),
+        chunk_size=int(settings.get('chunk_size', 8192)),
+        cpu_workers=int(settings.get('evented_cpu_workers', 4)))
+elif asbool(settings.get('streaming', 'false')):
+    from publiccommons.stream import StreamingApplication
+    application = StreamingApplication(
+        application,
+        max_content_length=int(settings.get('max_content_length', 2 * 1024 * 1024)),
+        chunk_size=int(settings.get('chunk_size', 8192)))
+
+if asbool(settings.get('admission', 'false')):
+    from publiccommons.admission import Lane, AdmissionMiddleware
+    lanes = [Lane(name, int(concurrency), queue_timeout, target or None)
+             for name, concurrency, queue_timeout, target in zip(
+                 ('urgent', 'actual', 'low'),
+                 aslist(settings.get('admission_concurrency', '8,4,1'), float),
+                 aslist(settings.get('admission_queue_timeout', '20,5,0'), float),
+                 aslist(settings.get('admission_target', '2,5,0'), float))]
+    application = AdmissionMiddleware(
+        application, lanes,
+        urgent_categories=aslist(settings.get('admission_urgent_categories',
+                                              'EvacuationOrder')),
+        max_content_length=int(settings.get('max_content_length', 2 * 1024 * 1024)),
+        retry_after=int(settings.get('admission_retry_after', 30)),
+        window=float(settings.get('admission_window', 10)),
+        evented=asbool(settings.get('evented', 'false')))
+
+if asbool(settings.get('dedupe', 'false')):
+    from publiccommons.cache import LRUCache, SQLiteCache
+    from publiccommons.dedupe import DedupeMiddleware
+    size = int(settings.get('dedupe_size', 10000))
+    ttl = float(settings.get('dedupe_ttl', 600)) or None
+    if settings.get('dedupe_path'):
+        dedupe_cache = SQLiteCache(settings['dedupe_path'], size, ttl,
+                                   table='dedupe')
+    else:
+        dedupe_cache = LRUCache(size, ttl)
+    application = DedupeMiddleware(
+        application, dedupe_cache,
+        max_content_length=int(settings.get('max_content_length', 2 * 1024 * 1024)))
+
+archive = None
+if settings.get('body_archive'):
+    archive = BodyArchive(
+        settings['body_archive'],
+        max_bytes=int(settings.get('body_archive_max_bytes', 64 * 1024 * 1024)),
+        backup_count=int(settings.get('body_archive_backup_count', 10)),
+        queue_size=int(settings.get('body_archive_queue_size', 1000)))
+
+if settings.get('profile_dir'):
+    from publiccommons.profiling import ProfilingMiddleware
+    profile_min_size = int(settings.get('profile_min_size', 0))
+    application = ProfilingMiddleware(
+        application, settings['profile_dir'],
+        enabled=asbool(settings.get('profile', 'false')),
+        sample_rate=float(settings.get('profile_sample_rate', 0.01)),
+        min_size=profile_min_size or None,
+        toggle_path=settings.get('profile_toggle') or None,
+        flush_interval=float(settings.get('profile_flush_interval', 60)),
+        trace_memory=asbool(settings.get('profile_memory', 'false')))
+
+application = RequestLogger(
+    application, archive=archive,
+    sample_rate=float(settings.get('body_archive_sample_rate', 1.0)),
+    max_size=int(settings.get('body_archive_max_size', 0)) or None)
+
+if metrics_enabled:
+    application = metrics.MetricsMiddleware(
+        application, settings.get('metrics_path', '/metrics'))
 
 if __name__ == '__main__':
     from wsgiref.simple_server import make_server
@@ -25,6 +25,10 @@ tests_require = requires + [
     'tox'
 ]
 
+extras_require = {
+    'evented': ['gevent']
+}
+
 dependency_links = [
     'https://github.com/tin-com/nckvs-client/tarball/develop#egg=nckvs-client-0.0.0dev',
 ]
@@ -42,9 +46,10 @@ setup(name='publiccommons',
       author_email='yoshihisa@iij.ad.jp',
       url='https://github.com/tin-com/publiccommons-py',
       keywords='web',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       include_package_data=True,
       zip_safe=False,
       dependency_links=dependency_links,
       install_requires=requires,
+      extras_require=extras_require,
       tests_require=tests_require)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from publiccommons import soap, cache
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+header = {'Content-Type': 'text/xml; charset=utf-8'}
+
+
+def load_soap(filename='soap1.xml'):
+    with open(os.path.join(data_dir, filename), 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def soap_globals(request):
+    saved = soap.nckvs, soap.codec, soap.parser
+
+    def restore():
+        soap.nckvs, soap.codec, soap.parser = saved
+    request.addfinalizer(restore)
+
+
+def pytest_funcarg__store(request):
+    if request.param == 'sqlite':
+        tmpdir = request.getfuncargvalue('tmpdir')
+        return cache.SQLiteCache(str(tmpdir.join('cache.db')), size=2, ttl=60)
+    return cache.LRUCache(size=2, ttl=60)
+
+
+def pytest_generate_tests(metafunc):
+    if 'store' in metafunc.funcargnames:
+        metafunc.parametrize('store', ['memory', 'sqlite'], indirect=True)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class MemoryKVS(object):
+    def __init__(self):
+        self.records = {}
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.searches = 0
+        self.sets = 0
+
+    def _index(self, key):
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = {}
+            for id_, record in self.records.items():
+                index.setdefault(record.get(key), set()).add(id_)
+        return index
+
+    def search(self, conditions):
+        with self.lock:
+            self.searches += 1
+            ids = None
+            for c in conditions:
+                found = self._index(c['key']).get(c['value'], set())
+                ids = found if ids is None else ids & found
+            found = [self.records[id_] for id_ in sorted(ids or ())]
+        return {'datalist': found}
+
+    def set(self, records):
+        with self.lock:
+            self.sets += 1
+            for record in records:
+                if record['id'] == '-1':
+                    record = dict(record, id=str(len(self.records) + 1))
+
+                old = self.records.get(record['id'])
+                for key, index in self.indexes.items():
+                    if old is not None:
+                        index.get(old.get(key), set()).discard(record['id'])
+                    index.setdefault(record.get(key), set()).add(record['id'])
+                self.records[record['id']] = record
+
+    def upsert(self, data, key, cmp=None):
+        res = self.search([{'key': key, 'value': data[key], 'pattern': 'cmp'}])
+        if not res['datalist']:
+            return self.set([dict(data, id='-1')])
+
+        old = res['datalist'][0]
+        if cmp is None or cmp(old, data):
+            return self.set([dict(data, id=old['id'])])
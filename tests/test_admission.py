@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+from mock import patch
+from webtest import TestApp
+
+from conftest import header, load_soap
+from publiccommons import soap, admission
+from publiccommons.admission import Lane, AdmissionMiddleware
+
+def envelope(status='Test', category='EvacuationOrder'):
+    return load_soap().replace(
+        b'distributionStatus>Test<', b'distributionStatus>' + status + b'<'
+    ).replace(b'<commons:category>EvacuationOrder<',
+              b'<commons:category>' + category + b'<')
+
+
+def lanes():
+    return [Lane('urgent', 1, 1.0, 0.5), Lane('actual', 1, 1.0, 1.0),
+            Lane('low', 1, 0.0)]
+
+
+def test_peek():
+    assert admission.peek(envelope()) == ('Test', 'EvacuationOrder')
+    assert admission.peek(envelope(b'Actual', b'Weather')) == \
+        ('Actual', 'Weather')
+    assert admission.peek(b'<Envelope/>') == (None, None)
+
+
+def test_classify():
+    middleware = AdmissionMiddleware(None)
+    assert middleware.classify('Actual', 'EvacuationOrder') == 0
+    assert middleware.classify('Actual', 'Weather') == 1
+    assert middleware.classify('Exercise', 'EvacuationOrder') == 2
+    assert middleware.classify(None, None) == 2
+
+
+@patch('publiccommons.soap.upsert')
+def test_publish(upsert):
+    middleware = AdmissionMiddleware(soap.get_app(None), lanes())
+    res = TestApp(middleware).post('/', envelope(b'Actual'), header)
+    assert res.status_int == 200
+    assert upsert.call_count == 1
+    urgent = middleware.lanes[0]
+    assert urgent.active == 0
+    assert urgent.latency > 0
+
+
+@patch('publiccommons.soap.upsert')
+def test_shed_on_latency(upsert):
+    middleware = AdmissionMiddleware(soap.get_app(None), lanes())
+    app = TestApp(middleware)
+    middleware.lanes[0].observe(2.0, middleware.alpha)
+
+    res = app.post('/', envelope(b'Actual', b'Weather'), header,
+                   status=503)
+    assert res.headers['Retry-After'] == '30'
+    assert b'Server.Busy' in res.body
+    assert b'urgent latency is above target' in res.body
+    app.post('/', envelope(), header, status=503)
+    assert upsert.call_count == 0
+
+    app.post('/', envelope(b'Actual'), header)
+    assert upsert.call_count == 1
+
+    # a breach is forgotten once the lane has been quiet for a window
+    middleware.lanes[0].observed -= middleware.window
+    app.post('/', envelope(), header)
+    assert upsert.call_count == 2
+
+
+def test_queue_full():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def application(environ, start_response):
+        started.set()
+        finish.wait(5)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    middleware = AdmissionMiddleware(application, lanes())
+    app = TestApp(middleware)
+    t = threading.Thread(target=app.post, args=('/', envelope()))
+    t.start()
+    started.wait(5)
+    res = app.post('/', envelope(), status=503)
+    assert b'low queue is full' in res.body
+    finish.set()
+    t.join()
+    assert app.post('/', envelope()).body == b'ok'
+
+
+def test_priority():
+    finish = threading.Event()
+    events = []
+
+    def application(environ, start_response):
+        status = admission.peek(environ['wsgi.input'].read())[0]
+        events.append('start ' + status)
+        if len(events) == 1:
+            finish.wait(5)
+        events.append('end ' + status)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    middleware = AdmissionMiddleware(application, [
+        Lane('urgent', 1, 5.0), Lane('actual', 1, 5.0), Lane('low', 1, 5.0)])
+    app = TestApp(middleware)
+
+    def post(status, category='EvacuationOrder'):
+        t = threading.Thread(target=app.post,
+                             args=('/', envelope(status, category)))
+        t.start()
+        return t
+
+    threads = [post(b'Actual')]
+    while not middleware.lanes[0].active:
+        time.sleep(0.001)
+    threads.append(post(b'Actual'))
+    while not middleware.lanes[0].waiting:
+        time.sleep(0.001)
+    # the low lane is free, but waits behind the urgent backlog
+    threads.append(post(b'Test'))
+    while not middleware.lanes[2].waiting:
+        time.sleep(0.001)
+    assert events == ['start Actual']
+    finish.set()
+    for t in threads:
+        t.join()
+    assert len(events) == 6
+    assert events[:2] == ['start Actual', 'end Actual']
+
+
+def test_evented():
+    gevent = pytest.importorskip('gevent')
+
+    def application(environ, start_response):
+        gevent.sleep(0.1)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    middleware = AdmissionMiddleware(application, [
+        Lane('urgent', 1, 2.0), Lane('actual', 1, 2.0), Lane('low', 1, 0.0)],
+        evented=True)
+    app = TestApp(middleware)
+    ticks = []
+
+    def tick():
+        while True:
+            ticks.append(time.time())
+            gevent.sleep(0.01)
+
+    ticker = gevent.spawn(tick)
+    started = time.time()
+    requests = [gevent.spawn(app.post, '/', envelope(b'Actual'))
+                for _ in range(3)]
+    gevent.joinall(requests, raise_error=True)
+    ticker.kill()
+
+    # queued requests wait without blocking the other greenlets
+    assert [r.value.status_int for r in requests] == [200] * 3
+    assert time.time() - started < 1.0
+    assert len(ticks) >= 20
+
+
+def test_passthrough():
+    middleware = AdmissionMiddleware(soap.get_app(None), lanes(),
+                                     max_content_length=10)
+    app = TestApp(middleware)
+    assert app.get('/?wsdl').status_int == 200
+    with patch('publiccommons.soap.upsert') as upsert:
+        app.post('/', envelope(), header)
+    assert upsert.call_count == 1
+    assert all(lane.latency is None for lane in middleware.lanes)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import json
+import time
+from io import BytesIO
+
+from mock import Mock, patch
+
+from publiccommons import archive
+
+BODY = u'<message>避難勧告</message>'.encode('utf-8')
+
+
+class TestTeeInput(object):
+    def test_read(self):
+        tee = archive.TeeInput(BytesIO(BODY))
+        assert tee.read(3) + tee.read() == BODY
+        assert tee.getvalue() == BODY
+        assert tee.length == len(BODY)
+        assert not tee.truncated
+
+    def test_readline(self):
+        tee = archive.TeeInput(BytesIO(b'a\nb\n'))
+        assert list(tee) == [b'a\n', b'b\n']
+        assert tee.getvalue() == b'a\nb\n'
+
+    def test_max_size(self):
+        tee = archive.TeeInput(BytesIO(BODY), max_size=4)
+        assert tee.read(3) + tee.read() == BODY
+        assert tee.getvalue() == BODY[:4]
+        assert tee.truncated
+
+
+def test_closing_iterator():
+    iterable = Mock()
+    callback = Mock()
+    archive.ClosingIterator(iterable, callback).close()
+    assert iterable.close.call_count == 1
+    assert callback.call_count == 1
+
+
+def test_sampled():
+    assert archive.sampled(1.0)
+    with patch('random.random', return_value=0.5):
+        assert archive.sampled(0.6)
+        assert not archive.sampled(0.4)
+
+
+class TestBodyArchive(object):
+    def read(self, path):
+        with gzip.open(path) as f:
+            return f.read().splitlines()
+
+    def test_put(self, tmpdir):
+        ar = archive.BodyArchive(str(tmpdir))
+        ar.put(BODY, length=len(BODY))
+        ar.close()
+
+        paths = os.listdir(str(tmpdir))
+        assert len(paths) == 1
+        header, body = self.read(str(tmpdir.join(paths[0])))
+        assert json.loads(header) == {'length': len(BODY), 'size': len(BODY)}
+        assert body == BODY
+
+    def test_truncated(self, tmpdir):
+        ar = archive.BodyArchive(str(tmpdir))
+        ar.put(BODY[:4], length=len(BODY), truncated=True)
+        ar.put(BODY, length=len(BODY), truncated=False)
+        ar.close()
+
+        path = str(tmpdir.join(os.listdir(str(tmpdir))[0]))
+        with gzip.open(path) as f:
+            for body in (BODY[:4], BODY):
+                meta = json.loads(f.readline())
+                assert meta['size'] == len(body)
+                assert f.read(meta['size'] + 1) == body + b'\n'
+
+    def test_rotate(self, tmpdir):
+        ar = archive.BodyArchive(str(tmpdir), max_bytes=1, backup_count=2)
+        with patch('time.strftime', side_effect=map(str, range(10))):
+            for i in range(4):
+                ar.put(BODY, n=i)
+            ar.close()
+
+        paths = sorted(os.listdir(str(tmpdir)))
+        assert len(paths) == 2
+        assert [json.loads(self.read(str(tmpdir.join(p)))[0])['n']
+                for p in paths] == [2, 3]
+
+    def test_rotate_other_workers(self, tmpdir):
+        other = tmpdir.join('body-0-{0}.gz'.format(os.getpid() + 1))
+        other.write(b'')
+        ar = archive.BodyArchive(str(tmpdir), max_bytes=1, backup_count=1)
+        with patch('time.strftime', side_effect=map(str, range(1, 10))):
+            for i in range(3):
+                ar.put(BODY, n=i)
+            ar.close()
+
+        assert sorted(os.listdir(str(tmpdir))) == [
+            other.basename, 'body-3-{0}.gz'.format(os.getpid())]
+
+    def test_flush_when_idle(self, tmpdir):
+        ar = archive.BodyArchive(str(tmpdir), flush_interval=0.01)
+        f = Mock()
+        ar._rotate = lambda: setattr(ar, 'file', f)
+        ar.queue.put((BODY, {}))
+        ar.queue.put((BODY, {}))
+        ar._ensure_started()
+        deadline = time.time() + 5
+        while f.flush.call_count == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        ar.close()
+        assert f.write.call_count == 4
+        assert f.flush.call_count == 1
+
+    def test_queue_full(self, tmpdir):
+        ar = archive.BodyArchive(str(tmpdir), queue_size=1)
+        ar._ensure_started = lambda: None
+        ar.put(BODY)
+        ar.put(BODY)
+        assert ar.dropped == 1
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from mock import Mock, patch
+
+from publiccommons import cache, metrics
+from publiccommons.soap import is_new_revision
+
+
+def test_get_set(store):
+    assert store.get('a') is None
+    store.set('a', '1')
+    assert store.get('a') == '1'
+    assert store.stats()['hits'] == 1
+    assert store.stats()['misses'] == 1
+
+
+def test_ttl(store):
+    store.set('a', '1')
+    with patch('time.time', return_value=10 ** 10):
+        assert store.get('a') is None
+
+
+def test_evict(store):
+    store.set('a', '1')
+    store.set('b', '1')
+    store.get('a')
+    store.set('c', '1')
+    if isinstance(store, cache.SQLiteCache):
+        store.evict()
+    assert store.get('a') == '1'
+    assert store.get('b') is None
+    assert store.stats()['size'] == 2
+
+
+def test_sqlite_shared(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    cache.SQLiteCache(path).set('a', '3')
+    assert cache.SQLiteCache(path).get('a') == '3'
+
+
+class TestRevisionCachingClient(object):
+    @patch.object(metrics, 'registry', metrics.Registry())
+    def test_skip_known_revision(self):
+        client = Mock()
+        caching = cache.RevisionCachingClient(client, cache.LRUCache())
+        data = {'document_id': 'a001', 'revision': '2'}
+        caching.upsert(data, 'document_id', cmp=is_new_revision)
+        caching.upsert(data, 'document_id', cmp=is_new_revision)
+        caching.upsert(dict(data, revision='1'), 'document_id',
+                       cmp=is_new_revision)
+        assert client.upsert.call_count == 1
+
+        caching.upsert(dict(data, revision='3'), 'document_id',
+                       cmp=is_new_revision)
+        assert client.upsert.call_count == 2
+        assert caching.cache.stats() == {'hits': 3, 'misses': 1, 'size': 1}
+        counters = metrics.registry.counters
+        assert counters['publiccommons_revision_cache_total',
+                        (('result', 'hit'),)] == 3
+        assert counters['publiccommons_revision_cache_total',
+                        (('result', 'miss'),)] == 1
+
+    def test_stale_not_cached(self):
+        client = Mock()
+        client.upsert.side_effect = lambda data, key, cmp: cmp(
+            {'id': 'a001', 'revision': '5'}, data)
+        caching = cache.RevisionCachingClient(client, cache.LRUCache())
+        data = {'document_id': 'a001', 'revision': '2'}
+        caching.upsert(data, 'document_id', cmp=is_new_revision)
+        assert caching.cache.get('a001') == '5'
+
+        client.upsert.side_effect = lambda data, key, cmp: cmp(
+            {'id': 'a001', 'revision': '5'}, data)
+        caching.upsert(dict(data, revision='6'), 'document_id',
+                       cmp=is_new_revision)
+        assert caching.cache.get('a001') == '6'
+
+    def test_error_not_cached(self):
+        client = Mock()
+        client.upsert.side_effect = IOError
+        caching = cache.RevisionCachingClient(client, cache.LRUCache())
+        data = {'document_id': 'a001', 'revision': '2'}
+        with pytest.raises(IOError):
+            caching.upsert(data, 'document_id', cmp=is_new_revision)
+        assert caching.cache.get('a001') is None
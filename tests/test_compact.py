@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import lxml.etree
+import pytest
+from mock import patch
+
+from memorykvs import MemoryKVS
+from publiccommons import soap, compact
+from benchmarks.synthetic import generate
+
+SAMPLES = ['sample1.xml', 'sample2.xml', 'sample3.xml', 'sample4.xml',
+           'sample5.xml', 'soap1.xml']
+TITLE = '{http://xml.publiccommons.ne.jp/pcxml1/informationBasis3/}Title'
+DOCUMENT_ID = '{http://xml.publiccommons.ne.jp/xml/edxl/}documentID'
+TARGET_AREA = '{http://xml.publiccommons.ne.jp/xml/edxl/}targetArea'
+
+
+def load_xml(filename):
+    xml = os.path.join(os.path.dirname(__file__), 'data', filename)
+    return lxml.etree.parse(xml).getroot()
+
+
+def to_dict(node):
+    return {k: to_dict(v) if isinstance(v, compact.Node) else v
+            for k, v in node.iteritems()}
+
+
+class TestNode(object):
+    def test_mapping(self):
+        root = compact.parse(load_xml('sample1.xml'))
+        assert TARGET_AREA in root
+        assert 'nothing' not in root
+        assert root[TARGET_AREA].ns is root.ns
+        assert root.get('nothing', 1) == 1
+        with pytest.raises(KeyError):
+            root['nothing']
+        assert len(root) == len(list(root)) == len(root.items())
+
+    def test_find(self):
+        root = compact.parse(load_xml('sample1.xml'))
+        assert root.find(TITLE) == u'加古川市: 避難勧告・指示情報　発令'
+        assert root.find('nothing') is None
+        assert root[TARGET_AREA].find(TITLE) is None
+        assert len(root.findall(DOCUMENT_ID)) == 2
+        assert root[TARGET_AREA].findall(DOCUMENT_ID) == []
+
+    def test_slots(self):
+        root = compact.parse(load_xml('sample1.xml'))
+        with pytest.raises(AttributeError):
+            root.foo = 1
+
+    def test_shares_document(self):
+        root = compact.parse(load_xml('sample1.xml'))
+        assert root[TARGET_AREA].doc is root.doc
+
+    def test_comment(self):
+        root = compact.parse(lxml.etree.fromstring('<a><!-- c --><b>1</b></a>'))
+        assert to_dict(root) == {'b': '1'}
+
+    def test_repeated_tags(self):
+        root = compact.parse(lxml.etree.fromstring(
+            '<a><b>1</b><c/><b><d>2</d></b></a>'))
+        assert to_dict(root) == {'b': {'d': '2'}, 'c': None}
+
+    def test_encode(self):
+        root = compact.parse(load_xml('sample1.xml'))
+        encoded = root.encode('utf-8')
+        assert encoded.find(TITLE) == '加古川市: 避難勧告・指示情報　発令'
+        assert to_dict(encoded) == soap.parse(
+            load_xml('sample1.xml')).encode('utf-8')
+
+
+@pytest.mark.parametrize('xml', SAMPLES)
+def test_parse(xml):
+    root = load_xml(xml)
+    assert to_dict(compact.parse(root)) == soap.parse(root)
+
+
+@pytest.mark.parametrize('xml', SAMPLES)
+def test_shorten(xml):
+    root = load_xml(xml)
+    assert compact.parse(root).shorten() == soap.parse(root).shorten()
+
+
+@pytest.mark.parametrize('variant', [3, 4])
+def test_shorten_synthetic(variant):
+    root = lxml.etree.fromstring(generate(areas=50, shelters=5,
+                                          variant=variant))
+    assert compact.parse(root).shorten() == soap.parse(root).shorten()
+
+
+@pytest.mark.parametrize('xml', ['sample1.xml', 'sample3.xml'])
+def test_extract(xml):
+    root = load_xml(xml)
+    assert soap.extract(compact.parse(root)) == soap.extract(root)
+
+
+@patch('publiccommons.soap.upsert')
+def test_publish(upsert):
+    soap.get_app(MemoryKVS(), tree='compact')
+    assert soap.parser is compact.parse
+    message = load_xml('sample1.xml')
+    soap._publish(message)
+    expected = soap.codec.encode(soap.parse(message).shorten())
+    assert upsert.call_args[0][0]['rawdata'] == expected
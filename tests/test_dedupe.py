@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from mock import patch
+from webtest import TestApp
+
+from conftest import header, load_soap
+from publiccommons import soap, cache, dedupe
+
+
+def test_message_key():
+    key = dedupe.message_key(load_soap())
+    assert key.startswith('5b5417ff-d928-4169-a7c7-bfed08eff483:')
+    assert key != dedupe.message_key(load_soap() + b' ')
+    assert dedupe.message_key(b'<Envelope/>') is None
+
+
+@patch('publiccommons.soap.upsert')
+def test_duplicate(upsert, store):
+    app = TestApp(dedupe.DedupeMiddleware(soap.get_app(None), store))
+    first = app.post('/', load_soap(), header)
+    second = app.post('/', load_soap(), header)
+    assert upsert.call_count == 1
+    assert second.status_int == 200
+    assert second.body == first.body
+    assert second.content_type == first.content_type
+
+
+@patch('publiccommons.soap.upsert')
+def test_changed_body(upsert, store):
+    app = TestApp(dedupe.DedupeMiddleware(soap.get_app(None), store))
+    app.post('/', load_soap(), header)
+    app.post('/', load_soap().replace(b'Test', b'Actual'), header)
+    assert upsert.call_count == 2
+
+
+def test_fault_not_cached(store):
+    app = TestApp(dedupe.DedupeMiddleware(soap.get_app(None), store))
+    with patch('publiccommons.soap.upsert', side_effect=ValueError) as upsert:
+        app.post('/', load_soap(), header, expect_errors=True)
+        res = app.post('/', load_soap(), header, expect_errors=True)
+    assert upsert.call_count == 2
+    assert res.status_int == 500
+
+
+@patch('publiccommons.soap.upsert')
+def test_too_long(upsert):
+    app = TestApp(dedupe.DedupeMiddleware(
+        soap.get_app(None), cache.LRUCache(), max_content_length=100))
+    app.post('/', load_soap(), header)
+    app.post('/', load_soap(), header)
+    assert upsert.call_count == 2
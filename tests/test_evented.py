@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from mock import patch
+from webtest import TestApp
+
+from conftest import header, load_soap
+from publiccommons import soap
+
+evented = pytest.importorskip('publiccommons.evented')
+
+
+def app():
+    return TestApp(evented.EventedApplication(soap.get_app(None),
+                                              cpu_workers=2))
+
+
+@patch('publiccommons.soap.upsert')
+def test_publish(upsert):
+    res = app().post('/', load_soap(), header)
+    assert res.status_int == 200
+    assert '<tns:code>0</tns:code>' in res.body
+    args, _ = upsert.call_args
+    assert args[0]['document_id'] == '74ee219a-970d-417f-a9ab-a9ff1d3fe316'
+    assert 'rawdata' in args[0]
+
+
+@patch('publiccommons.soap.upsert', side_effect=ValueError)
+def test_upsert_error(upsert):
+    res = app().post('/', load_soap(), header, expect_errors=True)
+    assert res.status_int == 500
+    assert 'soap11env:Server' in res.body
+
+
+@patch('publiccommons.soap.upsert')
+def test_publish_batch(upsert):
+    xml = load_soap().replace(b'pcsoap:publish', b'pcsoap:publishBatch')
+    res = app().post('/', xml, header)
+    assert 'publishBatchResponse' in res.body
+    assert upsert.call_count == 1
+
+
+def test_invalid_xml():
+    res = app().post('/', '<soap:Envelope', header, expect_errors=True)
+    assert res.status_int == 500
+    assert 'soap11env:Client' in res.body
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+from StringIO import StringIO
+
+import pytest
+from mock import Mock, patch
+
+from publiccommons import index
+from publiccommons.soap import is_new_revision
+
+
+def pytest_funcarg__docs(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    docs = index.DocumentIndex(str(tmpdir.join('index.db')))
+    docs.add(doc('a', 1, '282103'), updated=10)
+    docs.add(doc('a', 2, '282103', title=u'解除'), updated=20)
+    docs.add(doc('b', 1, '282200', category='Shelter'), updated=30)
+    docs.add(doc('c', 1, '131016', status='Exercise'), updated=40)
+    return docs
+
+
+def doc(document_id, revision, area_code, category='EvacuationOrder',
+        status='Actual', title=None):
+    return {'document_id': document_id, 'revision': str(revision),
+            'area_code': area_code, 'category': category, 'status': status,
+            'title': title, 'summary': '', 'rawdata': {}}
+
+
+class TestDocumentIndex(object):
+    def test_by_area(self, docs):
+        assert [(d['document_id'], d['revision'])
+                for d in docs.by_area('28')] == [('b', 1), ('a', 2)]
+        assert [d['document_id'] for d in docs.by_area('2821')] == ['a']
+        assert docs.by_area('29') == []
+        assert len(docs.by_area()) == 3
+        assert len(docs.by_area(limit=1)) == 1
+
+    def test_since(self, docs):
+        found = docs.since('EvacuationOrder', 15)
+        assert [(d['document_id'], d['title']) for d in found] == \
+            [('a', u'解除')]
+        assert docs.since('EvacuationOrder', 25) == []
+        assert [d['document_id'] for d in
+                docs.since('EvacuationOrder', 0, status='Exercise')] == ['c']
+
+    def test_history(self, docs):
+        assert [(d['revision'], d['updated'])
+                for d in docs.history('a')] == [(1, 10), (2, 20)]
+        assert docs.history('nothing') == []
+
+    def test_stale_revision(self, docs):
+        docs.add(doc('a', 1, '131016'), updated=50)
+        assert docs.by_area('2821')[0]['revision'] == 2
+        assert docs.stats() == {'documents': 3, 'revisions': 4}
+
+    def test_invalid_document(self, docs):
+        with pytest.raises(KeyError):
+            docs.add({'document_id': 'd'})
+        assert docs.stats() == {'documents': 3, 'revisions': 4}
+
+
+class TestIndexingClient(object):
+    def test_upsert(self, docs):
+        client = Mock()
+        client.search.side_effect = [
+            {'datalist': []},
+            {'datalist': [{'id': 'x', 'revision': '3'}]}]
+        indexing = index.IndexingClient(client, docs)
+        indexing.upsert(doc('e', 1, '282103'), 'document_id',
+                        cmp=is_new_revision)
+        indexing.upsert(doc('a', 2, '282103'), 'document_id',
+                        cmp=is_new_revision)
+        assert client.set.call_count == 1
+        assert [d['revision'] for d in docs.history('e')] == [1]
+        assert docs.stats()['revisions'] == 5
+
+    def test_set_error(self, docs):
+        client = Mock()
+        client.set.side_effect = IOError
+        with pytest.raises(IOError):
+            index.IndexingClient(client, docs).set([doc('e', 1, '282103')])
+        assert docs.history('e') == []
+
+    def test_index_error(self, docs):
+        client = Mock()
+        indexing = index.IndexingClient(client, docs)
+        with patch.object(docs, 'add', side_effect=sqlite3.OperationalError):
+            indexing.set([doc('e', 1, '282103')])
+        assert client.set.call_count == 1
+        indexing.set([dict(doc('f', 1, '282103'), revision='x'),
+                      doc('g', 1, '282103')])
+        assert docs.history('e') == docs.history('f') == []
+        assert [d['revision'] for d in docs.history('g')] == [1]
+
+
+def test_main(docs):
+    out = StringIO()
+    index.main([docs.path, 'history', 'a'], out)
+    assert [json.loads(line)['revision']
+            for line in out.getvalue().splitlines()] == [1, 2]
+
+    out = StringIO()
+    index.main([docs.path, 'stats'], out)
+    assert json.loads(out.getvalue()) == {'documents': 3, 'revisions': 4}
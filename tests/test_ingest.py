@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import multiprocessing
+
+import pytest
+from mock import patch
+from webtest import TestApp
+
+from conftest import header, load_soap
+from publiccommons import soap, ingest, metrics
+from benchmarks.synthetic import generate
+
+
+class QueueClient(object):
+    def __init__(self):
+        self.queue = multiprocessing.Queue()
+
+    def upsert(self, data, key, cmp=None):
+        self.queue.put((data[key], data['revision'], os.getpid()))
+
+
+def test_channel():
+    channel = ingest.Channel(slots=2, slot_size=16)
+    channel.put(b'a' * 16)
+    channel.put(b'b')
+    with pytest.raises(ingest.PoolBusy):
+        channel.put(b'c', timeout=0.01)
+    channel.put(b'd' * 17)
+    assert channel.get() == b'a' * 16
+    channel.put(b'c', timeout=0.01)
+    assert [channel.get() for _ in range(3)] == [b'b', b'd' * 17, b'c']
+    channel.stop()
+    assert channel.get() is None
+
+
+def test_route():
+    body = generate(document_id='doc-1')
+    assert ingest.route(body, 4) == ingest.route(generate(document_id='doc-1',
+                                                          revision=2), 4)
+    assert set(ingest.route(generate(document_id=str(i)), 4)
+               for i in range(20)) == set(range(4))
+
+
+@patch('publiccommons.soap.upsert')
+def test_process(upsert):
+    ingest.process(load_soap())
+    args, _ = upsert.call_args
+    assert args[0]['document_id'] == '74ee219a-970d-417f-a9ab-a9ff1d3fe316'
+    assert 'rawdata' in args[0]
+
+
+def test_pool_ordering():
+    client = QueueClient()
+    soap.get_app(client)
+    pool = ingest.IngestPool(3, slots=2, slot_size=64 * 1024)
+    pool.start()
+    try:
+        messages = [(str(i % 5), i // 5 + 1) for i in range(30)]
+        for document_id, revision in messages:
+            pool.submit(generate(document_id=document_id, revision=revision))
+    finally:
+        pool.close()
+
+    results = [client.queue.get(timeout=5) for _ in messages]
+    for document_id in set(d for d, _ in messages):
+        upserts = [(r, pid) for d, r, pid in results if d == document_id]
+        assert [r for r, _ in upserts] == [str(i) for i in range(1, 7)]
+        assert len(set(pid for _, pid in upserts)) == 1
+
+
+def submit_forked(pool, body):
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            pool.submit(body)
+            result = b'ok'
+        except Exception as e:
+            result = e.__class__.__name__
+        os.write(w, result)
+        os._exit(0)
+    os.close(w)
+    result = os.read(r, 64)
+    os.close(r)
+    os.waitpid(pid, 0)
+    return result
+
+
+def test_pool_forked():
+    client = QueueClient()
+    soap.get_app(client)
+    pool = ingest.IngestPool(1, slots=2, slot_size=64 * 1024)
+    pool.start()
+    try:
+        # like uWSGI workers forked from the master that started the pool
+        assert submit_forked(pool, generate(document_id='a')) == b'ok'
+        assert client.queue.get(timeout=5)[0] == 'a'
+    finally:
+        pool.close()
+
+    assert submit_forked(pool, generate(document_id='a')) == b'PoolBusy'
+
+
+def test_pool_reroute():
+    client = QueueClient()
+    soap.get_app(client)
+    pool = ingest.IngestPool(2, slots=2, slot_size=64 * 1024)
+    pool.start()
+    body = generate(document_id='a')
+    dead = pool.processes[ingest.route(body, 2)]
+    dead.terminate()
+    dead.join()
+    try:
+        with patch.object(metrics, 'registry', metrics.Registry()):
+            assert submit_forked(pool, body) == b'ok'
+            pool.submit(body)
+            assert metrics.registry.counters == {
+                ('publiccommons_ingest_rerouted_total', ()): 1}
+        assert [client.queue.get(timeout=5)[2] for _ in range(2)] == \
+            [p.pid for p in pool.processes if p is not dead] * 2
+    finally:
+        pool.close()
+
+
+def test_pool_metrics(tmpdir):
+    client = QueueClient()
+    soap.get_app(client)
+    pool = ingest.IngestPool(1, slots=2, slot_size=64 * 1024)
+    with patch.object(metrics, 'registry',
+                      metrics.Registry(str(tmpdir), flush_interval=60)):
+        pool.start()
+        try:
+            pool.submit(generate(document_id='a'))
+            client.queue.get(timeout=5)
+            path = tmpdir.join('metrics-{0}.json'.format(pool.processes[0].pid))
+            deadline = time.time() + 5
+            while not path.check() and time.time() < deadline:
+                time.sleep(0.01)
+            assert path.check()
+        finally:
+            pool.close()
+
+
+class TestIngestApplication(object):
+    def app(self, pool):
+        return TestApp(ingest.IngestApplication(soap.get_app(None), pool))
+
+    def test_publish(self):
+        with patch.object(ingest.IngestPool, 'submit') as submit:
+            res = self.app(ingest.IngestPool(1)).post('/', load_soap(), header)
+        assert res.status_int == 200
+        assert '<tns:code>0</tns:code>' in res.body
+        assert submit.call_args[0][0] == load_soap()
+
+    def test_busy(self):
+        with patch.object(ingest.IngestPool, 'submit',
+                          side_effect=ingest.PoolBusy('busy')):
+            res = self.app(ingest.IngestPool(1)).post(
+                '/', load_soap(), header, expect_errors=True)
+        assert res.status_int == 503
+        assert 'soap11env:Server' in res.body
+
+    @patch('publiccommons.soap.upsert')
+    def test_other_operation(self, upsert):
+        xml = load_soap().replace(b'pcsoap:publish', b'pcsoap:publishBatch')
+        with patch.object(ingest.IngestPool, 'submit') as submit:
+            res = self.app(ingest.IngestPool(1)).post('/', xml, header)
+        assert 'publishBatchResponse' in res.body
+        assert submit.call_count == 0
+        assert upsert.call_count == 1
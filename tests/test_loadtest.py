@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import patch
+from webtest import TestApp
+
+from publiccommons.archive import BodyArchive
+from benchmarks import loadtest
+from benchmarks.fakekvs import FakeKVSApplication
+
+BODY = b'<a>\n1\n</a>'
+
+
+def test_read_archive(tmpdir):
+    ar = BodyArchive(str(tmpdir))
+    ar.put(BODY, length=len(BODY))
+    ar.put(BODY[:3], length=len(BODY), truncated=True)
+    ar.put(b'<b/>', length=4)
+    ar.close()
+
+    # a truncated body cannot be replayed, but what follows it can
+    assert loadtest.load_messages([str(tmpdir)]) == [BODY, b'<b/>']
+
+
+def test_load_messages(tmpdir):
+    path = tmpdir.join('soap.xml')
+    path.write(BODY)
+    assert loadtest.load_messages([str(path), str(path)]) == [BODY, BODY]
+    assert len(loadtest.load_messages([], count=3)) == 3
+
+
+def test_summary():
+    windows = [
+        {'elapsed': 5.0, 'completed': 10, 'throughput': 2.0,
+         'errors': {'500': 1}, 'shed': 0, 'rss': 100 * 1048576, 'respawns': 0},
+        {'elapsed': 10.0, 'completed': 20, 'throughput': 4.0,
+         'errors': {'500': 1, 'reset': 2}, 'shed': 3,
+         'rss': 101 * 1048576, 'respawns': 1}
+    ]
+    result = loadtest.summary(windows, [0.01] * 30)
+    assert result['completed'] == 30
+    assert result['throughput'] == 3.0
+    assert result['peak_throughput'] == 4.0
+    assert result['errors'] == {'500': 2, 'reset': 2}
+    assert result['shed'] == 3
+    assert result['respawns'] == 1
+    assert result['rss_growth_mb_per_hour'] == 720.0
+    assert round(result['p99_ms'], 6) == 10.0
+
+
+class TestFakeKVSApplication(object):
+    def test_search_set(self):
+        app = TestApp(FakeKVSApplication())
+        app.post('/api/rest/set', json.dumps(
+            [{'id': '-1', 'document_id': 'a', 'revision': '1'}]))
+        res = app.post('/api/rest/search', json.dumps(
+            [{'key': 'document_id', 'value': 'a', 'pattern': 'cmp'}]))
+        assert res.json['datalist'][0]['revision'] == '1'
+
+    def test_error_rate(self):
+        app = TestApp(FakeKVSApplication(error_rate=1.0))
+        app.post('/search', '[]', status=500)
+
+    @patch('time.sleep')
+    def test_stall(self, sleep):
+        app = TestApp(FakeKVSApplication(latency=0.1, stall_rate=1.0,
+                                         stall=30.0))
+        app.post('/search', json.dumps(
+            [{'key': 'document_id', 'value': 'a', 'pattern': 'cmp'}]))
+        assert sleep.call_args[0][0] == 30.1
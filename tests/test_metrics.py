@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import lxml.etree
+from mock import patch
+from webtest import TestApp
+
+from publiccommons import metrics, soap
+
+
+def test_counter():
+    registry = metrics.Registry()
+    registry.incr('publiccommons_messages_total', category='Event',
+                  status='Actual')
+    registry.incr('publiccommons_messages_total', 2, category='Event',
+                  status='Actual')
+    text = registry.render()
+    assert '# TYPE publiccommons_messages_total counter' in text
+    assert 'publiccommons_messages_total{category="Event",status="Actual"} 3' in text
+
+
+def test_histogram():
+    registry = metrics.Registry(buckets=(0.1, 1.0))
+    registry.observe('publiccommons_stage_seconds', 0.05, stage='parse')
+    registry.observe('publiccommons_stage_seconds', 0.5, stage='parse')
+    lines = registry.render().splitlines()
+    assert 'publiccommons_stage_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'publiccommons_stage_seconds_bucket{stage="parse",le="1.0"} 2' in lines
+    assert 'publiccommons_stage_seconds_bucket{stage="parse",le="+Inf"} 2' in lines
+    assert 'publiccommons_stage_seconds_sum{stage="parse"} 0.55' in lines
+    assert 'publiccommons_stage_seconds_count{stage="parse"} 2' in lines
+
+
+def test_timer():
+    registry = metrics.Registry()
+    with patch('time.time', side_effect=[1.0, 1.25]):
+        with registry.timer('publiccommons_stage_seconds', stage='upsert'):
+            pass
+    assert registry.histograms.values()[0][-1] == 0.25
+
+
+def test_shared_directory(tmpdir):
+    r1 = metrics.Registry(str(tmpdir))
+    r2 = metrics.Registry()
+    r1.incr('publiccommons_errors_total')
+    r2.incr('publiccommons_errors_total', 2)
+    tmpdir.join('metrics-1.json').write(json.dumps(r2.snapshot()))
+    assert 'publiccommons_errors_total 3' in r1.render()
+    assert tmpdir.join('metrics-{0}.json'.format(os.getpid())).check()
+
+
+@patch('publiccommons.metrics.alive', side_effect=lambda pid: pid != 2)
+def test_retire_dead(alive, tmpdir):
+    r1 = metrics.Registry(str(tmpdir))
+    r2 = metrics.Registry()
+    r2.incr('publiccommons_errors_total', 2)
+    r2.observe('publiccommons_stage_seconds', 0.5, stage='parse')
+    for pid in (1, 2):
+        tmpdir.join('metrics-{0}.json'.format(pid)).write(
+            json.dumps(r2.snapshot()))
+    r1.incr('publiccommons_errors_total')
+    text = r1.render()
+    assert 'publiccommons_errors_total 5' in text
+    assert 'publiccommons_stage_seconds_count{stage="parse"} 2' in text
+    assert not tmpdir.join('metrics-2.json').check()
+    assert tmpdir.join('metrics-retired.json').check()
+    assert 'publiccommons_errors_total 5' in r1.render()
+
+
+def test_retire_reused_pid(tmpdir):
+    r1 = metrics.Registry(str(tmpdir))
+    r1.incr('publiccommons_errors_total', 2)
+    tmpdir.join('metrics-{0}.json'.format(os.getpid())).write(
+        json.dumps(r1.snapshot()))
+    r2 = metrics.Registry(str(tmpdir))
+    r2.incr('publiccommons_errors_total')
+    assert 'publiccommons_errors_total 3' in r2.render()
+
+
+def test_reset_after_fork():
+    registry = metrics.Registry()
+    registry.incr('publiccommons_errors_total')
+    registry.pid = -1
+    assert registry.snapshot()['counters'] == []
+
+
+@patch('publiccommons.soap.upsert')
+def test_publish_instrumented(upsert):
+    registry = metrics.configure()
+    xml = os.path.join(os.path.dirname(__file__), 'data', 'sample1.xml')
+    soap._publish(lxml.etree.parse(xml).getroot())
+    text = registry.render()
+    for stage in ('extract', 'parse', 'shorten', 'encode', 'upsert'):
+        assert 'publiccommons_stage_seconds_count{{stage="{0}"}} 1'.format(
+            stage) in text
+    assert 'publiccommons_messages_total{category="EvacuationOrder",status="Actual"} 1' in text
+
+
+def test_skipped_revision():
+    registry = metrics.configure()
+    assert not soap.is_new_revision({'revision': '2'}, {'revision': '1'})
+    assert 'publiccommons_upsert_skipped_total 1' in registry.render()
+
+
+class TestMetricsMiddleware(object):
+    def app(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['ok']
+
+    def test_endpoint(self):
+        metrics.configure()
+        app = TestApp(metrics.MetricsMiddleware(
+            metrics.TimedApplication(self.app, 'spyne')))
+        app.post('/', 'x')
+        res = app.get('/metrics')
+        assert res.content_type == 'text/plain'
+        assert 'publiccommons_http_requests_total{method="POST",status="200"} 1' in res.body
+        assert 'publiccommons_http_request_seconds_count{layer="spyne"} 1' in res.body
+        assert 'publiccommons_http_request_seconds_count{layer="wsgi"} 1' in res.body
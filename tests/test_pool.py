@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import httplib
+import urllib2
+import threading
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from mock import Mock, patch
+
+from publiccommons import pool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = '{0} {1}'.format(self.command, self.path)
+        self.send_response(404 if self.path == '/missing' else 200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def pytest_funcarg__server(request):
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return '127.0.0.1:{0}'.format(server.server_address[1])
+
+
+class TestConnectionPool(object):
+    def test_keep_alive(self, server):
+        p = pool.ConnectionPool('http', server)
+        for _ in range(3):
+            res, data = p.request('GET', '/a')
+            assert res.status == 200
+            assert data == 'GET /a'
+        stats = p.stats()
+        assert stats['created'] == 1
+        assert stats['reused'] == 2
+        assert stats['idle'] == 1
+
+    def test_connection_close(self, server):
+        p = pool.ConnectionPool('http', server)
+        p.request('GET', '/close')
+        p.request('GET', '/close')
+        assert p.stats()['created'] == 2
+        assert p.stats()['idle'] == 0
+
+    def test_size(self, server):
+        p = pool.ConnectionPool('http', server, size=1)
+        conns = [p._get()[0] for _ in range(2)]
+        for conn in conns:
+            p._put(conn)
+        assert p.stats()['discarded'] == 1
+
+    def test_stale_connection(self, server):
+        p = pool.ConnectionPool('http', server)
+        p.request('POST', '/a', 'x')
+        p.idle.queue[0].sock.shutdown(socket.SHUT_RDWR)
+        res, data = p.request('POST', '/b', 'x')
+        assert data == 'POST /b'
+        assert p.stats()['retries'] == 1
+
+    @patch('time.sleep')
+    def test_retry_idempotent(self, sleep):
+        p = pool.ConnectionPool('http', '127.0.0.1:1', retries=2, backoff=0.1)
+        with pytest.raises(socket.error):
+            p.request('GET', '/')
+        assert [c[0][0] for c in sleep.call_args_list] == [0.1, 0.2]
+        assert p.stats()['errors'] == 1
+
+    def stale(self, method, error):
+        p = pool.ConnectionPool('http', '127.0.0.1:1')
+        conn = Mock()
+        conn.getresponse.side_effect = error
+        with patch.object(p, '_get', return_value=(conn, True)):
+            with pytest.raises(type(error)):
+                p.request(method, '/', 'x')
+        return conn.request.call_count
+
+    @patch('time.sleep')
+    def test_stale_after_send(self, sleep):
+        # a POST the server may have received is never sent again
+        assert self.stale('POST', httplib.BadStatusLine('')) == 1
+        assert self.stale('GET', httplib.BadStatusLine('')) == 4
+
+    @patch('time.sleep')
+    def test_no_retry_timeout(self, sleep):
+        assert self.stale('GET', socket.timeout()) == 1
+        assert self.stale('POST', socket.timeout()) == 1
+
+    @patch('time.sleep')
+    def test_no_retry_post(self, sleep):
+        p = pool.ConnectionPool('http', '127.0.0.1:1')
+        with pytest.raises(socket.error):
+            p.request('POST', '/', 'x')
+        assert sleep.call_count == 0
+
+
+class TestPooledHandler(object):
+    def test_urlopen(self, server):
+        handler = pool.PooledHandler()
+        opener = urllib2.build_opener(handler)
+        url = 'http://{0}/a'.format(server)
+        assert opener.open(url).read() == 'GET /a'
+        assert opener.open(url, 'x').read() == 'POST /a'
+        stats = handler.stats()['http://' + server]
+        assert stats['created'] == 1
+        assert stats['reused'] == 1
+
+    def test_http_error(self, server):
+        opener = urllib2.build_opener(pool.PooledHandler())
+        with pytest.raises(urllib2.HTTPError) as e:
+            opener.open('http://{0}/missing'.format(server))
+        assert e.value.code == 404
+
+    @patch('os.getpid')
+    def test_fork(self, getpid, server):
+        getpid.return_value = 1
+        handler = pool.PooledHandler()
+        opener = urllib2.build_opener(handler)
+        opener.open('http://{0}/a'.format(server)).read()
+        getpid.return_value = 2
+        opener.open('http://{0}/a'.format(server)).read()
+        assert handler.stats()['http://' + server]['created'] == 1
+        assert handler.stats()['http://' + server]['reused'] == 0
+
+
+    def test_scoped(self, server):
+        handler = pool.PooledHandler(scoped=True)
+        opener = urllib2.build_opener(handler)
+        url = 'http://{0}/a'.format(server)
+        assert opener.open(url).read() == 'GET /a'
+        assert handler.stats() == {}
+        with handler.scope():
+            assert opener.open(url).read() == 'GET /a'
+        assert handler.stats()['http://' + server]['created'] == 1
+
+
+class TestPooledClient(object):
+    def test_scope(self, server):
+        handler = pool.PooledHandler(scoped=True)
+        opener = urllib2.build_opener(handler)
+        client = Mock()
+        client.search.side_effect = lambda conditions: opener.open(
+            'http://{0}/search'.format(server)).read()
+        with patch.object(pool.log, 'warning') as warning:
+            assert pool.PooledClient(client, handler).search([]) == \
+                'GET /search'
+        assert handler.stats()['http://' + server]['created'] == 1
+        assert warning.call_count == 0
+
+    def test_not_urllib2(self):
+        client = pool.PooledClient(Mock(), pool.PooledHandler(scoped=True))
+        with patch.object(pool.log, 'warning') as warning:
+            client.search([])
+            client.set([])
+        assert warning.call_count == 1
+
+
+class TestRetryingClient(object):
+    @patch('time.sleep')
+    def test_search(self, sleep):
+        client = Mock()
+        client.search.side_effect = [IOError, {'datalist': []}]
+        retrying = pool.RetryingClient(client, retries=2)
+        assert retrying.search([]) == {'datalist': []}
+        assert client.search.call_count == 2
+
+    @patch('time.sleep')
+    def test_search_gives_up(self, sleep):
+        client = Mock()
+        client.search.side_effect = IOError
+        with pytest.raises(IOError):
+            pool.RetryingClient(client, retries=2).search([])
+        assert client.search.call_count == 3
+
+    def test_set_not_retried(self):
+        client = Mock()
+        client.search.return_value = {'datalist': []}
+        client.set.side_effect = IOError
+        with pytest.raises(IOError):
+            pool.RetryingClient(client).upsert(
+                {'document_id': 'a', 'revision': '1'}, 'document_id')
+        assert client.set.call_count == 1
+
+
+class TestLazyClient(object):
+    def test_deferred(self):
+        factory = Mock()
+        client = pool.LazyClient(factory, url='http://kvs')
+        assert factory.call_count == 0
+        client.search([])
+        client.upsert({}, 'document_id', cmp=None)
+        assert factory.call_args_list == [((), {'url': 'http://kvs'})]
+        factory.return_value.upsert.assert_called_with(
+            {}, 'document_id', cmp=None)
+
+    @patch('os.getpid')
+    def test_fork(self, getpid):
+        factory = Mock()
+        client = pool.LazyClient(factory)
+        getpid.return_value = 1
+        client.set([])
+        client.set([])
+        getpid.return_value = 2
+        client.set([])
+        assert factory.call_count == 2
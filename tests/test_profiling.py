@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+import cProfile
+import pstats
+
+from mock import patch
+from webtest import TestApp
+
+from publiccommons import profiling
+
+
+def inner():
+    time.sleep(0.01)
+
+
+def outer():
+    inner()
+    inner()
+
+
+def application(environ, start_response):
+    outer()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['ok']
+
+
+def pytest_funcarg__middleware(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    return profiling.ProfilingMiddleware(application, str(tmpdir),
+                                         sample_rate=1.0, signum=None)
+
+
+def test_folded():
+    profile = cProfile.Profile()
+    profile.runcall(outer)
+    stacks = profiling.folded(pstats.Stats(profile))
+    key = 'test_profiling.py:outer;test_profiling.py:inner;<time.sleep>'
+    assert stacks[key] >= 0.02
+    assert all(not k.startswith('test_profiling.py:inner') for k in stacks)
+
+
+class TestProfilingMiddleware(object):
+    def test_disabled(self, middleware):
+        with patch('cProfile.Profile') as profile:
+            TestApp(middleware).post('/', 'x')
+        assert profile.call_count == 0
+
+    def test_profile(self, middleware, tmpdir):
+        middleware.enabled = True
+        app = TestApp(middleware)
+        assert app.post('/', 'x').body == 'ok'
+        app.post('/', 'x')
+        app.get('/')
+        assert middleware.profiled == 2
+
+        middleware.flush()
+        prefix = str(tmpdir.join('profile-{0}'.format(os.getpid())))
+        stats = pstats.Stats(prefix + '.pstats')
+        calls = [v[1] for k, v in stats.stats.items() if k[2] == 'inner']
+        assert calls == [4]
+        with open(prefix + '.folded') as f:
+            lines = f.read().splitlines()
+        assert any(line.startswith('test_profiling.py:application;'
+                                   'test_profiling.py:outer') for line in lines)
+        assert all(int(line.rpartition(' ')[2]) > 0 for line in lines)
+
+    def test_min_size(self, middleware):
+        middleware.enabled = True
+        middleware.sample_rate = 0.0
+        middleware.min_size = 3
+        app = TestApp(middleware)
+        app.post('/', 'xx')
+        app.post('/', 'xxx')
+        assert middleware.profiled == 1
+
+    def test_toggle_path(self, middleware, tmpdir):
+        toggle = tmpdir.join('toggle')
+        middleware.toggle_path = str(toggle)
+        assert not middleware.active()
+        toggle.write('')
+        assert not middleware.active()
+        middleware.checked = 0
+        assert middleware.active()
+
+    def test_flush_when_switched_off(self, middleware, tmpdir):
+        toggle = tmpdir.join('toggle')
+        toggle.write('')
+        middleware.toggle_path = str(toggle)
+        app = TestApp(middleware)
+        app.post('/', 'x')
+        pstats_path = tmpdir.join('profile-{0}.pstats'.format(os.getpid()))
+        assert not pstats_path.check()
+
+        # under uWSGI, by removing the toggle file
+        toggle.remove()
+        middleware.checked = 0
+        app.post('/', 'x')
+        assert pstats_path.check()
+        assert middleware.profiled == 1
+
+        middleware.toggle()
+        app.post('/', 'x')
+        pstats_path.remove()
+        middleware.toggle()
+        app.post('/', 'x')
+        assert pstats_path.check()
+        assert middleware.profiled == 2
+
+    def test_signal(self, tmpdir):
+        previous = signal.getsignal(signal.SIGUSR2)
+        try:
+            middleware = profiling.ProfilingMiddleware(application, str(tmpdir))
+            os.kill(os.getpid(), signal.SIGUSR2)
+            assert middleware.enabled
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
+
+    def test_flush_interval(self, middleware):
+        middleware.enabled = True
+        middleware.flush_interval = 0
+        with patch.object(middleware, 'flush') as flush:
+            TestApp(middleware).post('/', 'x')
+        assert flush.call_count == 1
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import lxml.etree
+import pytest
+
+from publiccommons import soap, rawdata
+
+
+def load_rawdata(filename):
+    xml = os.path.join(os.path.dirname(__file__), 'data', filename)
+    return soap.parse(lxml.etree.parse(xml).getroot()).shorten()
+
+
+def test_intern_keys():
+    d = {'edxlde:distributionID': 'x',
+         'commons:contentObject': {'pcx_ib:Title': u'タイトル'},
+         'Report': {'unknown:key': '1'}}
+    interned = rawdata.intern_keys(d)
+    assert interned == {'#edistributionID': 'x',
+                        '#ccontentObject': {'#iTitle': u'タイトル'},
+                        'Report': {'unknown:key': '1'}}
+    assert rawdata.extern_keys(interned) == d
+
+
+@pytest.mark.parametrize('name', [
+    'dict', 'dict+interned', 'json', 'json+interned', 'zlib', 'zlib+interned'
+])
+@pytest.mark.parametrize('filename', ['sample1.xml', 'sample3.xml'])
+def test_roundtrip(name, filename):
+    d = load_rawdata(filename)
+    codec = rawdata.Codec(name)
+    assert codec.decode(codec.encode(d)) == d
+    assert rawdata.decode(codec.encode(d)) == d
+
+
+def test_zlib_header():
+    encoded = rawdata.Codec('zlib').encode(load_rawdata('sample1.xml'))
+    assert encoded.startswith(rawdata.ZLIB_HEADER)
+
+
+def test_dict_is_identity():
+    d = load_rawdata('sample1.xml')
+    assert rawdata.Codec().encode(d) is d
+
+
+@pytest.mark.parametrize('name', ['xml', 'json+lz4'])
+def test_unknown(name):
+    with pytest.raises(ValueError):
+        rawdata.Codec(name)
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import copy
 import json
+import random
 from collections import OrderedDict
 
 import lxml.etree
 import pytest
 from mock import patch, call
+from webtest import TestApp
 
+from memorykvs import MemoryKVS
 from publiccommons import soap
 
 
@@ -152,6 +156,14 @@ class TestXMLDict(object):
         assert d.find('baz') == 3
         assert d.find('nothing') is None
 
+    def test_findall(self):
+        d = soap.XMLDict()
+        d['foo'] = 1
+        d['nest'] = soap.XMLDict()
+        d['nest']['foo'] = 2
+        assert sorted(d.findall('foo')) == [1, 2]
+        assert d.findall('nothing') == []
+
     def test_shorten(self):
         d1 = soap.XMLDict({'ns1': 'http://example.com/ns1'})
         d2 = soap.XMLDict(self.nsmap)
@@ -225,12 +237,137 @@ class TestShortXMLDict(object):
         assert d1['child']['text'] == 'nested'
 
 
+class TestNamespaces(object):
+    def test_cache(self):
+        namespaces = soap.Namespaces()
+        ns = dict(TestXMLDict.nsmap)
+        ns_, rns, names = namespaces.cache(ns)
+        assert ns_ is ns
+        assert rns == {'http://example.com/ns1': 'ns1',
+                       'http://example.com/ns2': 'ns2'}
+        assert namespaces.cache(ns)[2] is names
+        assert namespaces.cache(dict(ns))[2] is names
+        assert namespaces.cache(dict(ns, ns3='http://example.com/ns3'))[2] \
+            is not names
+
+    def test_resolve(self):
+        namespaces = soap.Namespaces()
+        rns = {'http://example.com/ns1': 'ns1', 'http://example.com/ns2': None}
+        assert namespaces.resolve(rns, '{http://example.com/ns1}foo') == 'ns1:foo'
+        assert namespaces.resolve(rns, '{http://example.com/ns2}foo') == 'foo'
+        assert namespaces.resolve(rns, '{http://example.com/ns3}foo') == 'foo'
+        assert namespaces.resolve(rns, 'foo') == 'foo'
+
+    def test_shorten_shares_namespaces(self):
+        root = soap.parse(load_xml('sample1.xml'))
+        target = root['{http://xml.publiccommons.ne.jp/xml/edxl/}targetArea']
+        assert target.ns is root.ns
+
+        short = root.shorten()
+        assert short['commons:targetArea'].names is short.names
+
+
 def test_parse(xmldict):
     assert soap.parse(load_xml('sample1.xml')) == xmldict[0]
     assert soap.parse(load_xml('sample2.xml')) == xmldict[1]
     assert soap.parse(load_xml('sample3.xml')) == xmldict[2]
 
 
+RANDOM_NS = ['http://example.com/ns1', 'http://example.com/ns2',
+             'http://example.com/ns3', soap.NS_MAP['commons']]
+
+
+def random_element(rnd, depth=0):
+    nsmap = {}
+    for i in range(rnd.randint(0, 2)):
+        prefix = rnd.choice([None, 'a', 'b', 'ns{0}'.format(i)])
+        nsmap[prefix] = rnd.choice(RANDOM_NS)
+    tag = '{{{0}}}{1}'.format(rnd.choice(RANDOM_NS),
+                              rnd.choice(['x', 'y']))
+    elem = lxml.etree.Element(tag, nsmap=nsmap)
+    for _ in range(rnd.randint(0, 4) if depth < 4 else 0):
+        kind = rnd.random()
+        if kind < 0.1:
+            elem.append(lxml.etree.Comment('c'))
+        elif kind < 0.5:
+            elem.append(random_element(rnd, depth + 1))
+        else:
+            child = lxml.etree.SubElement(elem, '{{{0}}}{1}'.format(
+                rnd.choice(RANDOM_NS), rnd.choice(['x', 'z'])))
+            child.text = rnd.choice([None, 'text', u'テキスト'])
+    return elem
+
+
+@pytest.mark.parametrize('encoding', [None, 'utf-8'])
+@pytest.mark.parametrize('xml', ['sample1.xml', 'sample2.xml', 'sample3.xml',
+                                 'sample4.xml', 'sample5.xml', 'soap1.xml'])
+def test_flatten(xml, encoding):
+    root = load_xml(xml)
+    short = soap.parse(root).shorten()
+    expected = short if encoding is None else short.encode(encoding)
+    flat = soap.flatten(root, encoding)
+    assert flat == expected
+    assert json.dumps(flat, sort_keys=True) == \
+        json.dumps(expected, sort_keys=True)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_flatten_random(seed):
+    root = random_element(random.Random(seed))
+    short = soap.parse(root).shorten()
+    assert soap.flatten(root) == short
+    assert soap.flatten(root, 'utf-8') == short.encode('utf-8')
+
+
+def test_flatten_shares_namespaces():
+    root = load_xml('sample1.xml')
+    namespaces = soap.Namespaces()
+    soap.flatten(root, namespaces=namespaces)
+    caches = dict(namespaces.caches)
+    soap.flatten(load_xml('sample1.xml'), namespaces=namespaces)
+    assert namespaces.caches == caches
+
+
+class TestField(object):
+    def test_call(self):
+        field = soap.Field('edxlde:distributionStatus')
+        assert field(load_xml('sample1.xml')) == 'Actual'
+
+    def test_fallback_path(self):
+        field = soap.Field('commons:nothing', 'commons:targetArea/commons:jisX0402')
+        assert field(load_xml('sample1.xml')) == '282103'
+
+    def test_default(self):
+        field = soap.Field('commons:nothing', default='')
+        assert field(load_xml('sample1.xml')) == ''
+
+    def test_required(self):
+        field = soap.Field('commons:nothing')
+        with pytest.raises(KeyError):
+            field(load_xml('sample1.xml'))
+
+    def test_repeated(self):
+        elem = load_xml('sample1.xml')
+        area = elem.find('commons:targetArea', soap.NS_MAP)
+        lxml.etree.SubElement(area, area[-1].tag).text = '999999'
+        field = soap.FIELDS['area_code']
+        assert field(elem) == '999999'
+        assert field(soap.parse(elem)) == '999999'
+
+
+@pytest.mark.parametrize('xml', ['sample1.xml', 'sample3.xml'])
+def test_extract(xml):
+    assert soap.extract(load_xml(xml)) == {
+        'status': 'Actual',
+        'document_id': '7e573043-fc3c-4a6b-bdb8-a9608233b0af',
+        'revision': '1',
+        'category': 'EvacuationOrder',
+        'area_code': '282103',
+        'title': u'加古川市: 避難勧告・指示情報　発令',
+        'summary': u'平成22年11月30日、A地区の土砂災害現場において避難勧告を行うこととしている基準雨量を超えたことによるもの（サンプル）'
+    }
+
+
 class TestMQService(object):
     @pytest.mark.parametrize(('xml', 'index'), [
         ('sample1.xml', 0), ('sample3.xml', 2)
@@ -256,6 +393,24 @@ class TestMQService(object):
             'rawdata': shortxmldict[index]
         }
 
+    @pytest.mark.parametrize('tree', ['compact', 'fused'])
+    @patch('publiccommons.soap.upsert')
+    def test_publish_tree(self, upsert, shortxmldict, tree):
+        soap.get_app(MemoryKVS(), tree=tree)
+        soap.MQService.publish(load_xml('sample3.xml'))
+        assert upsert.call_args[0][0]['rawdata'] == shortxmldict[2]
+
+    def test_wsdl_url(self):
+        app = soap.get_app(MemoryKVS(), wsdl_url='http://example.com/pc')
+        with patch.object(app.doc.wsdl11, 'build_interface_document') as build:
+            res = TestApp(app).get('/?wsdl')
+        assert build.call_count == 0
+        assert 'location="http://example.com/pc"' in res.body
+
+    def test_unknown_tree(self):
+        with pytest.raises(ValueError):
+            soap.get_app(MemoryKVS(), tree='nothing')
+
     @patch('publiccommons.soap.upsert')
     def test_publish_incomplete_data(self, upsert):
         message = load_xml('sample4.xml')
@@ -272,6 +427,120 @@ class TestMQService(object):
         assert args[0]['summary'] == ''
 
 
+def publish_body(*messages):
+    publish = lxml.etree.Element(soap.PUBLISH)
+    for message in messages:
+        lxml.etree.SubElement(publish, soap.MESSAGE).append(message)
+    return publish
+
+
+class TestPublishSoap11(object):
+    def protocol(self, validation, sample_rate=1.0):
+        app = soap.get_app(None, validation=validation, sample_rate=sample_rate)
+        return app.app.in_protocol
+
+    def test_unknown_validation(self):
+        with pytest.raises(ValueError):
+            soap.PublishSoap11('none')
+
+    def test_schema_cache(self):
+        assert self.protocol('full').validation_schema is \
+            self.protocol('envelope').validation_schema
+
+    @pytest.mark.parametrize('validation', ['full', 'envelope', 'sampled'])
+    def test_valid(self, validation):
+        self.protocol(validation).validate_document(
+            publish_body(load_xml('sample1.xml')))
+
+    def test_no_message(self):
+        with pytest.raises(soap.SchemaValidationError):
+            self.protocol('envelope').validate_document(publish_body())
+
+    def test_envelope_missing_field(self):
+        message = load_xml('sample1.xml')
+        status = message.find('edxlde:distributionStatus', soap.NS_MAP)
+        message.remove(status)
+        with pytest.raises(soap.SchemaValidationError) as e:
+            self.protocol('envelope').validate_document(publish_body(message))
+        assert 'distributionStatus' in str(e.value)
+
+    def test_envelope_skips_schema(self):
+        body = publish_body(load_xml('sample1.xml'))
+        lxml.etree.SubElement(body, '{%s}unknown' % soap.TARGET_NAMESPACE)
+        with pytest.raises(soap.SchemaValidationError):
+            self.protocol('full').validate_document(body)
+        self.protocol('envelope').validate_document(body)
+
+    @pytest.mark.parametrize(('rate', 'count'), [(0.0, 0), (1.0, 1)])
+    def test_sampled(self, rate, count):
+        protocol = self.protocol('sampled', rate)
+        with patch.object(protocol, 'validate_schema') as validate_schema:
+            protocol.validate_document(publish_body(load_xml('sample1.xml')))
+        assert validate_schema.call_count == count
+
+
+def revised(message, document_id=None, revision=None):
+    message = copy.deepcopy(message)
+    content = message.find(soap.CONTENT, soap.NS_MAP)
+    if document_id is not None:
+        content.find('commons:documentID', soap.NS_MAP).text = document_id
+    if revision is not None:
+        content.find('commons:documentRevision', soap.NS_MAP).text = revision
+    return message
+
+
+class TestPublishBatch(object):
+    @patch('publiccommons.soap.upsert')
+    def test_dedupe(self, upsert):
+        message = load_xml('sample1.xml')
+        messages = [revised(message, revision='2'),
+                    revised(message, document_id='other'),
+                    revised(message, revision='3'),
+                    revised(message, revision='1')]
+        res = soap.MQService.publishBatch(messages)
+        assert [r.code for r in res.responses] == [0, 0, 0, 0]
+        assert [(c[0][0]['document_id'], c[0][0]['revision'])
+                for c in upsert.call_args_list] == [
+            ('other', '1'),
+            ('7e573043-fc3c-4a6b-bdb8-a9608233b0af', '3')]
+
+    @patch('publiccommons.soap.upsert')
+    def test_invalid_message(self, upsert):
+        message = load_xml('sample1.xml')
+        invalid = revised(message, revision='x')
+        res = soap.MQService.publishBatch([invalid, message])
+        assert [r.code for r in res.responses] == [1, 0]
+        assert upsert.call_count == 1
+
+    def test_upsert_error(self):
+        message = load_xml('sample1.xml')
+        messages = [revised(message, revision='2'), message,
+                    revised(message, document_id='other')]
+        with patch('publiccommons.soap.upsert') as upsert:
+            upsert.side_effect = [ValueError, None]
+            res = soap.MQService.publishBatch(messages)
+        assert [r.code for r in res.responses] == [1, 1, 0]
+
+    def test_empty(self):
+        assert soap.MQService.publishBatch(None).responses == []
+
+    def test_wsgi(self):
+        kvs = MemoryKVS()
+        envelope = lxml.etree.parse(os.path.join(
+            os.path.dirname(__file__), 'data', 'soap1.xml')).getroot()
+        publish = envelope.find('.//' + soap.PUBLISH)
+        publish.tag = '{%s}publishBatch' % soap.TARGET_NAMESPACE
+        message = publish.find(soap.MESSAGE)[0]
+        lxml.etree.SubElement(publish, soap.MESSAGE).append(
+            revised(message, revision='2'))
+        app = TestApp(soap.get_app(kvs))
+        res = app.post('/', lxml.etree.tostring(envelope),
+                       {'Content-Type': 'text/xml; charset=utf-8'})
+        assert res.body.count('<tns:code>0</tns:code>') == 2
+        assert kvs.sets == 1
+        assert kvs.records.values()[0]['revision'] == '2'
+
+
 @pytest.mark.parametrize(('search_res', 'set_id'), [
     ([], '-1'),
     ([{'id': 'a001', 'revision': '0'}], 'a001'),
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import urllib2
+from StringIO import StringIO
+
+import pytest
+from mock import Mock, patch
+
+from memorykvs import MemoryKVS
+from publiccommons import spool, metrics
+from publiccommons.soap import is_new_revision
+
+
+def record(document_id, revision):
+    return {'key': 'document_id',
+            'data': {'document_id': document_id, 'revision': str(revision)}}
+
+
+def test_segment(tmpdir):
+    path = str(tmpdir.join('a.seg'))
+    segment = spool.Segment(path, 64)
+    assert segment.append(b'{"a":1}')
+    assert segment.append(b'{"b":2}')
+    assert not segment.append(b'x' * 64)
+    assert spool.is_active(path)
+    assert [r for _, r in spool.read_segment(path)] == [{'a': 1}, {'b': 2}]
+
+    segment.close()
+    assert not spool.is_active(path)
+    assert [r for _, r in spool.read_segment(path, 15)] == [{'b': 2}]
+
+
+def test_broken_record(tmpdir):
+    path = str(tmpdir.join('a.seg'))
+    segment = spool.Segment(path, 64)
+    segment.append(b'{"a":1}')
+    segment.append(b'{"b":2}')
+    segment.mm[25] = b'X'
+    segment.close()
+    assert [r for _, r in spool.read_segment(path)] == [{'a': 1}]
+
+
+def test_roll(tmpdir):
+    s = spool.Spool(str(tmpdir), segment_size=64)
+    for i in range(3):
+        s.append(record('a', i))
+    s.append({'big': 'x' * 100})
+    s.close()
+    names = spool.segment_names(str(tmpdir))
+    assert len(names) == 4
+    assert sum(1 for name in names
+               for _ in spool.read_segment(str(tmpdir.join(name)))) == 4
+
+
+def test_fsync_policy(tmpdir):
+    with pytest.raises(ValueError):
+        spool.Spool(str(tmpdir), fsync='sometimes')
+
+
+class TestReplayer(object):
+    def test_drain(self, tmpdir):
+        s = spool.Spool(str(tmpdir))
+        for document_id, revision in [('a', 1), ('b', 1), ('a', 3), ('a', 2)]:
+            s.append(record(document_id, revision))
+
+        kvs = MemoryKVS()
+        replayer = spool.Replayer(str(tmpdir), kvs, is_new_revision)
+        assert replayer.drain() == 4
+        assert sorted((r['document_id'], r['revision'])
+                      for r in kvs.records.values()) == [('a', '3'), ('b', '1')]
+
+        # the active segment is kept and resumed from the checkpoint
+        assert len(spool.segment_names(str(tmpdir))) == 1
+        assert replayer.drain() == 0
+        s.append(record('b', 2))
+        s.close()
+        assert replayer.drain() == 1
+        assert spool.segment_names(str(tmpdir)) == []
+        assert replayer.load_checkpoint() == {}
+
+    def test_failure_keeps_position(self, tmpdir):
+        s = spool.Spool(str(tmpdir))
+        s.append(record('a', 1))
+        s.append(record('b', 1))
+        s.close()
+
+        client = Mock()
+        client.upsert.side_effect = [None, IOError]
+        replayer = spool.Replayer(str(tmpdir), client)
+        with pytest.raises(IOError):
+            replayer.drain()
+
+        client.upsert.side_effect = None
+        assert replayer.drain() == 1
+        assert client.upsert.call_args[0][0]['document_id'] == 'b'
+
+    def test_reject(self, tmpdir):
+        s = spool.Spool(str(tmpdir))
+        s.append(record('a', 1))
+        s.append(record('b', 1))
+        s.close()
+
+        client = Mock()
+        # a connection error in between starts the count over
+        client.upsert.side_effect = [ValueError, IOError, ValueError,
+                                     ValueError, None]
+        replayer = spool.Replayer(str(tmpdir), client, max_failures=2)
+        with patch.object(metrics, 'registry', metrics.Registry()):
+            for _ in range(3):
+                with pytest.raises((ValueError, IOError)):
+                    replayer.drain()
+            assert replayer.drain() == 1
+            assert metrics.registry.counters == {
+                ('publiccommons_spool_records_total',
+                 (('event', 'replayed'),)): 1,
+                ('publiccommons_spool_records_total',
+                 (('event', 'rejected'),)): 1}
+
+        assert client.upsert.call_args[0][0]['document_id'] == 'b'
+        assert spool.segment_names(str(tmpdir)) == []
+        rejected = str(tmpdir.join(spool.REJECTED))
+        assert [r for name in spool.segment_names(rejected)
+                for _, r in spool.read_segment(os.path.join(rejected, name))] \
+            == [record('a', 1)]
+
+    def test_unavailable(self):
+        assert spool.unavailable(IOError())
+        assert spool.unavailable(urllib2.HTTPError('', 503, '', {}, None))
+        assert not spool.unavailable(urllib2.HTTPError('', 400, '', {}, None))
+        assert not spool.unavailable(ValueError())
+
+    def test_single_replayer(self, tmpdir):
+        first = spool.Replayer(str(tmpdir), None)
+        second = spool.Replayer(str(tmpdir), None)
+        assert first.acquire()
+        assert not second.acquire()
+        first.release()
+        assert second.acquire()
+
+
+def test_sync(tmpdir):
+    s = spool.Spool(str(tmpdir), fsync_interval=0)
+    s.append(record('a', 1))
+    s.fsync_interval = 60
+    s.append(record('a', 2))
+    with patch.object(spool.Segment, 'flush') as flush:
+        s.sync()
+        assert flush.call_count == 0
+        s.fsync_interval = 0
+        s.sync()
+        s.sync()
+        assert flush.call_count == 1
+    s.close()
+
+
+def test_spool_client(tmpdir):
+    kvs = MemoryKVS()
+    client = spool.SpoolClient(kvs, str(tmpdir.join('spool')), poll=0.01,
+                               cmp=is_new_revision)
+    client.upsert({'document_id': 'a', 'revision': '1'}, 'document_id')
+    deadline = time.time() + 5
+    while not kvs.records and time.time() < deadline:
+        time.sleep(0.01)
+    client.close()
+    assert kvs.records.values()[0]['revision'] == '1'
+
+
+def test_cli(tmpdir):
+    s = spool.Spool(str(tmpdir))
+    s.append(record('a', 1))
+    s.append(record('a', 2))
+    s.close()
+    name = spool.segment_names(str(tmpdir))[0]
+    size = os.path.getsize(str(tmpdir.join(name)))
+
+    out = StringIO()
+    spool.main([str(tmpdir), 'list'], out)
+    assert out.getvalue() == '{0}\t{1}\t2\t2\tclosed\n'.format(name, size)
+
+    out = StringIO()
+    spool.main([str(tmpdir), 'show', name], out)
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+        record('a', 1), record('a', 2)]
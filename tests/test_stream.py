@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from io import BytesIO
+
+import lxml.etree
+import pytest
+from mock import patch
+from webtest import TestApp
+
+from conftest import header, load_soap
+from publiccommons import soap, stream
+
+
+def load_message(filename='soap1.xml'):
+    envelope = lxml.etree.fromstring(load_soap(filename))
+    return envelope.find('.//{%s}message' % soap.TARGET_NAMESPACE)[0]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 8192])
+def test_parse_stream(chunk_size):
+    xml = load_soap()
+    root = stream.parse_stream(BytesIO(xml), len(xml), chunk_size)
+    message = load_message()
+    assert root == soap.parse(message)
+    assert soap.extract(root) == soap.extract(message)
+    assert root.shorten() == soap.parse(message).shorten()
+
+
+def test_find_indexed():
+    xml = load_soap()
+    root = stream.parse_stream(BytesIO(xml), len(xml))
+    title = '{http://xml.publiccommons.ne.jp/pcxml1/informationBasis3/}Title'
+    doc_id = '{http://xml.publiccommons.ne.jp/xml/edxl/}documentID'
+    assert root.find(title) == soap.parse(load_message()).find(title)
+    assert root.find('nothing') is None
+
+    target = root['{http://xml.publiccommons.ne.jp/xml/edxl/}targetArea']
+    assert target.index is root.index
+    assert target.find(title) is None
+    assert len(root.findall(doc_id)) == 2
+    assert target.findall(doc_id) == []
+
+
+def test_parse_stream_not_publish():
+    xml = load_soap().replace(b'pcsoap:publish', b'pcsoap:subscribe')
+    with pytest.raises(stream.UnsupportedOperation) as e:
+        stream.parse_stream(BytesIO(xml), len(xml), 100)
+    assert xml.startswith(e.value.consumed)
+
+
+def test_parse_stream_syntax_error():
+    xml = load_soap()[:-100]
+    with pytest.raises(lxml.etree.XMLSyntaxError):
+        stream.parse_stream(BytesIO(xml), len(xml))
+
+
+class TestStreamingApplication(object):
+    def app(self, **kwargs):
+        app = stream.StreamingApplication(soap.get_app(None), **kwargs)
+        return TestApp(app)
+
+    @patch('publiccommons.soap.upsert')
+    def test_publish(self, upsert):
+        res = self.app(chunk_size=7).post('/', load_soap(), header)
+        assert res.status_int == 200
+        assert '<tns:code>0</tns:code>' in res.body
+
+        message = load_message()
+        param = soap.extract(message)
+        param['rawdata'] = soap.parse(message).shorten()
+        args, _ = upsert.call_args
+        assert args[0] == param
+
+    @patch('publiccommons.soap.upsert')
+    def test_too_long(self, upsert):
+        res = self.app(max_content_length=100).post(
+            '/', load_soap(), header, expect_errors=True)
+        assert res.status_int == 413
+        assert 'soap11env:Client' in res.body
+        assert upsert.call_count == 0
+
+    @patch('publiccommons.soap.upsert')
+    def test_invalid_xml(self, upsert):
+        res = self.app().post('/', '<soap:Envelope', header,
+                              expect_errors=True)
+        assert res.status_int == 500
+        assert 'soap11env:Client' in res.body
+
+    @patch('publiccommons.soap.upsert', side_effect=ValueError)
+    def test_upsert_error(self, upsert):
+        res = self.app().post('/', load_soap(), header,
+                              expect_errors=True)
+        assert res.status_int == 500
+        assert 'soap11env:Server' in res.body
+
+    def test_wsdl(self):
+        res = self.app().get('/?wsdl')
+        assert res.status_int == 200
+        assert 'publish' in res.body
+
+    @patch('publiccommons.soap.upsert')
+    def test_publish_batch(self, upsert):
+        xml = load_soap().replace(b'pcsoap:publish', b'pcsoap:publishBatch')
+        res = self.app(chunk_size=100).post('/', xml, header)
+        assert res.status_int == 200
+        assert 'publishBatchResponse' in res.body
+        assert upsert.call_count == 1
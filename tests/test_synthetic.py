@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import lxml.etree
+import pytest
+
+from memorykvs import MemoryKVS
+from publiccommons import soap
+from benchmarks import synthetic
+
+
+def message(xml):
+    envelope = lxml.etree.fromstring(xml)
+    return envelope.find('.//{%s}message' % soap.TARGET_NAMESPACE)[0]
+
+
+@pytest.mark.parametrize('variant', [3, 4])
+def test_generate(variant):
+    xml = synthetic.generate(areas=5, shelters=3, body_length=300,
+                             variant=variant, document_id='d1', revision=2)
+    param = soap.extract(message(xml))
+    assert param['document_id'] == 'd1'
+    assert param['revision'] == '2'
+    assert param['area_code'] == '131016'
+    assert len(param['summary']) == 300
+    assert param['title']
+
+
+def test_stream():
+    xmls = list(synthetic.stream(10, documents=3))
+    params = [soap.extract(message(xml)) for xml in xmls]
+    assert len(set(p['document_id'] for p in params)) <= 3
+    assert xmls == list(synthetic.stream(10, documents=3))
+
+
+def test_memory_kvs():
+    kvs = MemoryKVS()
+    kvs.upsert({'document_id': 'a', 'revision': '1'}, 'document_id',
+               cmp=soap.is_new_revision)
+    kvs.upsert({'document_id': 'a', 'revision': '2'}, 'document_id',
+               cmp=soap.is_new_revision)
+    kvs.upsert({'document_id': 'a', 'revision': '1'}, 'document_id',
+               cmp=soap.is_new_revision)
+    res = kvs.search([{'key': 'document_id', 'value': 'a'}])
+    assert [r['revision'] for r in res['datalist']] == ['2']
+    assert kvs.sets == 2
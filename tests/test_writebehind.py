@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import pytest
+from mock import Mock, call
+
+from publiccommons import writebehind
+from publiccommons.soap import is_new_revision
+
+
+def make_client(datalist=None):
+    client = Mock()
+    client.search.return_value = {'datalist': datalist or []}
+    return client
+
+
+def doc(document_id, revision):
+    return {'document_id': document_id, 'revision': str(revision)}
+
+
+def test_bulk_upsert():
+    client = make_client([{'id': 'a001', 'revision': '1'}])
+    items = [(doc('a', 2), 'document_id', is_new_revision),
+             (doc('b', 1), 'document_id', is_new_revision)]
+    writebehind.bulk_upsert(client, items)
+    assert client.search.call_args_list == [
+        call([{'key': 'document_id', 'value': 'a', 'pattern': 'cmp'}]),
+        call([{'key': 'document_id', 'value': 'b', 'pattern': 'cmp'}])
+    ]
+    assert client.set.call_args == call([dict(doc('a', 2), id='a001')])
+
+
+def test_bulk_upsert_new():
+    client = make_client()
+    writebehind.bulk_upsert(client, [(doc('a', 1), 'document_id', None)])
+    assert client.set.call_args == call([dict(doc('a', 1), id='-1')])
+
+
+class TestWriteBehindClient(object):
+    def make(self, client, **kwargs):
+        wb = writebehind.WriteBehindClient(client, **kwargs)
+        wb._ensure_started = lambda: None
+        return wb
+
+    def test_coalesce(self):
+        client = make_client()
+        wb = self.make(client)
+        wb.upsert(doc('a', 2), 'document_id', cmp=is_new_revision)
+        wb.upsert(doc('a', 1), 'document_id', cmp=is_new_revision)
+        wb.upsert(doc('b', 1), 'document_id', cmp=is_new_revision)
+        wb.upsert(doc('a', 3), 'document_id', cmp=is_new_revision)
+        wb.flush()
+        assert client.set.call_count == 1
+        assert client.set.call_args == call([dict(doc('a', 3), id='-1'),
+                                             dict(doc('b', 1), id='-1')])
+
+    def test_batch_size(self):
+        client = make_client()
+        wb = self.make(client, batch_size=2)
+        for i in range(5):
+            wb.upsert(doc(str(i), 1), 'document_id', cmp=is_new_revision)
+        wb.flush()
+        assert [len(args[0]) for args, _ in client.set.call_args_list] == [2, 2, 1]
+
+    def test_back_pressure(self):
+        wb = self.make(make_client(), max_pending=1, timeout=0.01)
+        wb.upsert(doc('a', 1), 'document_id', cmp=is_new_revision)
+        wb.upsert(doc('a', 2), 'document_id', cmp=is_new_revision)
+        with pytest.raises(writebehind.QueueFull):
+            wb.upsert(doc('b', 1), 'document_id', cmp=is_new_revision)
+
+    def test_write_error_keeps_pending(self):
+        client = make_client()
+        client.set.side_effect = IOError
+        wb = self.make(client)
+        wb.upsert(doc('a', 1), 'document_id', cmp=is_new_revision)
+        with wb.cond:
+            batch = wb._take()
+        assert not wb._write(batch)
+        assert list(wb.pending) == [('document_id', 'a')]
+
+    def test_thread(self):
+        client = make_client()
+        wb = writebehind.WriteBehindClient(client, linger=0.01)
+        wb.upsert(doc('a', 1), 'document_id', cmp=is_new_revision)
+        wb.close()
+        assert client.set.call_args == call([dict(doc('a', 1), id='-1')])
+
+
+class TestJournal(object):
+    def test_recover(self, tmpdir):
+        path = str(tmpdir.join('journal'))
+        with open('{0}.{1}'.format(path, 1), 'w') as f:
+            f.write(json.dumps({'key': 'document_id', 'data': doc('a', 1)}) + '\n')
+            f.write('broken\n')
+
+        journal = writebehind.Journal(path)
+        assert journal.recover() == [{'key': 'document_id',
+                                      'data': doc('a', 1)}]
+        assert os.listdir(str(tmpdir)) == [os.path.basename(journal.path)]
+
+    def test_replay(self, tmpdir):
+        path = str(tmpdir.join('journal'))
+        with open('{0}.{1}'.format(path, 1), 'w') as f:
+            f.write(json.dumps({'key': 'document_id', 'data': doc('a', 1)}) + '\n')
+
+        client = make_client()
+        wb = writebehind.WriteBehindClient(client, journal=path, fsync=False,
+                                           cmp=is_new_revision)
+        wb._ensure_started()
+        wb.close()
+        assert client.set.call_args == call([dict(doc('a', 1), id='-1')])
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_compact(self, tmpdir):
+        path = str(tmpdir.join('journal'))
+        wb = writebehind.WriteBehindClient(make_client(), batch_size=2,
+                                           linger=60, journal=path,
+                                           fsync=False, cmp=is_new_revision)
+        wb._ensure_started()
+        wb.closed = True
+        for i in range(3):
+            wb.upsert(doc('a', i + 1), 'document_id', is_new_revision)
+            wb.upsert(doc(str(i), 1), 'document_id', is_new_revision)
+        with open(wb.journal.path) as f:
+            assert len(f.readlines()) == 6
+
+        with wb.cond:
+            batch = wb._take()
+        wb._write(batch)
+        with open(wb.journal.path) as f:
+            assert [json.loads(line)['data'] for line in f] == [
+                doc('1', 1), doc('2', 1)]
+        assert os.listdir(str(tmpdir)) == [os.path.basename(wb.journal.path)]
+        wb.close()
+
+    def test_close_unavailable(self, tmpdir):
+        path = str(tmpdir.join('journal'))
+        client = make_client()
+        client.search.side_effect = IOError
+        wb = writebehind.WriteBehindClient(client, batch_size=1, linger=60,
+                                           journal=path, fsync=False,
+                                           cmp=is_new_revision)
+        wb._ensure_started()
+        wb.closed = True
+        wb.upsert(doc('a', 1), 'document_id', is_new_revision)
+        wb.upsert(doc('b', 1), 'document_id', is_new_revision)
+        wb.close()
+        assert client.search.call_count == 1
+        assert sorted(wb.pending) == [('document_id', 'a'),
+                                      ('document_id', 'b')]
+        with open(wb.journal.path) as f:
+            assert len(f.readlines()) == 2